@@ -2,14 +2,36 @@ from flask import Flask, request, jsonify
 from urllib.parse import urlparse, urlunparse
 
 from flask_cors import CORS
-import requests
-import ifcopenshell
-import ifcopenshell.guid
 import os
 import logging
-import urllib.parse
 import json
+import re
 import time
+from array import array
+
+from aps_client import APS_BASE_URL, AccessDenied, ApsClient
+from downloader import download_file_ranged
+from export_stream import CountingWriter, LocalFileSink, export_to_sink
+from jobs import JobManager
+from metrics import MetricsRegistry, RequestMetrics, profiled
+from model_cache import ModelCache, open_ifc_model
+from patch_writer import StepIndexError, copy_range, stream_patched
+from payload import PayloadError, normalize_update_payload, read_update_payload
+from rules import RuleError, compile_rules, evaluate_rules, get_product_materials
+from style_snapshot import StyleSnapshot, assign_element_colors, count_changed_elements
+from styles import (
+    build_style_cache,
+    build_styled_item_index,
+    get_or_create_presentation_style,
+    get_representation_context,
+    hex_to_rgb,
+    isValidHex,
+    normalize_rgb,
+    purge_styles,
+)
+from styling_engine import DEFAULT_STRATEGY, STRATEGIES, StylingEngine
+from uploader import MultipartUploadError, MultipartUploadStream, upload_file_multipart
+from workspace import Workspace
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -17,24 +39,69 @@ CORS(app)  # Enable CORS for all routes
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-
-def download_ifc_file(project, version, access_token, local_file_path):
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/vnd.api+json'
-    }
-
-    # Encode the version ID
-    encoded_version_id = urllib.parse.quote(version, safe='')
-
-    # Get the version details
-    url = f"https://developer.api.autodesk.com/data/v1/projects/{project}/versions/{encoded_version_id}"
-
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        raise Exception(f"Failed to get version details: {response.status_code} - {response.text}")
-
-    version_details = response.json()
+# Parse only the entities the color pipeline reads; set IFC_LAZY_PARSE=0 for full parses
+lazy_parsing = os.environ.get('IFC_LAZY_PARSE', '1') != '0'
+
+# Write saves by splicing changed entities into the downloaded file; set IFC_PATCH_WRITER=0 to rewrite fully
+patch_writing = os.environ.get('IFC_PATCH_WRITER', '1') != '0'
+
+# Keep the styling of a save on the cached model and only restyle what the next save changes; set IFC_DIFF_SAVES=0 to restyle fully.
+# Kept styling is restyled fully once it spans IFC_DIFF_SAVE_MAX_SAVES saves or IFC_DIFF_SAVE_MAX_OPERATIONS recorded operations
+diff_saves = os.environ.get('IFC_DIFF_SAVES', '1') != '0'
+
+# Downloaded and parsed models, reused across saves on the same version.
+# Their indexes are persisted in SQLite sidecars so restarts reopen cached versions; set IFC_SIDECARS=0 to keep them in memory only
+model_cache = ModelCache(
+    cache_directory=os.path.join(os.getcwd(), 'Temp', 'cache'),
+    memory_budget=int(os.environ.get('IFC_MODEL_CACHE_BUDGET_MB', '1024')) * 1024 * 1024,
+    lazy=lazy_parsing,
+    sidecars=os.environ.get('IFC_SIDECARS', '1') != '0',
+    max_kept_saves=int(os.environ.get('IFC_DIFF_SAVE_MAX_SAVES', '50')),
+    max_kept_operations=int(os.environ.get('IFC_DIFF_SAVE_MAX_OPERATIONS', '100000')),
+)
+
+# Per-request workspaces so concurrent saves don't overwrite each other's files
+workspace_root = os.path.join(os.getcwd(), 'Temp', 'jobs')
+workspace_quota_bytes = int(os.environ.get('IFC_WORKSPACE_QUOTA_MB', '2048')) * 1024 * 1024
+keep_workspaces = os.environ.get('IFC_KEEP_WORKSPACES') == '1'
+
+# Parallel ranged downloads from S3
+download_chunk_size = int(os.environ.get('IFC_DOWNLOAD_CHUNK_MB', '8')) * 1024 * 1024
+download_parallelism = int(os.environ.get('IFC_DOWNLOAD_PARALLELISM', '4'))
+
+# Parallel multipart uploads to S3
+upload_part_size = int(os.environ.get('IFC_UPLOAD_PART_MB', '16')) * 1024 * 1024
+upload_parallelism = int(os.environ.get('IFC_UPLOAD_PARALLELISM', '4'))
+upload_resume_attempts = 2
+
+# How saves are exported: "upload" (the default) streams the model straight into a new version without a temp file,
+# "file" writes output.ifc into the workspace and uploads it from there, so failed parts can be resumed,
+# "local" streams it into IFC_EXPORT_DIR (for tests and offline runs).
+# IFC_EXPORT_GZIP=1 gzips local exports; uploads stay plain IFC so the new version opens in the viewer.
+export_mode = os.environ.get('IFC_EXPORT_MODE', 'upload')
+export_gzip = os.environ.get('IFC_EXPORT_GZIP') == '1'
+export_directory = os.environ.get('IFC_EXPORT_DIR', os.path.join(os.getcwd(), 'Temp', 'exports'))
+
+# Pooled, retrying client for all Autodesk Data Management and S3 calls
+aps_client = ApsClient(pool_size=max(16, download_parallelism * 2, upload_parallelism * 2))
+
+# Largest update request body accepted after decompression
+max_payload_bytes = int(os.environ.get('IFC_MAX_PAYLOAD_MB', '256')) * 1024 * 1024
+# Flask refuses larger request bodies with 413 before reading them; compressed bodies are smaller still
+app.config['MAX_CONTENT_LENGTH'] = max_payload_bytes
+
+# Bounded pool for background save jobs
+job_manager = JobManager(max_workers=int(os.environ.get('IFC_JOB_WORKERS', '2')))
+
+# Per-stage timings and counters of update requests, served at /metrics
+metrics_registry = MetricsRegistry()
+metrics_registry.add_gauge('ifc_model_cache_models', 'Parsed models held in the model cache.', lambda: model_cache.stats()['models'])
+metrics_registry.add_gauge('ifc_model_cache_cost_bytes', 'Estimated memory of the cached models.', lambda: model_cache.stats()['costBytes'])
+
+
+def download_ifc_file(project, version, access_token, local_file_path, progress=None, max_bytes=None):
+    # Get the version details (cached, so upload_to_cloud doesn't fetch them again)
+    version_details = aps_client.get_version_details(project, version, access_token)
 
     # Extract the download URL from the version details
     try:
@@ -42,14 +109,18 @@ def download_ifc_file(project, version, access_token, local_file_path):
     except KeyError:
         raise Exception("Download URL not found in version details.")
     
-    signed_url = get_signed_s3_url(access_token,storage_url)
+    signed_download = get_signed_s3_download(access_token,storage_url)
 
-    download_file_from_s3(signed_url,local_file_path)
+    download_file_from_s3(signed_download["url"],local_file_path, progress, max_bytes, signed_download.get("sha1"))
 
     logging.info(f"File downloaded successfully to {local_file_path}")
 
 # Step 2: Get the signed S3 URL
-def get_signed_s3_url(access_token, bucket_key):
+def get_signed_s3_download(access_token, bucket_key):
+    """
+    Requests a signed S3 download for an OSS object.
+    The response holds the signed "url" and, when OSS knows them, the object's "size" and "sha1".
+    """
 
     parsed_url = urlparse(bucket_key)
     path = parsed_url.path
@@ -63,55 +134,68 @@ def get_signed_s3_url(access_token, bucket_key):
     headers = {"Authorization": f"Bearer {access_token}",
                        'Content-Type': 'application/vnd.api+json'
                        }
-    response = requests.get(url, headers=headers)
+    response = aps_client.get(url, headers=headers)
     response.raise_for_status()
-    return response.json()["url"]
+    return response.json()
+
+def get_signed_s3_url(access_token, bucket_key):
+    return get_signed_s3_download(access_token, bucket_key)["url"]
 
 # Step 3: Download the file from the signed S3 URL
-def download_file_from_s3(signed_url, local_file_path):
-    response = requests.get(signed_url, stream=True)
-    response.raise_for_status()
-    with open(local_file_path, "wb") as file:
-        for chunk in response.iter_content(chunk_size=8192):
-            file.write(chunk)
-    print(f"File downloaded successfully to {local_file_path}")
+def download_file_from_s3(signed_url, local_file_path, progress=None, max_bytes=None, expected_sha1=None):
+    download_file_ranged(
+        signed_url,
+        local_file_path,
+        chunk_size=download_chunk_size,
+        parallelism=download_parallelism,
+        expected_sha1=expected_sha1,
+        progress=progress,
+        max_bytes=max_bytes,
+        session=aps_client.session,
+    )
+    logging.info(f"File downloaded successfully to {local_file_path}")
 
 def extract_material_info(ifc_file_path):
-    ifc_model = ifcopenshell.open(ifc_file_path)
-    materials_dict = {}
-    
-    for element in ifc_model.by_type('IfcProduct'):
-        if element.HasAssociations:
-            for association in element.HasAssociations:
-                if association.is_a('IfcRelAssociatesMaterial'):
-                    material = association.RelatingMaterial
-                    materials = []
-                    
-                    if material.is_a('IfcMaterial'):
-                        materials.append(material)
-                    elif material.is_a('IfcMaterialList'):
-                        materials.extend(material.Materials)
-                    elif material.is_a('IfcMaterialLayerSetUsage'):
-                        for layer in material.ForLayerSet.MaterialLayers:
-                            materials.append(layer.Material)
-                    
-                    for mat in materials:
-                        material_name = mat.Name
-                        material_color = get_material_color(mat, ifc_model)
-
-                        if material_color == "Unknown Color":
-                            material_color = set_default_color(ifc_model, mat)
-
-                        if material_name not in materials_dict:
-                            materials_dict[material_name] = {}
-
-                        if material_color not in materials_dict[material_name]:
-                            materials_dict[material_name][material_color] = 0
-
-                        materials_dict[material_name][material_color] += 1
-    
+    ifc_model = open_ifc_model(ifc_file_path, lazy_parsing)
+    materials_dict = build_material_inventory(ifc_model)
     return materials_dict, ifc_model
 
+def build_material_inventory(ifc_model):
+    """
+    Counts product/material occurrences per material name and color without changing the model.
+    Each distinct material's color is resolved once; counts are tallied in an array indexed by
+    (material name, color) pair. Uncolored materials are reported as "Unknown Color";
+    use assign_default_colors to color them.
+    Returns {material_name: {color: count}}.
+    """
+    material_colors = {}  # material id -> color
+    pair_positions = {}  # (material name, color) -> position in tallies
+    tallies = array('q')
+
+    for element in ifc_model.by_type('IfcProduct'):
+        if not element.HasAssociations:
+            continue
+        for association in element.HasAssociations:
+            if not association.is_a('IfcRelAssociatesMaterial'):
+                continue
+            for mat in get_product_materials(association.RelatingMaterial):
+                material_color = material_colors.get(mat.id())
+                if material_color is None:
+                    material_color = get_material_color(mat, ifc_model)
+                    material_colors[mat.id()] = material_color
+
+                pair = (mat.Name, material_color)
+                position = pair_positions.get(pair)
+                if position is None:
+                    position = pair_positions[pair] = len(tallies)
+                    tallies.append(0)
+                tallies[position] += 1
+
+    materials_dict = {}
+    for (material_name, material_color), position in pair_positions.items():
+        materials_dict.setdefault(material_name, {})[material_color] = tallies[position]
+    return materials_dict
+
 def get_material_color(material, ifc_model):
     """
     Extracts the color of a material if available.
@@ -124,7 +208,7 @@ def get_material_color(material, ifc_model):
                 if rep.is_a('IfcStyledRepresentation'):
                     for item in rep.Items:
                         if item.is_a('IfcStyledItem'):
-                            for style in item.Styles:
+                            for style in get_item_styles(item):
                                 if style.is_a('IfcSurfaceStyle'):
                                     for surface_style in style.Styles:
                                         if surface_style.is_a('IfcSurfaceStyleRendering'):
@@ -132,6 +216,18 @@ def get_material_color(material, ifc_model):
                                             break
     return color
 
+def get_item_styles(styled_item):
+    """
+    Returns the styles of an IfcStyledItem, unwrapping IfcPresentationStyleAssignments.
+    """
+    styles = []
+    for style in styled_item.Styles:
+        if style.is_a('IfcPresentationStyleAssignment'):
+            styles.extend(style.Styles)
+        else:
+            styles.append(style)
+    return styles
+
 def extract_rgb(surface_style_rendering):
     """
     Extracts the RGB color from the IfcSurfaceStyleRendering entity.
@@ -141,65 +237,60 @@ def extract_rgb(surface_style_rendering):
     blue = surface_style_rendering.SurfaceColour.Blue * 255
     return f"RGB({int(red)}, {int(green)}, {int(blue)})"
 
-def get_ifc_schema_version(ifc_model):
+def set_default_color(ifc_model, material):
     """
-    Determines the IFC schema version.
+    Sets the material color to red if it is unknown.
+    Prefer assign_default_colors for more than one material, so they share one style chain.
     """
-    schema_version = ifc_model.schema
-    return schema_version
+    assign_default_colors(ifc_model, [material])
+    return "RGB(255, 0, 0)"
 
-def set_default_color(ifc_model, material):
+def find_uncolored_materials(ifc_model):
     """
-    Sets the material color to red if it is unknown and creates a new IfcSurfaceStyleRendering.
-    Adjusts logic based on IFC schema version.
+    Returns the IfcMaterials without a surface color, resolving each material once.
     """
-    red = 1.0  # Normalized value for Red
-    green = 0.0  # Normalized value for Green
-    blue = 0.0  # Normalized value for Blue
-
-    # Create a new IfcColourRgb entity for red
-    new_color = ifc_model.create_entity('IfcColourRgb', Name="Red", Red=red, Green=green, Blue=blue)
-    
-    # Create a new IfcSurfaceStyleRendering entity using the new color
-    new_rendering = ifc_model.create_entity('IfcSurfaceStyleRendering', SurfaceColour=new_color)
-    
-    # Create a new IfcSurfaceStyle and associate the rendering to it
-    new_surface_style = ifc_model.create_entity('IfcSurfaceStyle', Name="Red Surface Style", Styles=[new_rendering])
+    return [material for material in ifc_model.by_type('IfcMaterial')
+            if get_material_color(material, ifc_model) == "Unknown Color"]
 
-    schema_version = get_ifc_schema_version(ifc_model)
+def assign_default_colors(ifc_model, materials=None, style_cache=None):
+    """
+    Colors all given materials (default: every uncolored material) red in one pass.
+    One red style chain and one IfcStyledRepresentation are created (or reused) and shared by
+    every material, each through its IfcMaterialDefinitionRepresentation.
+    Returns the number of materials that were colored.
+    """
+    if materials is None:
+        materials = find_uncolored_materials(ifc_model)
+    if not materials:
+        return 0
+    if style_cache is None:
+        style_cache = build_style_cache(ifc_model)
+
+    # Step 1: One shared styled representation holding the red style
+    presentation_style = get_or_create_presentation_style(ifc_model, (1.0, 0.0, 0.0), style_cache)
+    styled_item = ifc_model.create_entity('IfcStyledItem', Item=None, Styles=[presentation_style])
+    styled_representation = ifc_model.create_entity(
+        'IfcStyledRepresentation',
+        ContextOfItems=get_representation_context(ifc_model),
+        RepresentationIdentifier="Style",
+        RepresentationType="Material",
+        Items=[styled_item],
+    )
 
-    if schema_version == "IFC4":
-        if not material.HasRepresentation:
-            material_def_rep = ifc_model.create_entity('IfcMaterialDefinitionRepresentation')
-            material.DefinitionRepresentation = material_def_rep
-            material_def_rep.Representations = []
-        else:
+    # Step 2: Link it to every material
+    for material in materials:
+        if material.HasRepresentation:
             material_def_rep = material.HasRepresentation[0]
-            # Convert to a list if it's not already
-            if isinstance(material_def_rep.Representations, tuple):
-                material_def_rep.Representations = list(material_def_rep.Representations)
-    else:  # For IFC2x3 and earlier
-        if not material.HasRepresentation:
-            # Here, the Representation will be directly attached to the IfcStyledItem or other suitable entities.
-            material_def_rep = None
+            material_def_rep.Representations = material_def_rep.Representations + (styled_representation,)
         else:
-            material_def_rep = material.HasRepresentation[0]
-            if isinstance(material_def_rep.Representations, tuple):
-                material_def_rep.Representations = list(material_def_rep.Representations)
-
-    # Create a new styled item to associate with the surface style
-    styled_item = ifc_model.create_entity('IfcStyledItem', Item=None, Styles=[new_surface_style])
+            ifc_model.create_entity(
+                'IfcMaterialDefinitionRepresentation',
+                Representations=[styled_representation],
+                RepresentedMaterial=material,
+            )
 
-    if schema_version == "IFC4":
-        if material_def_rep is not None:
-            # Associate the styled item with the material's representation
-            material_def_rep.Representations = material_def_rep.Representations + (styled_item,)
-    else:
-        # For IFC2x3, apply the styled item directly to an appropriate representation
-        # Handle association according to the schema
-        material.HasRepresentation = material.HasRepresentation + (styled_item,) if material.HasRepresentation else (styled_item,)
-
-    return "RGB(255, 0, 0)"
+    logging.info(f"Assigned the default color to {len(materials)} materials")
+    return len(materials)
 
 def save_ifc_model(ifc_model, output_file_path):
     """
@@ -223,221 +314,6 @@ def create_owner_history(ifc_file):
 
     return owner_history
 
-def update_element_and_children_colors(ifc_file, root_element, rgb):
-    # Step 1: Create the surface style and presentation style assignment
-    surface_style = ifc_file.create_entity(
-        "IfcSurfaceStyle",
-        Name="ElementColor",
-        Side="BOTH",
-        Styles=[
-            ifc_file.create_entity(
-                "IfcSurfaceStyleRendering",
-                SurfaceColour=ifc_file.create_entity(
-                    "IfcColourRgb", Name=None, Red=rgb[0], Green=rgb[1], Blue=rgb[2]
-                ),
-                Transparency=0.0,
-                ReflectanceMethod="MATT",
-            )
-        ],
-    )
-
-    presentation_style = ifc_file.create_entity(
-        "IfcPresentationStyleAssignment", Styles=[surface_style]
-    )
-
-    # Step 2: Assign the presentation style to IfcMappedItem
-    def apply_style_to_mapped_item(mapped_item):
-        """Assign a presentation style to an IfcMappedItem."""
-        # Check if the mapped item already has an IfcStyledItem
-        styled_item = None
-        for style in ifc_file.by_type("IfcStyledItem"):
-            if style.Item == mapped_item:
-                styled_item = style
-                break
-
-        if not styled_item:
-            # Create a new IfcStyledItem if none exists
-            styled_item = ifc_file.create_entity(
-                "IfcStyledItem", Item=mapped_item, Styles=()
-            )
-
-        # Ensure the presentation style is assigned to the styled item
-        styled_item.Styles = (presentation_style,)
-
-    # Step 3: Iterative traversal
-    def traverse_and_apply_style(root):
-        visited = set()
-        stack = [root]
-
-        while stack:
-            element = stack.pop()
-
-            # Skip already visited elements
-            if element.id() in visited:
-                continue
-            visited.add(element.id())
-
-            # Apply style to IfcMappedItem in the representation
-            if hasattr(element, "Representation") and element.Representation:
-                for shape_representation in element.Representation.Representations:
-                    for item in shape_representation.Items:
-                        if item.is_a("IfcMappedItem"):
-                            apply_style_to_mapped_item(item)
-
-            # Add children via decomposition
-            if hasattr(element, "IsDecomposedBy"):
-                for decomposition in element.IsDecomposedBy:
-                    stack.extend(decomposition.RelatedObjects)
-
-            # Add related objects defined by type
-            if hasattr(element, "IsDefinedBy"):
-                for definition in element.IsDefinedBy:
-                    if definition.is_a("IfcRelDefinesByType"):
-                        stack.extend(definition.RelatedObjects)
-
-    # Start traversal
-    traverse_and_apply_style(root_element)
-
-    print("Finished assigning colors to IfcMappedItem.")
-
-
-
-def update_element_and_children_colors3(ifc_file, root_element, rgb):
-    # Step 1: Create the surface style and presentation style assignment
-    surface_style = ifc_file.create_entity(
-        "IfcSurfaceStyle",
-        Name="ElementColor",
-        Side="BOTH",
-        Styles=[
-            ifc_file.create_entity(
-                "IfcSurfaceStyleRendering",
-                SurfaceColour=ifc_file.create_entity(
-                    "IfcColourRgb", Name=None, Red=rgb[0], Green=rgb[1], Blue=rgb[2]
-                ),
-                Transparency=0.0,
-                ReflectanceMethod="MATT",
-            )
-        ],
-    )
-
-    presentation_style = ifc_file.create_entity(
-        "IfcPresentationStyleAssignment", Styles=[surface_style]
-    )
-
-    # Step 2: Assign the presentation style to IfcMappedItem
-    def apply_style_to_mapped_item(mapped_item):
-        """Assign a presentation style to an IfcMappedItem."""
-        styled_item = None
-        for style in ifc_file.by_type("IfcStyledItem"):
-            if style.Item == mapped_item:
-                styled_item = style
-                break
-
-        if not styled_item:
-            # Create a new IfcStyledItem if none exists
-            styled_item = ifc_file.create_entity(
-                "IfcStyledItem", Item=mapped_item, Styles=()
-            )
-
-        # Assign the presentation style to the styled item
-        styled_item.Styles = (presentation_style,)
-
-    def traverse_and_apply_style(element):
-        """Traverse elements and apply styles to IfcMappedItem."""
-        if not hasattr(element, "Representation") or not element.Representation:
-            return
-
-        for shape_representation in element.Representation.Representations:
-            for item in shape_representation.Items:
-                if item.is_a("IfcMappedItem"):
-                    # Apply style to IfcMappedItem
-                    apply_style_to_mapped_item(item)
-
-        # Process related objects defined by type
-        if hasattr(element, "IsDefinedBy"):
-            for definition in element.IsDefinedBy:
-                if definition.is_a("IfcRelDefinesByType"):
-                    for related_object in definition.RelatedObjects:
-                        traverse_and_apply_style(related_object)
-
-    # Start traversal
-    traverse_and_apply_style(root_element)
-
-
-def update_element_and_children_colors2(ifc_file, root_element, rgb):
-
-    
-
-    # Step 1: Create a surface style with the specified color
-    surface_style = ifc_file.create_entity(
-        "IfcSurfaceStyle",
-        Name="ElementColor",
-        Side="BOTH",
-        Styles=[
-            ifc_file.create_entity(
-                "IfcSurfaceStyleRendering",
-                SurfaceColour=ifc_file.create_entity(
-                    "IfcColourRgb", Name="Test", Red=rgb[0], Green=rgb[1], Blue=rgb[2]
-                ),
-                Transparency=0.0,
-                ReflectanceMethod="MATT",
-            )
-        ],
-    )
-
-    # Step 2: Assign the color directly to elements
-    def apply_style_to_shape_representation(element):
-        if not hasattr(element, "Representation") or not element.Representation:
-            return
-
-        for shape_representation in element.Representation.Representations:
-            for item in shape_representation.Items:
-                if item.is_a("IfcRepresentationMap"):
-                    # Handle IfcRepresentationMap
-                    mapped_representation = item.MappingSource.MappedRepresentation
-                    for mapped_item in mapped_representation.Items:
-                        assign_style_to_item(mapped_item)
-                elif item.is_a("IfcMappedItem"):
-                    # Handle IfcMappedItem
-                    source_representation = item.MappingSource.MappedRepresentation
-                    for mapped_item in source_representation.Items:
-                        assign_style_to_item(mapped_item)
-                else:
-                    # Handle regular representation items
-                    assign_style_to_item(item)
-
-    def assign_style_to_item(item):
-        """Assign a surface style to a representation item."""
-        # Check if there's already an IfcStyledItem
-        styled_item = None
-        for style in ifc_file.by_type("IfcStyledItem"):
-            if style.Item == item:
-                styled_item = style
-                break
-
-        if not styled_item:
-            # Create a new IfcStyledItem if none exists
-            styled_item = ifc_file.create_entity("IfcStyledItem", Item=item, Styles=())
-
-        # Assign the surface style to the styled item
-        styled_item.Styles = (surface_style,)
-
-    # Step 3: Recursively apply styles to the element and its children
-    def traverse_and_apply_style(element):
-        apply_style_to_shape_representation(element)
-
-        # Process related objects defined by type
-        if hasattr(element, "IsDefinedBy"):
-            for definition in element.IsDefinedBy:
-                if definition.is_a("IfcRelDefinesByType"):
-                    for related_object in definition.RelatedObjects:
-                        traverse_and_apply_style(related_object)
-    # Start traversal and apply styles
-    try:
-        traverse_and_apply_style(root_element)
-    except:
-        here = "Test"
-
 def get_children_of_element(ifc_file, element):
     """Get the children of an element."""
     children = []
@@ -446,68 +322,12 @@ def get_children_of_element(ifc_file, element):
             children.extend(rel.RelatedObjects)
     return children
 
-def assign_color_to_material(ifc_file, material, rgb):
-    """Assign a color to a material using IfcSurfaceStyle for IFC2X3 schema."""
-    # Step 1: Create an IfcColourRgb entity for the color
-    color_rgb = ifc_file.create_entity(
-        "IfcColourRgb",
-        Name="CustomColor",
-        Red=rgb[0],
-        Green=rgb[1],
-        Blue=rgb[2]
-    )
-
-    # Step 2: Create an IfcSurfaceStyleShading entity
-    surface_style_shading = ifc_file.create_entity(
-        "IfcSurfaceStyleShading",
-        SurfaceColour=color_rgb
-    )
-
-    # Step 3: Create an IfcSurfaceStyle entity and assign shading
-    surface_style = ifc_file.create_entity(
-        "IfcSurfaceStyle",
-        Side="BOTH",  # Apply to both sides
-        Styles=[surface_style_shading]  # Add the shading style
-    )
-
-    # Step 4: Create an IfcStyledItem to link to geometry (if applicable)
-    styled_item = ifc_file.create_entity(
-        "IfcStyledItem",
-        Item=None,  # Geometric item this style applies to
-        Styles=[surface_style]
-    )
-
-    # Step 5: Link to material through IfcMaterialDefinitionRepresentation
-    material_def_rep = ifc_file.create_entity(
-        "IfcMaterialDefinitionRepresentation",
-        RepresentedMaterial=material,
-        Representations=[styled_item]
-    )
-
 def get_geometric_representation_item(ifc_file, material):
     """Retrieve or create a geometric representation item for the material."""
     # Placeholder: This should retrieve or create the geometry for the material
     # In real cases, it depends on how geometry is represented in your IFC file
     return material  # Replace with actual logic
 
-def get_representation_context(ifc_file):
-    """Retrieve or create the representation context for styled representations."""
-    # Placeholder: This should retrieve or create a suitable representation context
-    # In real cases, it depends on the IFC file setup
-    return ifc_file.by_type("IfcGeometricRepresentationContext")[0]  # Replace with actual logic
-
-
-
-# Utility function to validate if the color is a valid hex color code
-def isValidHex(hex):
-    if isinstance(hex, str) and len(hex) in [4, 7] and hex[0] == "#":
-        try:
-            int(hex[1:], 16)  # Try to parse the string to an integer
-            return True
-        except ValueError:
-            return False
-    return False
-
 
 def get_item_id_from_version(project_id, version_id, access_token):
     """
@@ -518,37 +338,41 @@ def get_item_id_from_version(project_id, version_id, access_token):
     :param access_token: OAuth token for authentication
     :return: item_id (str) or None if not found
     """
-    encoded_version_id = urllib.parse.quote(version_id, safe='')
-
-    url = f"https://developer.api.autodesk.com/data/v1/projects/{project_id}/versions/{encoded_version_id}"
-    headers = {"Authorization": f"Bearer {access_token}"}
+    try:
+        data = aps_client.get_version_details(project_id, version_id, access_token)
+    except Exception as e:
+        logging.error(f"Error fetching version details: {e}")
+        return None
 
-    response = requests.get(url, headers=headers)
+    item_id = data["data"]["relationships"]["item"]["data"]["id"]
+    return item_id
 
-    if response.status_code == 200:
-        data = response.json()
-        item_id = data["data"]["relationships"]["item"]["data"]["id"]
-        return item_id
-    else:
-        print(f"Error: {response.status_code} - {response.text}")
+def get_version_file_name(project_id, version_id, access_token):
+    """
+    Returns the file name a version is displayed with, or None if the version details don't carry one.
+    """
+    try:
+        data = aps_client.get_version_details(project_id, version_id, access_token)
+    except Exception as e:
+        logging.warning(f"Error fetching version details: {e}")
         return None
 
+    attributes = data["data"].get("attributes") or {}
+    return attributes.get("displayName") or attributes.get("name")
+
 def get_folder_id_from_item(project_id, item_id, access_token):
-    headers = {"Authorization": f"Bearer {access_token}"}
     # 2️⃣ Step 2: Get folder_id from item_id
-    item_url = f"https://developer.api.autodesk.com/data/v1/projects/{project_id}/items/{item_id}"
-    item_response = requests.get(item_url, headers=headers)
-
-    if item_response.status_code != 200:
-        print(f"Error fetching item details: {item_response.status_code} - {item_response.text}")
+    try:
+        item_data = aps_client.get_item_details(project_id, item_id, access_token)
+    except Exception as e:
+        logging.error(f"Error fetching item details: {e}")
         return None
 
-    item_data = item_response.json()
     folder_id = item_data["data"]["relationships"]["parent"]["data"]["id"]
 
     return folder_id
 
-def upload_to_cloud(project_id, version_id, file_path, file_name, access_token):
+def upload_to_cloud(project_id, version_id, file_path, file_name, access_token, progress=None):
     """
     Uploads a new version of a file to Autodesk's BIM 360 cloud.
 
@@ -557,12 +381,66 @@ def upload_to_cloud(project_id, version_id, file_path, file_name, access_token):
     :param file_path: The local path to the file to upload.
     :param file_name: The name of the file to upload.
     :param access_token: The OAuth access token.
+    :param progress: Optional JobProgress that receives the uploaded bytes.
     :return: The response of the version creation request.
     """
+    storage_id, item_id, folder_id = create_upload_storage(project_id, version_id, file_name, access_token)
+
+    # 2️⃣ STEP 2: UPLOAD FILE TO S3 IN PARALLEL PARTS, RESUMING FAILED PARTS
+    upload_state = None
+    for attempt in range(upload_resume_attempts + 1):
+        try:
+            upload_file_multipart(
+                aps_client,
+                access_token,
+                storage_id,
+                file_path,
+                part_size=upload_part_size,
+                parallelism=upload_parallelism,
+                progress=progress,
+                state=upload_state,
+            )
+            break
+        except MultipartUploadError as e:
+            if attempt == upload_resume_attempts:
+                raise
+            upload_state = e.state
+            logging.warning(f"Resuming upload of {len(upload_state.missing_parts())} missing parts: {e}")
+
+    logging.info("File uploaded successfully to S3.")
+
+    return create_uploaded_version(project_id, storage_id, item_id, folder_id, file_name, access_token)
+
+def stream_to_cloud(project_id, version_id, file_name, access_token, write_content, progress=None):
+    """
+    Uploads a new version like upload_to_cloud, streaming the content straight into the multipart upload
+    instead of reading it from a file. write_content(writable) writes the file content.
+    Returns the response of the version creation request and the number of uploaded bytes.
+    """
+    storage_id, item_id, folder_id = create_upload_storage(project_id, version_id, file_name, access_token)
+
+    upload_stream = MultipartUploadStream(
+        aps_client,
+        access_token,
+        storage_id,
+        part_size=upload_part_size,
+        parallelism=upload_parallelism,
+        progress=progress,
+    )
+    _, uploaded_bytes = export_to_sink(upload_stream, write_content)
+    logging.info("File streamed successfully to S3.")
+
+    return create_uploaded_version(project_id, storage_id, item_id, folder_id, file_name, access_token), uploaded_bytes
+
+def create_upload_storage(project_id, version_id, file_name, access_token):
+    """
+    Creates the OSS storage object for a new version of the item behind version_id.
+    Returns the storage id, the item id and the folder id.
+    """
     item_id = get_item_id_from_version(project_id, version_id, access_token)
     folder_id = get_folder_id_from_item(project_id,item_id,access_token)
     # Step 1: Create storage
-    storage_url = f"https://developer.api.autodesk.com/data/v1/projects/{project_id}/storage"
+    storage_url = f"{APS_BASE_URL}/data/v1/projects/{project_id}/storage"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/vnd.api+json"
@@ -580,28 +458,27 @@ def upload_to_cloud(project_id, version_id, file_path, file_name, access_token):
         }
     }
 
-    storage_response = requests.post(storage_url, headers=headers, json=storage_payload)
+    storage_response = aps_client.post(storage_url, headers=headers, json=storage_payload)
     if storage_response.status_code != 201:
         raise Exception(f"Failed to create storage: {storage_response.json()}")
 
     storage_data = storage_response.json()
     storage_id = storage_data["data"]["id"]
-    signed_upload_url = storage_data["data"]["links"]["upload"]
+    return storage_id, item_id, folder_id
 
-    logging.info(f"Signed S3 URL obtained: {signed_upload_url}")
-
-    # 2️⃣ STEP 2: UPLOAD FILE TO S3 SIGNED URL
-    with open(file_path, "rb") as file_data:
-        upload_response = requests.put(signed_upload_url, data=file_data, headers={"Content-Type": "application/octet-stream"})
-        
-        if upload_response.status_code not in [200, 201]:
-            raise Exception(f"Failed to upload IFC file: {upload_response.text}")
-
-    logging.info("File uploaded successfully to S3.")
+def create_uploaded_version(project_id, storage_id, item_id, folder_id, file_name, access_token):
+    """
+    Creates the item (if there is none yet) and the version for uploaded storage.
+    Returns the response of the version creation request.
+    """
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/vnd.api+json"
+    }
 
     # 3️⃣ STEP 3: CREATE A NEW ITEM IF NO `item_id` IS PROVIDED
     if not item_id:
-        item_url = f"https://developer.api.autodesk.com/data/v1/projects/{project_id}/items"
+        item_url = f"{APS_BASE_URL}/data/v1/projects/{project_id}/items"
         
         item_payload = {
             "jsonapi": {"version": "1.0"},
@@ -615,7 +492,7 @@ def upload_to_cloud(project_id, version_id, file_path, file_name, access_token):
             }
         }
 
-        item_response = requests.post(item_url, headers=headers, json=item_payload)
+        item_response = aps_client.post(item_url, headers=headers, json=item_payload)
         
         if item_response.status_code != 201:
             raise Exception(f"Failed to create new item: {item_response.json()}")
@@ -626,7 +503,7 @@ def upload_to_cloud(project_id, version_id, file_path, file_name, access_token):
         logging.info(f"New item created with ID: {item_id}")
 
     # 4️⃣ STEP 4: CREATE A NEW VERSION OF THE FILE
-    version_url = f"https://developer.api.autodesk.com/data/v1/projects/{project_id}/versions"
+    version_url = f"{APS_BASE_URL}/data/v1/projects/{project_id}/versions"
     
     version_payload = {
         "jsonapi": {"version": "1.0"},
@@ -646,7 +523,7 @@ def upload_to_cloud(project_id, version_id, file_path, file_name, access_token):
         }
     }
 
-    version_response = requests.post(version_url, headers=headers, json=version_payload)
+    version_response = aps_client.post(version_url, headers=headers, json=version_payload)
     
     if version_response.status_code != 201:
         raise Exception(f"Failed to create new version: {version_response.json()}")
@@ -655,79 +532,479 @@ def upload_to_cloud(project_id, version_id, file_path, file_name, access_token):
     
     return version_response.json()
 
-@app.route('/api/update_ifc', methods=['POST'])
-def extract_ifc():
-    data = request.json
-    version = data.get('versionID')
-    project = data.get('projectID')
-    accessToken = data.get('accessToken')
-    
-    if not version:
+def patch_step_index(cached_model):
+    """
+    Returns the STEP index to patch the downloaded file with, or None if the model has to be written fully.
+    """
+    if not patch_writing or not os.path.exists(cached_model.file_path):
+        return None
+    return cached_model.get_step_index()
+
+def write_model(cached_model, ifc_file, output_file_path, progress=None):
+    """
+    Writes a checked-out model. With the patch writer only the entities changed in this request are
+    serialized and everything else is copied from the downloaded file; otherwise the whole model is rewritten.
+    The "write" stage of progress advances with every written chunk, or once for a full rewrite.
+    """
+    step_index = patch_step_index(cached_model)
+    if step_index is not None:
+        try:
+            with open(output_file_path, "wb") as output:
+                stream_patched(ifc_file, step_index, cached_model.file_path, CountingWriter(output, progress))
+            return
+        except StepIndexError as e:
+            logging.warning(f"Writing the model fully: {e}")
+    ifc_file.write(output_file_path)
+    if progress:
+        progress.advance("write", os.path.getsize(output_file_path))
+
+def stream_model(cached_model, ifc_file, output, progress=None):
+    """
+    Writes a checked-out model into a binary writable, like write_model.
+    Only the patch writer streams with bounded memory; a full rewrite is serialized in one piece first,
+    since ifcopenshell can only write whole models to a path or a string.
+    """
+    output = CountingWriter(output, progress)
+    step_index = patch_step_index(cached_model)
+    if step_index is not None:
+        try:
+            # Raises before writing anything, so the full rewrite below still starts a clean output
+            stream_patched(ifc_file, step_index, cached_model.file_path, output)
+            return
+        except StepIndexError as e:
+            logging.warning(f"Writing the model fully: {e}")
+    content = ifc_file.to_string().encode("utf-8")
+    copy_range(output, memoryview(content), 0, len(content))
+
+def export_file_name(version, compress):
+    """
+    File name for a local export of a version, safe for a local path.
+    """
+    return re.sub(r'[^A-Za-z0-9._-]', '_', version) + (".ifc.gz" if compress else ".ifc")
+
+def export_model(cached_model, ifc_file, version, project, access_token, progress=None):
+    """
+    Streams a checked-out model into the sink of export_mode without a local copy.
+    Uploads become a new version named like the item; local exports are named after the version.
+    Returns the export summary for the response and the number of bytes the sink received.
+    """
+    def write_content(output):
+        stream_model(cached_model, ifc_file, output, progress)
+
+    if export_mode == "upload":
+        file_name = get_version_file_name(project, version, access_token) or export_file_name(version, False)
+        export = {"mode": export_mode, "compressed": False, "fileName": file_name}
+        version_response, exported_bytes = stream_to_cloud(
+            project, version, file_name, access_token, write_content, progress
+        )
+        export["versionId"] = version_response["data"]["id"]
+    elif export_mode == "local":
+        export = {"mode": export_mode, "compressed": export_gzip}
+        sink_result, exported_bytes = export_to_sink(
+            LocalFileSink(os.path.join(export_directory, export_file_name(version, export_gzip))),
+            write_content,
+            export_gzip,
+        )
+        export["path"] = sink_result["path"]
+    else:
+        raise ValueError(f"Unknown IFC_EXPORT_MODE {export_mode!r}")
+
+    export["bytes"] = exported_bytes
+    return export, exported_bytes
+
+def validate_update_request(data):
+    """
+    Returns an error response for a malformed update request, or None if it is valid.
+    """
+    if not data.get('versionID'):
         return jsonify({'error': 'versionId is required'}), 400
 
-    if not project:
+    if not data.get('projectID'):
         return jsonify({'error': 'projectId is required'}), 400
 
-    if not accessToken:
+    if not data.get('accessToken'):
         return jsonify({'error': 'accessToken is required'}), 400
 
-    # Get the current working directory
-    current_directory = os.getcwd()
-    
-    # Construct the path to the "Temp" folder and the target file
-    temp_directory = os.path.join(current_directory, 'Temp')
-    local_file_path = os.path.join(temp_directory, "temp.ifc")
+    elements = data.get('elements', [])
+    if not isinstance(elements, list):
+        return jsonify({'error': 'elements must be a list'}), 400
+    for position, element in enumerate(elements):
+        if not isinstance(element, dict) or not isinstance(element.get('ifcGUIDs'), list):
+            return jsonify({'error': f'Element {position}: needs an ifcGUIDs list'}), 400
+        if not all(isinstance(guid, (str, int)) and not isinstance(guid, bool) for guid in element['ifcGUIDs']):
+            return jsonify({'error': f'Element {position}: ifcGUIDs must be strings or STEP ids'}), 400
 
-    # Ensure the directory exists
-    if not os.path.exists(temp_directory):
-        os.makedirs(temp_directory)
-    
-    try:
-        download_ifc_file(project, version, accessToken, local_file_path)
+    if data.get('strategy', DEFAULT_STRATEGY) not in STRATEGIES:
+        return jsonify({'error': f"strategy must be one of {', '.join(STRATEGIES)}"}), 400
+
+    return None
 
-        ifc_file = ifcopenshell.open(local_file_path)
+def validate_materials_request(data):
+    """
+    Returns an error response for a malformed materials request, or None if it is valid.
+    """
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+
+    for key, name in (('versionID', 'versionId'), ('projectID', 'projectId'), ('accessToken', 'accessToken')):
+        if not isinstance(data.get(key), str) or not data[key]:
+            return jsonify({'error': f'{name} is required'}), 400
+
+    return None
+
+def process_update_request(color_data, compiled_rules=(), progress=None, profile=False):
+    """
+    Downloads (or reuses) the model of a version, recolors it and writes the result.
+    compiled_rules are the request's rules, compiled by the route when it validated them.
+    Runs both for the synchronous route and for background jobs, reporting to progress if given.
+    The result carries the request's stage timings and counters, and a cProfile summary if profile is set.
+    """
+    request_metrics = RequestMetrics()
+    profile_result = {}
+
+    try:
+        with profiled(profile, profile_result):
+            # Every request gets its own workspace under Temp/jobs, removed when it ends
+            with Workspace(workspace_root, workspace_quota_bytes, keep=keep_workspaces) as workspace:
+                result = process_update_in_workspace(workspace, color_data, compiled_rules, progress, request_metrics)
+    except Exception:
+        metrics_registry.observe_request(request_metrics, "error")
+        raise
+
+    metrics_registry.observe_request(request_metrics, "success")
+    logging.info(f"Update of version {color_data['versionID']} took {request_metrics.to_dict()}")
+    result["metrics"] = request_metrics.to_dict()
+    result.update(profile_result)
+    return result
+
+def load_cached_model(workspace, project, version, access_token, progress=None, request_metrics=None):
+    """
+    Returns the cached model of a version, downloading it into the workspace on a cache miss.
+    Raises AccessDenied if the access token may not read the version.
+    """
+    request_metrics = request_metrics or RequestMetrics()
+
+    # Cached models are shared by every user and restored from sidecars after a restart, so the token is
+    # checked before the cache is consulted. The lookup is cached per token and reused by a download.
+    aps_client.get_version_details(project, version, access_token)
+
+    # Reuse the parsed model if this version was downloaded before
+    cached_model = model_cache.get(project, version)
+    if cached_model is None:
+        request_metrics.count("modelCacheMisses")
+        download_file_path = workspace.path("download.ifc")
+        with request_metrics.stage("download"):
+            download_ifc_file(project, version, access_token, download_file_path, progress, workspace.quota_bytes)
+        request_metrics.count("downloadBytes", os.path.getsize(download_file_path))
+        with request_metrics.stage("parse"):
+            cached_model = model_cache.put(project, version, download_file_path)
+    else:
+        request_metrics.count("modelCacheHits")
+
+    # Inventory the materials of the downloaded file before a save styles the model; a no-op once it exists
+    with request_metrics.stage("inventory"):
+        cached_model.ensure_material_inventory(build_material_inventory)
+    return cached_model
+
+def process_update_in_workspace(workspace, color_data, compiled_rules=(), progress=None, request_metrics=None):
+    version = color_data['versionID']
+    project = color_data['projectID']
+    accessToken = color_data['accessToken']
+    local_file_path = workspace.path("output.ifc")
+    request_metrics = request_metrics or RequestMetrics()
+
+    strategy = color_data.get('strategy', DEFAULT_STRATEGY)
+    dry_run = bool(color_data.get('dryRun'))
+
+    cached_model = load_cached_model(workspace, project, version, accessToken, progress, request_metrics)
+
+    # Work on the shared model inside a transaction: rolled back afterwards, or kept for the next diff save.
+    # Kept styling is only reused by saves with the same strategy, if that strategy can be diffed.
+    if diff_saves and not dry_run:
+        checkout = cached_model.checkout_restyle(
+            lambda kept: kept.strategy == strategy and STRATEGIES[strategy].supports_diff
+        )
+    else:
+        checkout = cached_model.checkout()
+    with checkout as ifc_file:
+        first_new_id = ifc_file.get_max_id() + 1
+        request_metrics.set_gauge("modelEntities", ifc_file.get_max_id())
+
+        snapshot = cached_model.style_snapshot if diff_saves and not dry_run else None
+        diff_save = snapshot is not None
+        removed_style_count, purge_seconds = 0, 0.0
+        if not diff_save:
             # Step 1: Delete all existing styles in the file
-        for styled_item in ifc_file.by_type("IfcStyledItem"):
-            ifc_file.remove(styled_item)
-        for style_assignment in ifc_file.by_type("IfcPresentationStyleAssignment"):
-            ifc_file.remove(style_assignment)
-        # Parse incoming data
-        color_data = request.json  # [{'id': [1, 2, 3], 'color': '#FF5733'}, ...]
-
-        for data in color_data["elements"]:
-            element_ids = data['ifcGUIDs']
-            hex_color = data['color']
+            with request_metrics.stage("purge"):
+                request_metrics.count("styledItemsRemoved", len(ifc_file.by_type("IfcStyledItem")))
+                removed_style_count, purge_seconds = purge_styles(ifc_file)
+            request_metrics.count("entitiesRemoved", removed_style_count)
+
+            with request_metrics.stage("index"):
+                # Index the remaining styled items once for all color groups
+                # and share one style chain per color across all color groups
+                snapshot = StyleSnapshot(strategy, build_styled_item_index(ifc_file), build_style_cache(ifc_file))
+        else:
+            request_metrics.count("diffSaves")
+        styled_item_count = len(snapshot.styled_item_index)
+
+        # Resolve every GUID of the payload against the model's GUID index in one pass
+        elements = color_data.get("elements", [])
+        with request_metrics.stage("resolve"):
+            element_groups, missing_guids = cached_model.get_guid_index().resolve_groups(
+                [data['ifcGUIDs'] for data in elements], ifc_file
+            )
+        request_metrics.count("guidsRequested", sum(len(data['ifcGUIDs']) for data in elements))
+        request_metrics.count("guidsMissing", len(missing_guids))
+        if missing_guids:
+            logging.warning(f"{len(missing_guids)} requested elements were not found in the model")
+
+        # Select the elements of declarative rules through the model's selector index; rules apply after GUID groups
+        with request_metrics.stage("rules"):
+            # The selector index is only built once a request actually sends rules
+            selector_index = cached_model.get_selector_index() if compiled_rules else None
+            rule_groups = evaluate_rules(compiled_rules, selector_index, ifc_file)
+
+        color_groups = [(data.get('color'), element_ids) for data, element_ids in zip(elements, element_groups)]
+        color_groups.extend((rule.color, element_ids) for rule, element_ids in zip(compiled_rules, rule_groups))
+
+        styled_groups = []
+        for hex_color, element_ids in color_groups:
                 # Skip if color is undefined, null, or invalid
             if not hex_color or not isValidHex(hex_color):
                 continue  # Skip this iteration and move to the next one
 
             # Convert hex to RGB (normalized to 0-1 for IFC)
-            rgb = tuple(int(hex_color.lstrip("#")[i:i+2], 16) / 255 for i in (0, 2, 4))
+            styled_groups.append((normalize_rgb(hex_to_rgb(hex_color)), element_ids))
 
-            for element_id in element_ids:
-                element = ifc_file.by_id(element_id)
-                if element:
-                    update_element_and_children_colors(ifc_file, element, rgb)
+        if progress:
+            progress.start("style", sum(len(element_ids) for _, element_ids in styled_groups))
 
-        # Save updated IFC file
-        ifc_file.write(local_file_path)
+        def advance_style(element_ids):
+            if progress:
+                progress.advance("style", len(element_ids))
 
-        # Step 5: Upload the updated IFC file to the cloud
-        #upload_to_cloud(project,version, local_file_path,"1.ifc", accessToken)
+        def create_engine(strategy_name):
+            return StylingEngine(
+                ifc_file, strategy_name, cached_model.get_traversal_cache(), snapshot.styled_item_index, snapshot.style_cache
+            )
+
+        def collect_closures(engine, on_group=None):
+            closures = engine.collect_targets([element_ids for _, element_ids in styled_groups], on_group)
+            cached_model.persist_traversal()
+            return closures
+
+        if dry_run:
+            # Plan every strategy on the purged model and report what each would create; the checkout rolls back
+            with request_metrics.stage("plan"):
+                plans = {}
+                for strategy_name in STRATEGIES:
+                    engine = create_engine(strategy_name)
+                    plans[strategy_name] = engine.dry_run(styled_groups, collect_closures(engine))
+            return {
+                "status": "dryRun",
+                "message": "Planned the styling without changing the model.",
+                "purge": {"removedEntities": removed_style_count, "seconds": round(purge_seconds, 3)},
+                "plans": plans,
+                "missingGUIDs": missing_guids,
+                "ruleMatches": [len(element_ids) for element_ids in rule_groups],
+            }
+
+        # Compare the requested colors with the ones the model already shows
+        element_colors = assign_element_colors(styled_groups)
+        changed_element_count = count_changed_elements(snapshot.element_colors, element_colors)
+        request_metrics.count("elementsChanged", changed_element_count)
+
+        restyled_count = unstyled_count = removed_styled_item_count = 0
+        if changed_element_count:
+            engine = create_engine(strategy)
+
+            # Expand the roots of every group to the targets of the strategy they reach, reporting each group
+            with request_metrics.stage("traverse"):
+                closures = collect_closures(engine, advance_style)
+
+            # Style every target with the color of the last group that reaches it, touching only changed targets
+            with request_metrics.stage("style"):
+                target_colors, conflict_count = engine.plan(styled_groups, closures)
+                restyled_count, unstyled_count = engine.apply_changes(snapshot.item_colors, target_colors)
+                snapshot.item_colors = target_colors
+            removed_styled_item_count = engine.removed_styled_item_count
+            request_metrics.count("styledItemsRemoved", removed_styled_item_count)
+            request_metrics.count("styleConflicts", conflict_count)
+        snapshot.element_colors = element_colors
+
+        request_metrics.count("elementsStyled", len(element_colors))
+        request_metrics.count("targetsStyled", restyled_count)
+        request_metrics.count("targetsUnstyled", unstyled_count)
+        if progress and not changed_element_count:
+            # Nothing changed, so no group was walked
+            progress.finish("style")
+
+        request_metrics.count(
+            "styledItemsCreated", len(snapshot.styled_item_index) - styled_item_count + removed_styled_item_count
+        )
+        request_metrics.count("entitiesCreated", ifc_file.get_max_id() - first_new_id + 1)
+
+        if progress:
+            # The downloaded file's size estimates the output until the write is done
+            progress.start("write", cached_model.file_size)
+
+        if export_mode == "file":
+            # Save updated IFC file
+            with request_metrics.stage("write"):
+                write_model(cached_model, ifc_file, local_file_path, progress)
+            workspace.check_quota()
+            written_bytes = os.path.getsize(local_file_path)
+            if progress:
+                progress.finish("write")
+
+            # Upload it as a new version; parts that fail are resumed from the file
+            file_name = get_version_file_name(project, version, accessToken) or export_file_name(version, False)
+            with request_metrics.stage("upload"):
+                version_response = upload_to_cloud(project, version, local_file_path, file_name, accessToken, progress)
+            export = {
+                "mode": export_mode,
+                "compressed": False,
+                "fileName": file_name,
+                "versionId": version_response["data"]["id"],
+                "bytes": written_bytes,
+            }
+        else:
+            # Serialize straight into the sink; the model stays checked out until the export is complete
+            with request_metrics.stage("export"):
+                export, written_bytes = export_model(cached_model, ifc_file, version, project, accessToken, progress)
+            if progress:
+                progress.finish("write")
+        request_metrics.count("outputBytes", written_bytes)
+
+        # Later saves on this model diff against the styling it now holds
+        if diff_saves:
+            cached_model.style_snapshot = snapshot
+
+    return {
+        "status": "success",
+        "message": "IFC file updated successfully.",
+        "purge": {"removedEntities": removed_style_count, "seconds": round(purge_seconds, 3)},
+        "restyle": {
+            "mode": "diff" if diff_save else "full",
+            "strategy": strategy,
+            "elementsChanged": changed_element_count,
+            "targetsRestyled": restyled_count,
+            "targetsUnstyled": unstyled_count,
+        },
+        "export": export,
+        "missingGUIDs": missing_guids,
+        "ruleMatches": [len(element_ids) for element_ids in rule_groups],
+    }
+
+def read_update_request():
+    """
+    Returns the body of an update request in the JSON shape, decoding compressed and packed payloads.
+    Raises PayloadError for a body that can't be decoded.
+    """
+    return normalize_update_payload(read_update_payload(request, max_payload_bytes), isValidHex)
+
+def profiling_requested():
+    """
+    Whether the client asked for a cProfile summary of its request with the X-IFC-Profile header.
+    """
+    return request.headers.get('X-IFC-Profile', '').lower() in ('1', 'true', 'yes')
+
+@app.route('/api/update_ifc', methods=['POST'])
+def extract_ifc():
+    try:
+        data = read_update_request()
+    except PayloadError as e:
+        return jsonify({'error': str(e)}), 400
+    error_response = validate_update_request(data)
+    if error_response:
+        return error_response
+    try:
+        compiled_rules = compile_rules(data.get('rules', []))
+    except RuleError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        # Parse incoming data: [{'ifcGUIDs': [...], 'color': '#FF5733'}, ...]
+        # and optional rules: [{'category': 'Ventil', 'ifcType': 'IfcFlowController', 'color': '#FF5733'}, ...]
+        return jsonify(process_update_request(data, compiled_rules, profile=profiling_requested()))
+
+    except RuleError as e:
+        return jsonify({'error': str(e)}), 400
+
+    except AccessDenied as e:
+        return jsonify({'error': str(e)}), 403
 
-        return jsonify({"status": "success", "message": "IFC file updated successfully."})
-    
     except Exception as e:
         logging.error(f"An error occurred: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    #finally:
-        # Optionally clean up temporary files
-     #   if os.path.exists(local_file_path):
-      #      os.remove(local_file_path)
+
+@app.route('/api/materials', methods=['POST'])
+def get_materials():
+    """
+    Returns {material_name: {color: count}} for a version, streamed as JSON.
+    The inventory is computed once per model and served from the model cache or its sidecar afterwards.
+    """
+    data = request.get_json(silent=True)
+    error_response = validate_materials_request(data)
+    if error_response:
+        return error_response
+
+    try:
+        with Workspace(workspace_root, workspace_quota_bytes, keep=keep_workspaces) as workspace:
+            cached_model = load_cached_model(workspace, data['projectID'], data['versionID'], data['accessToken'])
+            materials_dict = cached_model.ensure_material_inventory(build_material_inventory)
+    except AccessDenied as e:
+        return jsonify({'error': str(e)}), 403
+    except Exception as e:
+        logging.error(f"An error occurred: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    def generate():
+        yield '{'
+        for position, (material_name, colors) in enumerate(materials_dict.items()):
+            yield (',' if position else '') + json.dumps({material_name: colors})[1:-1]
+        yield '}'
+
+    return app.response_class(generate(), mimetype='application/json')
+
+@app.route('/api/update_ifc/jobs', methods=['POST'])
+def submit_update_job():
+    """
+    Queues an update on the worker pool and returns its job id immediately.
+    """
+    try:
+        data = read_update_request()
+    except PayloadError as e:
+        return jsonify({'error': str(e)}), 400
+    error_response = validate_update_request(data)
+    if error_response:
+        return error_response
+    try:
+        compiled_rules = compile_rules(data.get('rules', []))
+    except RuleError as e:
+        return jsonify({'error': str(e)}), 400
+
+    job = job_manager.submit(process_update_request, data, compiled_rules, profile=profiling_requested())
+    return jsonify({"jobId": job.id, "status": job.status}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Stage timings and counters of all update requests since start, in the Prometheus text format.
+    """
+    return app.response_class(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     port = 8001
-    print(f"Starting server on port {port}")
+    logging.info(f"Starting server on port {port}")
     app.run(port=port)
 
 
@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Override with APS_BASE_URL to run against a local mock (see mock_aps.py)
+APS_BASE_URL = os.environ.get("APS_BASE_URL", "https://developer.api.autodesk.com")
+
+# Methods that are safe to resend after a server error or a dropped connection.
+# Non-idempotent calls (storage/item/version creation) are only retried on 429, which the server rejected unprocessed.
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# Statuses Data Management answers a token with that may not read a resource
+ACCESS_DENIED_STATUS_CODES = (401, 403, 404)
+
+
+class AccessDenied(Exception):
+    """Raised when APS refuses a token access to a version or item."""
+
+
+class LookupCache:
+    """
+    Small thread-safe LRU cache with a time-to-live, for Data Management lookups.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def token_key(access_token):
+    """Cache entries are scoped per token so one user never sees another user's lookups."""
+    return hashlib.sha256(access_token.encode()).hexdigest()[:16]
+
+
+class ApsClient:
+    """
+    Shared client for Autodesk Platform Services calls.
+    Keeps connections alive through one pooled session, applies timeouts, retries with exponential backoff
+    (honoring Retry-After on 429) and caches version and item lookups.
+    """
+
+    def __init__(self, pool_size=16, timeout=(10, 120), max_retries=5, backoff_seconds=0.5, max_backoff_seconds=30):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.version_details_cache = LookupCache()
+        self.item_details_cache = LookupCache()
+
+    def retry_delay(self, attempt, response=None):
+        if response is not None and response.headers.get("Retry-After"):
+            try:
+                return min(float(response.headers["Retry-After"]), self.max_backoff_seconds)
+            except ValueError:
+                pass  # HTTP-date form, fall back to backoff
+        return min(self.backoff_seconds * 2 ** attempt, self.max_backoff_seconds)
+
+    def request(self, method, url, retry=True, **kwargs):
+        """
+        Sends a request through the pooled session and retries throttled or failed calls.
+        Returns the last response; callers check its status code as before.
+        With retry=False the request is sent once, for callers that retry on their own.
+        """
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+        max_retries = self.max_retries if retry else 0
+
+        for attempt in range(max_retries + 1):
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if method not in IDEMPOTENT_METHODS or attempt == max_retries:
+                    raise
+                delay = self.retry_delay(attempt)
+                logging.warning(f"{method} {url} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            retryable = response.status_code == 429 or (
+                response.status_code in RETRY_STATUS_CODES and method in IDEMPOTENT_METHODS
+            )
+            if not retryable or attempt == max_retries:
+                return response
+
+            delay = self.retry_delay(attempt, response)
+            logging.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def get_version_details(self, project_id, version_id, access_token):
+        """
+        Returns the Data Management JSON of a version, fetched at most once per token within the cache TTL.
+        Raises AccessDenied if the token may not read the version, and Exception for other failures.
+        """
+        key = (token_key(access_token), project_id, version_id)
+        version_details = self.version_details_cache.get(key)
+        if version_details is not None:
+            return version_details
+
+        encoded_version_id = urllib.parse.quote(version_id, safe='')
+        url = f"{APS_BASE_URL}/data/v1/projects/{project_id}/versions/{encoded_version_id}"
+        response = self.get(url, headers={"Authorization": f"Bearer {access_token}"})
+        if response.status_code in ACCESS_DENIED_STATUS_CODES:
+            raise AccessDenied(f"Access to version {version_id} denied: {response.status_code}")
+        if response.status_code != 200:
+            raise Exception(f"Failed to get version details: {response.status_code} - {response.text}")
+
+        version_details = response.json()
+        self.version_details_cache.put(key, version_details)
+        return version_details
+
+    def get_item_details(self, project_id, item_id, access_token):
+        """
+        Returns the Data Management JSON of an item, cached like get_version_details.
+        """
+        key = (token_key(access_token), project_id, item_id)
+        item_details = self.item_details_cache.get(key)
+        if item_details is not None:
+            return item_details
+
+        encoded_item_id = urllib.parse.quote(item_id, safe='')
+        url = f"{APS_BASE_URL}/data/v1/projects/{project_id}/items/{encoded_item_id}"
+        response = self.get(url, headers={"Authorization": f"Bearer {access_token}"})
+        if response.status_code in ACCESS_DENIED_STATUS_CODES:
+            raise AccessDenied(f"Access to item {item_id} denied: {response.status_code}")
+        if response.status_code != 200:
+            raise Exception(f"Failed to get item details: {response.status_code} - {response.text}")
+
+        item_details = response.json()
+        self.item_details_cache.put(key, item_details)
+        return item_details
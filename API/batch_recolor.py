@@ -0,0 +1,226 @@
+"""
+Offline batch recolor of local IFC files.
+
+Applies the same styling as /api/update_ifc to many files without APS, one model per worker process:
+
+    python batch_recolor.py Models/ --rules colors.json --output-dir Recolored/ --summary summary.json
+
+The input is a directory (every *.ifc in it) or a JSON manifest listing files, each either a path or
+{"path": ..., "output": ..., "rules": ...} to override the output path or the rules for that file.
+Rules use the shape of the update payload, [{"color": "#RRGGBB", "ifcGUIDs": [...]}, ...], where a
+rule may instead select elements like the rules of /api/update_ifc, e.g. {"ifcType": "IfcWall",
+"material": "Beton*", "color": ...} (see rules.py). {"elements": [...], "rules": [...]} is accepted too.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from guid_index import GuidIndex
+from model_cache import open_ifc_model
+from patch_writer import StepIndex, StepIndexError, write_patched
+from rules import CompiledRule, SelectorIndex
+from styles import build_style_cache, build_styled_item_index, hex_to_rgb, isValidHex, purge_styles
+from styling_engine import update_element_and_children_colors
+from traversal import TraversalCache
+
+
+def load_rules(rules):
+    """
+    Returns the list of color rules from a rules file path or an already loaded rules value.
+    """
+    if isinstance(rules, str):
+        with open(rules, "r", encoding="utf-8") as file:
+            rules = json.load(file)
+    if isinstance(rules, dict):
+        rules = rules.get("elements", []) + rules.get("rules", [])
+    return rules
+
+
+def load_batch(source, default_rules, output_directory):
+    """
+    Expands a directory or manifest into tasks of (input path, output path, rules).
+    """
+    if os.path.isdir(source):
+        entries = sorted(
+            os.path.join(source, name) for name in os.listdir(source) if name.lower().endswith(".ifc")
+        )
+        base_directory = source
+    else:
+        with open(source, "r", encoding="utf-8") as file:
+            entries = json.load(file)
+        base_directory = os.path.dirname(os.path.abspath(source))
+
+    tasks = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"path": entry}
+        input_path = os.path.join(base_directory, entry["path"]) if not os.path.isabs(entry["path"]) else entry["path"]
+        output_path = entry.get("output") or os.path.join(output_directory, os.path.basename(input_path))
+        rules = load_rules(entry["rules"]) if "rules" in entry else default_rules
+        if os.path.abspath(output_path) == os.path.abspath(input_path):
+            raise ValueError(f"Output would overwrite the input file {input_path}")
+        tasks.append((input_path, output_path, rules))
+    return tasks
+
+
+def resolve_rule_roots(rule, ifc_file, guid_index, selector_index):
+    """
+    Returns the STEP ids a rule selects and the GUIDs it names that are not in the model.
+    """
+    if "ifcGUIDs" in rule:
+        (root_ids,), missing_guids = guid_index.resolve_groups([rule["ifcGUIDs"]], ifc_file)
+        return root_ids, missing_guids
+    return CompiledRule.compile(rule).evaluate(selector_index, ifc_file), []
+
+
+def recolor_file(input_path, output_path, rules, keep_styles=False, patch_write=True):
+    """
+    Recolors one IFC file and writes the result. Runs inside a worker process.
+    Returns the per-file summary: timings in seconds, entity counts and unresolved GUIDs.
+    """
+    timings = {}
+    start_time = time.perf_counter()
+    summary = {"path": input_path, "output": output_path, "status": "success"}
+
+    try:
+        ifc_file = open_ifc_model(input_path)
+        timings["open"] = time.perf_counter() - start_time
+        first_new_id = ifc_file.get_max_id() + 1
+
+        if patch_write:
+            # Record the changes so only they are serialized on write
+            ifc_file.set_history_size(1)
+            ifc_file.begin_transaction()
+
+        removed_style_count = 0
+        if not keep_styles:
+            removed_style_count, timings["purge"] = purge_styles(ifc_file)
+
+        step_start = time.perf_counter()
+        styled_item_index = build_styled_item_index(ifc_file)
+        style_cache = build_style_cache(ifc_file)
+        guid_index = GuidIndex.build(ifc_file)
+        selector_index = SelectorIndex.build(ifc_file)
+        traversal_cache = TraversalCache()
+        styled_root_count, styled_mapped_item_count, skipped_rules, missing_guids = 0, 0, 0, []
+
+        for rule in rules:
+            hex_color = rule.get("color")
+            if not hex_color or not isValidHex(hex_color):
+                skipped_rules += 1
+                continue
+            root_ids, rule_missing_guids = resolve_rule_roots(rule, ifc_file, guid_index, selector_index)
+            missing_guids.extend(rule_missing_guids)
+
+            # Every root shares the traversal cache, so walks overlapping earlier roots are not repeated
+            rgb = hex_to_rgb(hex_color)
+            for root_id in root_ids:
+                update_element_and_children_colors(
+                    ifc_file, ifc_file.by_id(root_id), rgb, styled_item_index, style_cache,
+                    traversal_cache=traversal_cache,
+                )
+            styled_root_count += len(root_ids)
+            styled_mapped_item_count += len(traversal_cache.mapped_items_for_roots(ifc_file, root_ids))
+        timings["style"] = time.perf_counter() - step_start
+
+        step_start = time.perf_counter()
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        patched = False
+        if patch_write:
+            try:
+                write_patched(ifc_file, StepIndex.build(input_path), input_path, output_path)
+                patched = True
+            except StepIndexError as e:
+                logging.warning(f"Writing {output_path} fully: {e}")
+        if not patched:
+            ifc_file.write(output_path)
+        timings["write"] = time.perf_counter() - step_start
+
+        summary.update({
+            "entities": {
+                "created": ifc_file.get_max_id() - first_new_id + 1,
+                "removed": removed_style_count,
+            },
+            "styledElements": styled_root_count,
+            "styledMappedItems": styled_mapped_item_count,
+            "skippedRules": skipped_rules,
+            "missingGUIDs": missing_guids,
+        })
+    except Exception as e:
+        logging.error(f"Failed to recolor {input_path}: {str(e)}")
+        summary.update({"status": "error", "error": str(e)})
+
+    timings["total"] = time.perf_counter() - start_time
+    summary["seconds"] = {stage: round(seconds, 3) for stage, seconds in timings.items()}
+    return summary
+
+
+def run_batch(tasks, workers=None, keep_styles=False, patch_write=True):
+    """
+    Recolors every task in a process pool, one model per worker at a time.
+    Returns the per-file summaries in task order plus the batch totals.
+    """
+    start_time = time.perf_counter()
+    results = [None] * len(tasks)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(recolor_file, input_path, output_path, rules, keep_styles, patch_write): position
+            for position, (input_path, output_path, rules) in enumerate(tasks)
+        }
+        for future in as_completed(futures):
+            result = results[futures[future]] = future.result()
+            logging.info(f"{result['status']}: {result['path']} in {result['seconds']['total']}s")
+
+    succeeded = [result for result in results if result["status"] == "success"]
+    return {
+        "files": results,
+        "totals": {
+            "files": len(results),
+            "succeeded": len(succeeded),
+            "failed": len(results) - len(succeeded),
+            "entitiesCreated": sum(result["entities"]["created"] for result in succeeded),
+            "entitiesRemoved": sum(result["entities"]["removed"] for result in succeeded),
+            "seconds": round(time.perf_counter() - start_time, 3),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply color rules to many local IFC files.")
+    parser.add_argument("source", help="directory of .ifc files or a JSON manifest")
+    parser.add_argument("--rules", help="JSON color rules applied to every file without its own rules")
+    parser.add_argument("--output-dir", default="Recolored", help="where recolored files are written")
+    parser.add_argument("--summary", help="write the JSON summary to this file instead of stdout")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--keep-styles", action="store_true", help="don't purge existing styles first")
+    parser.add_argument("--full-write", action="store_true", help="rewrite whole files instead of patching")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s - %(levelname)s - %(message)s")
+
+    default_rules = load_rules(args.rules) if args.rules else []
+    tasks = load_batch(args.source, default_rules, args.output_dir)
+    if not tasks:
+        logging.error(f"No IFC files found in {args.source}")
+        return 1
+
+    batch_summary = run_batch(tasks, args.workers, args.keep_styles, not args.full_write)
+
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as file:
+            json.dump(batch_summary, file, indent=2)
+    else:
+        json.dump(batch_summary, sys.stdout, indent=2)
+        print()
+
+    return 0 if batch_summary["totals"]["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
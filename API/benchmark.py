@@ -0,0 +1,334 @@
+"""
+Benchmarks of the recolor pipeline over the bundled Temp/*.ifc models and synthetic scaled-up copies.
+
+Every run downloads a model from a local mock APS server (mock_aps.py), then parses it, purges the styles,
+resolves the GUIDs of a payload that colors every product, styles it with one of the styling strategies,
+writes it and uploads it back. Each stage records wall time, peak RSS (null where the platform can't
+report it) and entities created:
+
+    python benchmark.py --scales 4 16 --repeat 3 --output benchmark.json
+
+Each run happens in a fresh process so its memory figures don't include earlier runs.
+Scaled models are generated once into --synthetic-dir and reused by later benchmarks.
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ifcopenshell
+import ifcopenshell.guid
+
+from mock_aps import MockApsServer
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is reported as null there
+    resource = None
+
+TEMP_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Temp")
+
+# Styling strategies of the styling engine; "mapped" is the default of /api/update_ifc
+VARIANTS = ("mapped", "deep", "material")
+
+# Colors of the benchmark payload, assigned to the products round-robin
+PALETTE = ("#FF0000", "#00FF88", "#3366CC", "#FFCC00", "#884400", "#AA00FF")
+
+PROJECT_ID = "mock-project"
+ACCESS_TOKEN = "mock-token"
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class RssSampler:
+    """
+    Samples the RSS of the process in a background thread to find the peak within one stage.
+    Falls back to the process-lifetime peak from getrusage where RSS can't be sampled, and leaves
+    the peak as None where neither is available.
+    """
+
+    def __init__(self, interval_seconds=0.002):
+        self.interval_seconds = interval_seconds
+        self.peak = current_rss()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stopped.wait(self.interval_seconds):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        if self.peak is not None:
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.peak is None:
+            if resource is not None:
+                # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+                max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                self.peak = max_rss if sys.platform == "darwin" else max_rss * 1024
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class StageRecorder:
+    """
+    Collects the measurements of the stages of one run.
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name, ifc_file=None):
+        """
+        Measures a stage. Entities created are counted from the id counter of ifc_file, if given.
+        The yielded dict takes extra values to record; a failing stage records its error and re-raises.
+        """
+        result = {"name": name}
+        first_new_id = ifc_file.get_max_id() + 1 if ifc_file is not None else None
+        sampler = RssSampler()
+        start_time = time.perf_counter()
+        try:
+            with sampler:
+                yield result
+        except BaseException as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            result["seconds"] = round(time.perf_counter() - start_time, 4)
+            result["peakRssBytes"] = sampler.peak
+            if first_new_id is not None:
+                result["entitiesCreated"] = ifc_file.get_max_id() - first_new_id + 1
+            self.stages.append(result)
+
+
+def generate_scaled_model(source_path, factor, directory):
+    """
+    Writes a model holding `factor` copies of the source model, each with fresh GlobalIds,
+    and returns its path. An existing file from an earlier benchmark is reused.
+    """
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    output_path = os.path.join(directory, f"{stem}-x{factor}.ifc")
+    if os.path.exists(output_path):
+        return output_path
+
+    start_time = time.perf_counter()
+    scaled_model = ifcopenshell.open(source_path)
+    for _ in range(factor - 1):
+        # A freshly opened copy, so add() duplicates every entity instead of reusing earlier copies
+        copy = ifcopenshell.open(source_path)
+        for root in copy.by_type("IfcRoot"):
+            root.GlobalId = ifcopenshell.guid.new()
+        for entity in copy:
+            scaled_model.add(entity)
+
+    os.makedirs(directory, exist_ok=True)
+    scaled_model.write(output_path)
+    logging.info(f"Generated {output_path} ({factor}x) in {time.perf_counter() - start_time:.1f}s")
+    return output_path
+
+
+def build_payload(ifc_file, group_count):
+    """
+    Color groups covering every product of the model, like a save of the web client.
+    """
+    groups = [{"ifcGUIDs": [], "color": PALETTE[position % len(PALETTE)]} for position in range(group_count)]
+    for position, product in enumerate(ifc_file.by_type("IfcProduct")):
+        groups[position % group_count]["ifcGUIDs"].append(product.GlobalId)
+    return groups
+
+
+def style_groups(app, variant, ifc_file, element_groups, colors, styled_item_index, style_cache):
+    """
+    Styles the resolved groups with one strategy.
+    Returns the number of styled roots and the dry-run plan of the styling, taken before it was applied.
+    """
+    from traversal import TraversalCache
+
+    engine = app.StylingEngine(ifc_file, variant, TraversalCache(), styled_item_index, style_cache)
+    color_groups = [(app.hex_to_rgb(hex_color), element_ids) for element_ids, hex_color in zip(element_groups, colors)]
+    plan = engine.dry_run(color_groups)
+    for rgb, element_ids in color_groups:
+        engine.style_group(element_ids, rgb)
+    return sum(len(element_ids) for element_ids in element_groups), plan
+
+
+def run_benchmark(model_path, version_id, variant, group_count, network):
+    """
+    One benchmark run of a model with one styling variant, in a fresh worker process.
+    Returns the run record with its stages; a failing stage ends the run and is recorded.
+    """
+    # Imported here so the worker picks up APS_BASE_URL of the mock server
+    import app
+    from guid_index import GuidIndex
+    from model_cache import open_ifc_model
+    from patch_writer import StepIndex, write_patched
+
+    logging.getLogger().setLevel(logging.WARNING)
+    recorder = StageRecorder()
+    run = {"model": os.path.basename(model_path), "variant": variant, "stages": recorder.stages}
+
+    # The pipeline prints progress; keep stdout free for the JSON results
+    with tempfile.TemporaryDirectory(prefix="ifc-benchmark-") as directory, contextlib.redirect_stdout(sys.stderr):
+        downloaded_path = os.path.join(directory, "download.ifc")
+        output_path = os.path.join(directory, "output.ifc")
+        try:
+            if network:
+                with recorder.stage("download") as stage:
+                    app.download_ifc_file(PROJECT_ID, version_id, ACCESS_TOKEN, downloaded_path)
+                    stage["bytes"] = os.path.getsize(downloaded_path)
+            else:
+                downloaded_path = model_path
+
+            with recorder.stage("parse") as stage:
+                ifc_file = open_ifc_model(downloaded_path, app.lazy_parsing)
+            run["entities"] = ifc_file.get_max_id()
+
+            # Record the changes like a checked-out cached model, so the patch writer can be measured
+            ifc_file.set_history_size(1)
+            ifc_file.begin_transaction()
+
+            with recorder.stage("purge", ifc_file) as stage:
+                stage["entitiesRemoved"], _ = app.purge_styles(ifc_file)
+
+            with recorder.stage("index", ifc_file):
+                styled_item_index = app.build_styled_item_index(ifc_file)
+                style_cache = app.build_style_cache(ifc_file)
+
+            payload = build_payload(ifc_file, group_count)
+            with recorder.stage("resolveGUIDs", ifc_file) as stage:
+                element_groups, missing_guids = GuidIndex.build(ifc_file).resolve_groups(
+                    [group["ifcGUIDs"] for group in payload], ifc_file
+                )
+                stage["guids"] = sum(len(group["ifcGUIDs"]) for group in payload)
+                stage["missing"] = len(missing_guids)
+
+            with recorder.stage("style", ifc_file) as stage, contextlib.redirect_stdout(io.StringIO()):
+                stage["roots"], run["plan"] = style_groups(
+                    app, variant, ifc_file, element_groups, [group["color"] for group in payload],
+                    styled_item_index, style_cache,
+                )
+
+            with recorder.stage("writePatched") as stage:
+                stage["serializedEntities"] = write_patched(
+                    ifc_file, StepIndex.build(downloaded_path), downloaded_path, output_path
+                )
+                stage["bytes"] = os.path.getsize(output_path)
+
+            with recorder.stage("writeFull") as stage:
+                ifc_file.write(output_path)
+                stage["bytes"] = os.path.getsize(output_path)
+
+            if network:
+                with recorder.stage("upload") as stage:
+                    app.upload_to_cloud(PROJECT_ID, version_id, output_path, run["model"], ACCESS_TOKEN)
+                    stage["bytes"] = os.path.getsize(output_path)
+
+            run["status"] = "success"
+        except BaseException as e:
+            if isinstance(e, KeyboardInterrupt):
+                raise
+            run["status"] = "error"
+            run["error"] = f"{type(e).__name__}: {e}"
+
+    return run
+
+
+def environment_info():
+    return {
+        "python": sys.version.split()[0],
+        "ifcopenshell": ifcopenshell.version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the IFC recolor pipeline.")
+    parser.add_argument("--models", nargs="*", help="IFC files to benchmark (default: Temp/*.ifc)")
+    parser.add_argument("--scale-source", default=os.path.join(TEMP_DIRECTORY, "temp2.ifc"),
+                        help="model the synthetic scaled-up models are copied from")
+    parser.add_argument("--scales", nargs="*", type=int, default=[4], help="copies per synthetic model")
+    parser.add_argument("--synthetic-dir", default=os.path.join(TEMP_DIRECTORY, "benchmarks"))
+    parser.add_argument("--variants", nargs="*", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--groups", type=int, default=4, help="color groups in the payload")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--no-network", action="store_true", help="skip the mock download and upload")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    model_paths = args.models or sorted(glob.glob(os.path.join(TEMP_DIRECTORY, "*.ifc")))
+    scaled = {}
+    for factor in args.scales:
+        if factor > 1:
+            scaled_path = generate_scaled_model(args.scale_source, factor, args.synthetic_dir)
+            model_paths.append(scaled_path)
+            scaled[scaled_path] = factor
+
+    server = MockApsServer().start()
+    os.environ["APS_BASE_URL"] = server.base_url
+    version_ids = {
+        model_path: server.add_version(f"urn:adsk.wipprod:fs.file:vf.{position}?version=1", model_path)
+        for position, model_path in enumerate(model_paths)
+    }
+
+    runs = []
+    try:
+        # One process per run, so peak RSS and caches start from the same baseline every time
+        context = multiprocessing.get_context("spawn")
+        for model_path in model_paths:
+            for variant in args.variants:
+                for repeat in range(args.repeat):
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        run = executor.submit(
+                            run_benchmark, model_path, version_ids[model_path], variant, args.groups,
+                            not args.no_network,
+                        ).result()
+                    run.update({
+                        "repeat": repeat,
+                        "scale": scaled.get(model_path, 1),
+                        "fileBytes": os.path.getsize(model_path),
+                    })
+                    runs.append(run)
+                    total_seconds = sum(stage["seconds"] for stage in run["stages"])
+                    logging.info(f"{run['model']} {variant} #{repeat}: {run['status']} in {total_seconds:.2f}s")
+    finally:
+        server.stop()
+
+    results = {"environment": environment_info(), "runs": runs}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
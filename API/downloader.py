@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from workspace import WorkspaceQuotaExceeded
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_PARALLELISM = 4
+DEFAULT_MAX_RETRIES = 3
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+def file_digest(file_path, algorithm, chunk_size=1024 * 1024):
+    digest = hashlib.new(algorithm)
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_checksum(file_path, expected_sha1=None, etag=None):
+    """
+    Checks a downloaded file against the SHA-1 reported by OSS, or else against a plain MD5 ETag.
+    Multipart ETags ("<md5>-<parts>") are not content hashes and are skipped.
+    """
+    if expected_sha1:
+        actual = file_digest(file_path, "sha1")
+        if actual.lower() != expected_sha1.lower():
+            raise ChecksumMismatch(f"SHA-1 mismatch for {file_path}: expected {expected_sha1}, got {actual}")
+        return "sha1"
+
+    etag = (etag or "").strip('"')
+    if re.fullmatch(r"[0-9a-fA-F]{32}", etag):
+        actual = file_digest(file_path, "md5")
+        if actual.lower() != etag.lower():
+            raise ChecksumMismatch(f"MD5 mismatch for {file_path}: expected {etag}, got {actual}")
+        return "md5"
+
+    return None
+
+
+def parse_content_range_total(content_range):
+    """Returns the total size from a 'bytes start-end/total' Content-Range header, or None."""
+    match = re.match(r"bytes \d+-\d+/(\d+)", content_range or "")
+    return int(match.group(1)) if match else None
+
+
+def is_retryable_status(status_code):
+    """Throttling and server errors may pass; other client errors (expired URL, missing object) won't."""
+    return status_code == 429 or status_code >= 500
+
+
+def get_with_retries(session, url, headers, max_retries, stream=False, expected_length=None):
+    """
+    GETs url, retrying connection errors, short reads, 429 and 5xx responses with exponential backoff.
+    Other HTTP errors are raised right away.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            response = session.get(url, headers=headers, stream=stream, timeout=60)
+            response.raise_for_status()
+            if expected_length is not None and len(response.content) != expected_length:
+                raise IOError(f"Short read: expected {expected_length} bytes, got {len(response.content)}")
+            return response
+        except (requests.RequestException, IOError) as e:
+            if isinstance(e, requests.HTTPError) and not is_retryable_status(e.response.status_code):
+                raise
+            if attempt == max_retries:
+                raise
+            delay = 2 ** attempt * 0.5
+            logging.warning(f"GET {headers.get('Range', 'full')} failed ({e}), retrying in {delay}s")
+            time.sleep(delay)
+
+
+def download_file_ranged(signed_url, local_file_path, chunk_size=DEFAULT_CHUNK_SIZE, parallelism=DEFAULT_PARALLELISM,
+                         max_retries=DEFAULT_MAX_RETRIES, expected_sha1=None, progress=None, max_bytes=None,
+                         session=None):
+    """
+    Downloads a file with concurrent HTTP Range requests into a preallocated local file.
+    Each chunk is retried on its own; the file is checksum-verified at the end.
+    Servers that ignore Range get a single streamed download instead.
+    Returns the number of downloaded bytes.
+    """
+    session = session or requests.Session()
+    start_time = time.perf_counter()
+
+    # The first chunk doubles as the size probe, since signed GET URLs don't allow HEAD
+    first_response = get_with_retries(session, signed_url, {"Range": f"bytes=0-{chunk_size - 1}"}, max_retries, stream=True)
+    etag = first_response.headers.get("ETag")
+    total_size = parse_content_range_total(first_response.headers.get("Content-Range"))
+
+    if first_response.status_code != 206 or total_size is None:
+        # No range support: stream the whole body over the single connection
+        connections = 1
+        if progress:
+            content_length = first_response.headers.get("Content-Length")
+            progress.start("download", int(content_length) if content_length else None)
+        total_size = 0
+        with open(local_file_path, "wb") as file:
+            for chunk in first_response.iter_content(chunk_size=1024 * 1024):
+                total_size += len(chunk)
+                if max_bytes is not None and total_size > max_bytes:
+                    raise WorkspaceQuotaExceeded(f"Download exceeds the workspace quota of {max_bytes} bytes")
+                file.write(chunk)
+                if progress:
+                    progress.advance("download", len(chunk))
+    else:
+        connections = parallelism
+        if max_bytes is not None and total_size > max_bytes:
+            raise WorkspaceQuotaExceeded(f"File of {total_size} bytes exceeds the workspace quota of {max_bytes} bytes")
+        if progress:
+            progress.start("download", total_size)
+
+        # The probe is the first chunk, so it gets the same short-read check and retries as the others
+        first_length = min(chunk_size, total_size)
+        try:
+            first_content = first_response.content
+        except requests.RequestException as e:
+            first_content = None
+            logging.warning(f"Reading the first chunk failed ({e}), retrying")
+        if first_content is None or len(first_content) != first_length:
+            if first_content is not None:
+                logging.warning(f"Short read of the first chunk: expected {first_length} bytes, got {len(first_content)}")
+            first_content = get_with_retries(
+                session, signed_url, {"Range": f"bytes=0-{first_length - 1}"}, max_retries, expected_length=first_length
+            ).content
+
+        # Preallocate so every chunk can be written at its own offset
+        with open(local_file_path, "wb") as file:
+            file.truncate(total_size)
+            file.seek(0)
+            file.write(first_content)
+        if progress:
+            progress.advance("download", len(first_content))
+
+        def download_chunk(start):
+            end = min(start + chunk_size, total_size) - 1
+            response = get_with_retries(
+                session, signed_url, {"Range": f"bytes={start}-{end}"}, max_retries, expected_length=end - start + 1
+            )
+            # Each chunk writes its own byte range through its own handle
+            with open(local_file_path, "r+b") as file:
+                file.seek(start)
+                file.write(response.content)
+            if progress:
+                progress.advance("download", len(response.content))
+
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="ifc-download") as executor:
+            # list() re-raises the first failed chunk
+            list(executor.map(download_chunk, range(chunk_size, total_size, chunk_size)))
+
+    elapsed = time.perf_counter() - start_time
+    verified_with = verify_checksum(local_file_path, expected_sha1, etag)
+    throughput = total_size / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+    logging.info(
+        f"Downloaded {total_size} bytes in {elapsed:.2f}s ({throughput:.1f} MB/s, "
+        f"{connections} connections, checksum {verified_with or 'not available'})"
+    )
+    return total_size
@@ -0,0 +1,83 @@
+"""
+Streaming export of a recolored model into a sink, without a temporary file.
+
+A sink is a binary writable with finish() and abort(): MultipartUploadStream (uploader.py) sends what is
+written straight to OSS, LocalFileSink writes a local file for tests and offline use.
+"""
+import gzip
+import os
+import uuid
+
+GZIP_LEVEL = 6
+
+
+class LocalFileSink:
+    """
+    Sink that writes into a local file, which only appears under its final path once finish() succeeds.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.partial_path = f"{file_path}.{uuid.uuid4().hex}.part"
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.partial_path, "wb")
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def finish(self):
+        self.file.close()
+        os.replace(self.partial_path, self.file_path)
+        return {"path": self.file_path}
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.partial_path)
+        except FileNotFoundError:
+            pass
+
+
+class CountingWriter:
+    """
+    Passes writes through to a sink and counts the bytes that reach it.
+    With a JobProgress, every write also advances its stage by the written bytes.
+    """
+
+    def __init__(self, sink, progress=None, stage="write"):
+        self.sink = sink
+        self.progress = progress
+        self.stage = stage
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.sink.write(data)
+        self.bytes_written += len(data)
+        if self.progress:
+            self.progress.advance(self.stage, len(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def export_to_sink(sink, write_content, compress=False):
+    """
+    Calls write_content(writable) to produce the file content, streams it into the sink, gzip-compressed
+    if compress is set, and finishes the sink. The sink is aborted if anything fails.
+    Returns the result of sink.finish() and the number of bytes the sink received.
+    """
+    writer = CountingWriter(sink)
+    try:
+        if compress:
+            with gzip.GzipFile(fileobj=writer, mode="wb", compresslevel=GZIP_LEVEL) as output:
+                write_content(output)
+        else:
+            write_content(writer)
+        result = sink.finish()
+    except BaseException:
+        sink.abort()
+        raise
+    return result, writer.bytes_written
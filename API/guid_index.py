@@ -0,0 +1,69 @@
+import logging
+import time
+from itertools import chain, islice
+
+# Only these entities can be colored; any other identifier is reported as missing
+COLORABLE_TYPES = ("IfcProduct", "IfcTypeObject")
+
+
+class GuidIndex:
+    """
+    Maps the identifiers the web client sends to STEP ids of one model.
+    Accepts IFC GlobalIds (22-character strings) and STEP ids (ints, "123" or "#123")
+    of products and type objects.
+    Holds ids rather than entity instances so it stays valid across request transactions.
+    """
+
+    def __init__(self, ids_by_guid):
+        self.ids_by_guid = ids_by_guid
+
+    @classmethod
+    def build(cls, ifc_file):
+        start_time = time.perf_counter()
+        ids_by_guid = {
+            entity.GlobalId: entity.id() for type_name in COLORABLE_TYPES for entity in ifc_file.by_type(type_name)
+        }
+        logging.info(f"Indexed {len(ids_by_guid)} GlobalIds in {time.perf_counter() - start_time:.3f}s")
+        return cls(ids_by_guid)
+
+    def resolve_step_id(self, identifier, ifc_file):
+        if isinstance(identifier, int):
+            step_id = identifier
+        elif isinstance(identifier, str) and identifier.lstrip("#").isdigit():
+            step_id = int(identifier.lstrip("#"))
+        else:
+            return None
+
+        # STEP ids are only valid if the model actually has that instance and it can be colored
+        try:
+            entity = ifc_file.by_id(step_id)
+        except RuntimeError:
+            return None
+        return step_id if any(entity.is_a(type_name) for type_name in COLORABLE_TYPES) else None
+
+    def resolve_one(self, identifier, ifc_file):
+        step_id = self.ids_by_guid.get(identifier)
+        return step_id if step_id is not None else self.resolve_step_id(identifier, ifc_file)
+
+    def resolve_groups(self, groups, ifc_file):
+        """
+        Resolves the identifiers of every color group in one pass.
+        All identifiers are looked up in the GlobalId map at once; only the misses are tried as STEP ids.
+        Returns a list of STEP id lists (one per group, in order) and the identifiers that were not found.
+        Identifiers must be strings or ints.
+        """
+        groups = [list(identifiers) for identifiers in groups]
+        identifiers = list(chain.from_iterable(groups))
+        step_ids = list(map(self.ids_by_guid.get, identifiers))
+
+        missing = []
+        for position in [position for position, step_id in enumerate(step_ids) if step_id is None]:
+            step_id = step_ids[position] = self.resolve_step_id(identifiers[position], ifc_file)
+            if step_id is None:
+                missing.append(identifiers[position])
+
+        resolved = iter(step_ids)
+        resolved_groups = [
+            [step_id for step_id in islice(resolved, len(group)) if step_id is not None] for group in groups
+        ]
+        return resolved_groups, missing
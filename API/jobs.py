@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Stages reported by a save job, in the order they run
+JOB_STAGES = ("download", "style", "write", "upload")
+
+
+class JobProgress:
+    """
+    Thread-safe per-stage progress of one job.
+    Each stage holds a done counter and an optional total (bytes for transfers, elements for styling).
+    """
+
+    def __init__(self, stages=JOB_STAGES):
+        self.lock = threading.Lock()
+        self.stages = {stage: {"done": 0, "total": None} for stage in stages}
+        self.current_stage = None
+
+    def start(self, stage, total=None):
+        with self.lock:
+            self.current_stage = stage
+            self.stages[stage] = {"done": 0, "total": total}
+
+    def advance(self, stage, amount=1):
+        with self.lock:
+            self.stages[stage]["done"] += amount
+
+    def set_total(self, stage, total):
+        with self.lock:
+            self.stages[stage]["total"] = total
+
+    def finish(self, stage):
+        """Sets the total of a stage to its done counter, for stages that started with an estimated total."""
+        with self.lock:
+            self.stages[stage]["total"] = self.stages[stage]["done"]
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "currentStage": self.current_stage,
+                "stages": {stage: dict(values) for stage, values in self.stages.items()},
+            }
+
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.progress = JobProgress()
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "progress": self.progress.snapshot(),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded thread pool and keeps their status for polling.
+    Finished jobs are forgotten retention_seconds after they end.
+    """
+
+    def __init__(self, max_workers, retention_seconds=3600):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ifc-job")
+        self.retention_seconds = retention_seconds
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, work, *args, **kwargs):
+        """
+        Queues work(*args, progress=..., **kwargs) and returns the Job right away.
+        """
+        job = Job()
+        with self.lock:
+            self.forget_finished_jobs()
+            self.jobs[job.id] = job
+        self.executor.submit(self.run, job, work, *args, **kwargs)
+        return job
+
+    def run(self, job, work, *args, **kwargs):
+        job.status = "running"
+        try:
+            job.result = work(*args, progress=job.progress, **kwargs)
+            job.status = "succeeded"
+        except Exception as e:
+            logging.error(f"Job {job.id} failed: {str(e)}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def forget_finished_jobs(self):
+        """Must be called with self.lock held."""
+        expiry = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished_at and job.finished_at < expiry]:
+            del self.jobs[job_id]
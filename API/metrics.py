@@ -0,0 +1,143 @@
+import bisect
+import cProfile
+import io
+import logging
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the stage duration histogram buckets
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def snake_case(name):
+    return re.sub(r"(?<=[a-z0-9])([A-Z])", r"_\1", name).lower()
+
+
+class RequestMetrics:
+    """
+    Stage timers, counters and gauges of one update request.
+    Stages that run more than once (e.g. per color group) accumulate their time.
+    Gauges hold sizes that only make sense per request (e.g. model entities) and are never summed.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.stages = {}  # stage -> seconds
+        self.counters = {}  # counter name -> value
+        self.gauges = {}  # gauge name -> value
+
+    @contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start_time
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def to_dict(self):
+        return {
+            "totalSeconds": round(time.perf_counter() - self.start_time, 4),
+            "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+        }
+
+
+class MetricsRegistry:
+    """
+    Process-wide aggregates of the update requests, rendered in the Prometheus text format.
+    Counters of the requests are summed per name; stage times go into one histogram per stage.
+    Request gauges keep the value of the latest request; other gauges are read from callbacks when scraped.
+    """
+
+    def __init__(self, prefix="ifc_update"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.requests = {}  # status -> count
+        self.counters = {}  # counter name -> total
+        self.stage_histograms = {}  # stage -> (bucket counts, sum, count)
+        self.request_gauges = {}  # gauge name -> value of the latest request
+        self.gauges = {}  # metric name -> (help text, callback)
+
+    def observe_request(self, request_metrics, status):
+        with self.lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+            for name, value in request_metrics.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.request_gauges.update(request_metrics.gauges)
+            for stage, seconds in request_metrics.stages.items():
+                bucket_counts, total, count = self.stage_histograms.get(stage, ([0] * len(STAGE_BUCKETS), 0.0, 0))
+                position = bisect.bisect_left(STAGE_BUCKETS, seconds)
+                if position < len(STAGE_BUCKETS):
+                    bucket_counts[position] += 1
+                self.stage_histograms[stage] = (bucket_counts, total + seconds, count + 1)
+
+    def add_gauge(self, name, help_text, callback):
+        self.gauges[name] = (help_text, callback)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            name = f"{self.prefix}_requests_total"
+            lines += [f"# HELP {name} Update requests by outcome.", f"# TYPE {name} counter"]
+            for status, count in sorted(self.requests.items()):
+                lines.append(f'{name}{{status="{status}"}} {count}')
+
+            for counter, value in sorted(self.counters.items()):
+                name = f"{self.prefix}_{snake_case(counter)}_total"
+                lines += [f"# TYPE {name} counter", f"{name} {value}"]
+
+            for gauge, value in sorted(self.request_gauges.items()):
+                name = f"{self.prefix}_{snake_case(gauge)}"
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+
+            name = f"{self.prefix}_stage_seconds"
+            lines += [f"# HELP {name} Time spent per pipeline stage of a request.", f"# TYPE {name} histogram"]
+            for stage, (bucket_counts, total, count) in sorted(self.stage_histograms.items()):
+                cumulative = 0
+                for upper_bound, bucket_count in zip(STAGE_BUCKETS, bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{upper_bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+        for name, (help_text, callback) in sorted(self.gauges.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {callback()}"]
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def profiled(enabled, result, limit=40):
+    """
+    Runs the block under cProfile if enabled and stores the top functions by cumulative time
+    in result["profile"]. Profiling only covers the calling thread.
+    """
+    if not enabled:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Another profiler is already active in this thread
+        logging.warning(f"Profiling skipped: {e}")
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(limit)
+        result["profile"] = output.getvalue()
@@ -0,0 +1,246 @@
+"""
+Local stand-in for the Autodesk Platform Services endpoints the API calls, for offline benchmarks.
+
+Serves version and item lookups, signed S3 downloads (with Range support) and the storage,
+multipart upload and version creation flow. Start it, then point APS_BASE_URL at server.base_url
+before importing app.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKET_KEY = "mock-bucket"
+FOLDER_ID = "urn:adsk.wipprod:fs.folder:mock-folder"
+
+
+class MockApsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(f"mock APS: {format % args}")
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def authorized(self, path):
+        """Signed S3 URLs carry their own authorization; everything else needs one of server.tokens, if set."""
+        if path.startswith("/s3") or self.server.tokens is None:
+            return True
+        return self.headers.get("Authorization", "").removeprefix("Bearer ") in self.server.tokens
+
+    def route(self, method):
+        parsed = urllib.parse.urlparse(self.path)
+        path = urllib.parse.unquote(parsed.path)
+        query = {key: values[0] for key, values in urllib.parse.parse_qs(parsed.query).items()}
+        with self.server.lock:
+            self.server.requests.append((method, path))
+            status = self.server.take_failure(method, path)
+        if status is not None:
+            self.read_body()
+            retry_after = self.server.retry_after if status == 429 else None
+            headers = {"Retry-After": retry_after} if retry_after is not None else None
+            return self.send_json(status, {"error": f"Injected failure {status}"}, headers)
+        if not self.authorized(path):
+            self.read_body()
+            return self.send_json(401, {"error": "Invalid access token"})
+        for route_method, pattern, handler in ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                return handler(self, query, *match.groups())
+        self.send_json(404, {"error": f"{method} {path} is not mocked"})
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_PUT(self):
+        self.route("PUT")
+
+    # Data Management
+
+    def get_version(self, query, project_id, version_id):
+        object_key = self.server.versions.get(version_id)
+        if object_key is None:
+            return self.send_json(404, {"error": f"Unknown version {version_id}"})
+        self.send_json(200, {"data": {"id": version_id, "attributes": {"name": object_key, "displayName": object_key}, "relationships": {
+            "item": {"data": {"type": "items", "id": f"urn:adsk.wipprod:dm.lineage:{object_key}"}},
+            "storage": {"meta": {"link": {
+                "href": f"{self.server.base_url}/oss/v2/buckets/{BUCKET_KEY}/objects/{urllib.parse.quote(object_key)}"
+                        "?scopes=b360project"
+            }}},
+        }}})
+
+    def get_item(self, query, project_id, item_id):
+        self.send_json(200, {"data": {"id": item_id, "relationships": {
+            "parent": {"data": {"type": "folders", "id": FOLDER_ID}},
+        }}})
+
+    def create_storage(self, query, project_id):
+        name = json.loads(self.read_body())["data"]["attributes"]["name"]
+        object_key = f"{uuid.uuid4().hex}-{name}"
+        self.send_json(201, {"data": {"type": "objects", "id": f"urn:adsk.objects:os.object:{BUCKET_KEY}/{object_key}"}})
+
+    def create_item(self, query, project_id):
+        self.read_body()
+        self.send_json(201, {"data": {"type": "items", "id": f"urn:adsk.wipprod:dm.lineage:{uuid.uuid4().hex}"}})
+
+    def create_version(self, query, project_id):
+        self.read_body()
+        self.send_json(201, {"data": {"type": "versions", "id": f"urn:adsk.wipprod:fs.file:vf.{uuid.uuid4().hex}?version=2"}})
+
+    # OSS and S3
+
+    def signed_download(self, query, bucket_key, object_key):
+        data = self.server.objects.get(object_key)
+        if data is None:
+            return self.send_json(404, {"error": f"Unknown object {object_key}"})
+        self.send_json(200, {
+            "url": f"{self.server.base_url}/s3/{urllib.parse.quote(object_key)}",
+            "size": len(data),
+            "sha1": hashlib.sha1(data).hexdigest(),
+        })
+
+    def s3_get(self, query, object_key):
+        data = self.server.objects.get(object_key)
+        if data is None:
+            return self.send_json(404, {"error": f"Unknown object {object_key}"})
+
+        range_match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if range_match:
+            start, end = int(range_match.group(1)), min(int(range_match.group(2)), len(data) - 1)
+            body = data[start:end + 1]
+            with self.server.lock:
+                short_reads = self.server.short_reads.get(start, 0)
+                if short_reads:
+                    self.server.short_reads[start] = short_reads - 1
+                    body = body[:len(body) // 2]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", f'"{hashlib.md5(data).hexdigest()}"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def signed_upload(self, query, bucket_key, object_key):
+        upload_key = query.get("uploadKey") or uuid.uuid4().hex
+        first_part, parts = int(query.get("firstPart", 1)), int(query.get("parts", 1))
+        self.send_json(200, {"uploadKey": upload_key, "urls": [
+            f"{self.server.base_url}/s3-upload/{upload_key}/{part}" for part in range(first_part, first_part + parts)
+        ]})
+
+    def s3_put(self, query, upload_key, part):
+        data = self.read_body()
+        with self.server.lock:
+            self.server.uploaded_bytes += len(data)
+            self.server.parts[(upload_key, int(part))] = data
+        self.send_response(200)
+        self.send_header("ETag", f'"{hashlib.md5(data).hexdigest()}"')
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def complete_upload(self, query, bucket_key, object_key):
+        body = json.loads(self.read_body())
+        with self.server.lock:
+            parts = [self.server.parts.get((body["uploadKey"], part)) for part in range(1, len(body["eTags"]) + 1)]
+        if any(data is None for data in parts):
+            return self.send_json(400, {"error": "Not every part was uploaded"})
+        if [hashlib.md5(data).hexdigest() for data in parts] != body["eTags"]:
+            return self.send_json(400, {"error": "ETags don't match the uploaded parts"})
+        content = b"".join(parts)
+        if len(content) != body["size"]:
+            return self.send_json(400, {"error": f"Size {body['size']} doesn't match the {len(content)} uploaded bytes"})
+        self.server.objects[object_key] = content
+        self.send_json(200, {"bucketKey": bucket_key, "objectKey": object_key, "size": len(content)})
+
+
+ROUTES = (
+    ("GET", r"/data/v1/projects/([^/]+)/versions/(.+)", MockApsHandler.get_version),
+    ("GET", r"/data/v1/projects/([^/]+)/items/(.+)", MockApsHandler.get_item),
+    ("POST", r"/data/v1/projects/([^/]+)/storage", MockApsHandler.create_storage),
+    ("POST", r"/data/v1/projects/([^/]+)/items", MockApsHandler.create_item),
+    ("POST", r"/data/v1/projects/([^/]+)/versions", MockApsHandler.create_version),
+    ("GET", r"/oss/v2/buckets/([^/]+)/objects/(.+)/signeds3download", MockApsHandler.signed_download),
+    ("GET", r"/oss/v2/buckets/([^/]+)/objects/(.+)/signeds3upload", MockApsHandler.signed_upload),
+    ("POST", r"/oss/v2/buckets/([^/]+)/objects/(.+)/signeds3upload", MockApsHandler.complete_upload),
+    ("GET", r"/s3/(.+)", MockApsHandler.s3_get),
+    ("PUT", r"/s3-upload/([^/]+)/(\d+)", MockApsHandler.s3_put),
+)
+
+
+class MockApsServer(ThreadingHTTPServer):
+    """
+    Mock APS server on a free local port, serving registered files as versions.
+    Every request is logged in requests as (method, path). With tokens set, Data Management and OSS calls
+    need one of those bearer tokens and get a 401 otherwise. Uploaded parts are kept until their upload
+    is completed, which checks their ETags and size and stores the object so it can be downloaded again.
+    fail() makes the next requests to a path answer with error statuses, injected 429s carrying retry_after
+    as their Retry-After header if it is set. short_reads ({range start: count}) makes the next ranged
+    responses starting at that offset return half of their body while still reporting the full range.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), MockApsHandler)
+        self.base_url = f"http://{host}:{self.server_port}"
+        self.versions = {}  # version id -> object key
+        self.objects = {}  # object key -> file content
+        self.uploaded_bytes = 0
+        self.short_reads = {}  # range start -> number of truncated responses still to send
+        self.tokens = None  # accepted access tokens; None accepts any
+        self.requests = []  # (method, path) of every request
+        self.parts = {}  # (upload key, part number) -> uploaded data
+        self.failures = []  # [method, path pattern, statuses still to answer with]
+        self.retry_after = None  # Retry-After header of injected 429 responses
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add_version(self, version_id, file_path):
+        """Serves the content of a local file as a version; returns the version id."""
+        object_key = os.path.basename(file_path)
+        with open(file_path, "rb") as file:
+            self.objects[object_key] = file.read()
+        self.versions[version_id] = object_key
+        return version_id
+
+    def fail(self, method, path_pattern, *statuses):
+        """Answers the next requests matching method and path_pattern with the given statuses, in order."""
+        with self.lock:
+            self.failures.append([method, path_pattern, list(statuses)])
+
+    def take_failure(self, method, path):
+        """Returns the injected status for a request, if any. Must be called with self.lock held."""
+        for failure_method, path_pattern, statuses in self.failures:
+            if failure_method == method and statuses and re.fullmatch(path_pattern, path):
+                return statuses.pop(0)
+        return None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="mock-aps", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
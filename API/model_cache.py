@@ -0,0 +1,423 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import ifcopenshell
+
+from guid_index import GuidIndex
+from patch_writer import StepIndex, StepIndexError
+from rules import SelectorIndex
+from sidecar import ModelSidecar
+from traversal import TraversalCache
+
+# Rough in-memory size of a parsed model relative to its STEP file size
+PARSED_MODEL_SIZE_FACTOR = 8
+
+# Rough in-memory size of one operation recorded in the transaction of kept styling
+KEPT_OPERATION_COST = 1024
+
+# Kept styling is rolled back and restyled fully once it spans this many saves or recorded operations
+DEFAULT_MAX_KEPT_SAVES = 50
+DEFAULT_MAX_KEPT_OPERATIONS = 100_000
+
+
+def file_checksum(file_path, chunk_size=1024 * 1024):
+    """
+    Returns the SHA-256 hex digest of a file.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_ifc_model(file_path, lazy=True):
+    """
+    Opens an IFC file for the color pipeline.
+    In lazy mode ifcopenshell only indexes the entity lines on open and parses an entity's attributes
+    when they are first read, so geometry the color code never touches stays unparsed STEP text.
+    ifcopenshell falls back to a full parse by itself if the file uses syntax its index pass can't handle.
+    """
+    return ifcopenshell.open(file_path, lazy=lazy)
+
+
+class CachedModel:
+    """
+    A downloaded IFC file and its parsed model, shared between requests.
+    Requests work on the model through checkout(), which rolls back every change afterwards,
+    or through checkout_restyle(), which keeps the styling of the last save for the next one.
+    """
+
+    def __init__(self, checksum, file_path, ifc_file, sidecar=None, max_kept_saves=DEFAULT_MAX_KEPT_SAVES,
+                 max_kept_operations=DEFAULT_MAX_KEPT_OPERATIONS):
+        self.checksum = checksum
+        self.file_path = file_path
+        self.file_size = os.path.getsize(file_path)
+        self.ifc_file = ifc_file
+        self.lock = threading.Lock()
+        self.sidecar = sidecar  # ModelSidecar persisting the indexes below, if the model is retained
+        self.step_index = None
+        self.step_index_unusable = False  # set once the file turned out not to be indexable
+        self.guid_index = None
+        self.selector_index = None
+        self.traversal_cache = TraversalCache(adjacency=self.with_sidecar(ModelSidecar.load_adjacency))
+        self.material_inventory = None
+        self.style_snapshot = None  # StyleSnapshot of the styling kept applied by checkout_restyle()
+        self.max_kept_saves = max_kept_saves
+        self.max_kept_operations = max_kept_operations
+        self.kept_saves = 0  # saves whose changes the kept transaction holds
+        self.kept_operations = 0  # operations recorded in the kept transaction
+
+    @property
+    def cost(self):
+        """Estimated memory of the parsed model and of the transaction holding its kept styling."""
+        return self.file_size * PARSED_MODEL_SIZE_FACTOR + self.kept_operations * KEPT_OPERATION_COST
+
+    def with_sidecar(self, operation, *args):
+        """
+        Runs a ModelSidecar method on the model's sidecar and returns its result, or None without a sidecar.
+        A failing sidecar (e.g. removed by an eviction mid-request) is dropped and treated like a missing one.
+        """
+        if self.sidecar is None:
+            return None
+        try:
+            return operation(self.sidecar, *args)
+        except sqlite3.Error as e:
+            logging.warning(f"Sidecar of model {self.checksum[:12]} failed, continuing without it: {e}")
+            self.sidecar = None
+            return None
+
+    def get_step_index(self):
+        """
+        Byte offsets of the instances in the cached file, built on first use.
+        Returns None if the file can't be indexed unambiguously, so it has to be written fully.
+        Call with the model checked out.
+        """
+        if self.step_index is None and not self.step_index_unusable:
+            offsets = self.with_sidecar(ModelSidecar.load_step_offsets)
+            if offsets is not None:
+                self.step_index = StepIndex(*offsets)
+            else:
+                try:
+                    self.step_index = StepIndex.build(self.file_path)
+                except StepIndexError as e:
+                    logging.warning(f"Writing {self.file_path} fully from now on: {e}")
+                    self.step_index_unusable = True
+                    return None
+                self.with_sidecar(
+                    ModelSidecar.store_step_offsets,
+                    self.step_index.ids, self.step_index.starts, self.step_index.data_start, self.step_index.data_end,
+                )
+        return self.step_index
+
+    def get_guid_index(self):
+        """
+        GlobalId -> STEP id map of the model, built on first use and shared by later requests.
+        Call with the model checked out.
+        """
+        if self.guid_index is None:
+            ids_by_guid = self.with_sidecar(ModelSidecar.load_guids)
+            if ids_by_guid is not None:
+                self.guid_index = GuidIndex(ids_by_guid)
+            else:
+                self.guid_index = GuidIndex.build(self.ifc_file)
+                self.with_sidecar(ModelSidecar.store_guids, self.guid_index.ids_by_guid)
+        return self.guid_index
+
+    def get_selector_index(self):
+        """
+        Material and property index for color rules, built on first use and shared by later requests.
+        Call with the model checked out.
+        """
+        if self.selector_index is None:
+            self.selector_index = SelectorIndex.build(self.ifc_file)
+        return self.selector_index
+
+    def get_traversal_cache(self):
+        return self.traversal_cache
+
+    def persist_traversal(self):
+        """
+        Writes the adjacency the recolor walk discovered since the last call to the sidecar.
+        """
+        self.with_sidecar(ModelSidecar.store_adjacency, self.traversal_cache.take_new_adjacency())
+
+    def ensure_material_inventory(self, build):
+        """
+        Returns the material inventory of the downloaded file, loading it from the sidecar or building it
+        with build(ifc_file) on first use. Call it when the model is loaded, before a save styles it:
+        the kept styling of a save is left alone, so an inventory missing by then is built from a fresh
+        parse of the file instead of from the styled model.
+        """
+        with self.lock:
+            if self.material_inventory is None:
+                self.material_inventory = self.with_sidecar(ModelSidecar.load_material_inventory)
+            if self.material_inventory is None:
+                if self.ifc_file.transaction is None:
+                    self.material_inventory = build(self.ifc_file)
+                else:
+                    self.material_inventory = build(open_ifc_model(self.file_path))
+                self.with_sidecar(ModelSidecar.store_material_inventory, self.material_inventory)
+            return self.material_inventory
+
+    @contextmanager
+    def checkout(self):
+        """
+        Lends the parsed model to one request inside an ifcopenshell transaction.
+        Everything the request creates, edits or removes is discarded on exit, so the
+        cached model stays identical to the downloaded file for the next request.
+        Styling kept by checkout_restyle() is rolled back first, so readers see the downloaded file.
+        """
+        with self.lock:
+            self.discard_styles()
+            self.ifc_file.begin_transaction()
+            try:
+                yield self.ifc_file
+            finally:
+                self.ifc_file.discard_transaction()
+
+    @contextmanager
+    def checkout_restyle(self, can_reuse=lambda style_snapshot: True):
+        """
+        Lends the model to a save with the styling of the previous save still applied.
+        The changes of successful saves stay in one open transaction, so the model keeps the styling
+        described by style_snapshot and the patch writer still sees the net change against the downloaded file.
+        Kept styling that can_reuse(style_snapshot) rejects is rolled back first, and so is kept styling
+        that already spans max_kept_saves saves or max_kept_operations operations, since the transaction
+        (and the patch writer's walk over it) would otherwise grow with every save. A failed save rolls
+        everything back and drops the snapshot, so the next save restyles from scratch.
+        """
+        with self.lock:
+            reusable = (
+                self.ifc_file.transaction is not None and self.style_snapshot is not None
+                and can_reuse(self.style_snapshot)
+            )
+            if reusable and (self.kept_saves >= self.max_kept_saves or self.kept_operations >= self.max_kept_operations):
+                logging.info(
+                    f"Kept styling of model {self.checksum[:12]} spans {self.kept_saves} saves and "
+                    f"{self.kept_operations} operations, restyling fully"
+                )
+                reusable = False
+            if not reusable:
+                self.discard_styles()
+                self.ifc_file.begin_transaction()
+            try:
+                yield self.ifc_file
+            except BaseException:
+                self.discard_styles()
+                raise
+            self.kept_saves += 1
+            self.kept_operations = len(self.ifc_file.transaction.operations)
+
+    def discard_styles(self):
+        """
+        Rolls back the styling kept by checkout_restyle(). Must be called with self.lock held.
+        """
+        if not self.ifc_file.history_size:
+            self.ifc_file.set_history_size(1)
+        if self.ifc_file.transaction is not None:
+            self.ifc_file.discard_transaction()
+            if self.style_snapshot is not None:
+                logging.info(f"Discarded the kept styling of model {self.checksum[:12]}")
+        self.style_snapshot = None
+        self.kept_saves = 0
+        self.kept_operations = 0
+
+
+class ModelCache:
+    """
+    In-process LRU cache of downloaded and parsed IFC models.
+    Entries are content-addressed by file checksum; (project, version) pairs point at a checksum.
+    The summed estimated size of the parsed models is kept under memory_budget bytes.
+    With sidecars, every cached file gets a ModelSidecar next to it, so the version mapping and the
+    indexes survive restarts: a version cached by an earlier process is reopened from disk, not downloaded.
+    """
+
+    def __init__(self, cache_directory, memory_budget, lazy=True, sidecars=True, max_kept_saves=DEFAULT_MAX_KEPT_SAVES,
+                 max_kept_operations=DEFAULT_MAX_KEPT_OPERATIONS):
+        self.cache_directory = cache_directory
+        self.memory_budget = memory_budget
+        self.lazy = lazy
+        self.sidecars = sidecars
+        self.max_kept_saves = max_kept_saves
+        self.max_kept_operations = max_kept_operations
+        self.entries = OrderedDict()  # checksum -> CachedModel, least recently used first
+        self.versions = {}  # (project, version) -> checksum
+        self.lock = threading.Lock()
+        if sidecars:
+            self.load_persisted_versions()
+
+    def open_entry(self, checksum, file_path, sidecar=None):
+        """Parses a file into a CachedModel with the kept styling limits of this cache."""
+        return CachedModel(
+            checksum, file_path, open_ifc_model(file_path, self.lazy), sidecar, self.max_kept_saves, self.max_kept_operations
+        )
+
+    def cached_file_path(self, checksum):
+        return os.path.join(self.cache_directory, f"{checksum}.ifc")
+
+    def sidecar_path(self, checksum):
+        return os.path.join(self.cache_directory, f"{checksum}.sqlite")
+
+    def load_persisted_versions(self):
+        """
+        Restores the (project, version) -> checksum pairs recorded in the sidecars of the cached files.
+        The models themselves are reopened on first use.
+        """
+        if not os.path.isdir(self.cache_directory):
+            return
+        for name in os.listdir(self.cache_directory):
+            if not name.endswith(".sqlite"):
+                continue
+            checksum = name[:-len(".sqlite")]
+            sidecar = ModelSidecar(self.sidecar_path(checksum), checksum)
+            if not os.path.exists(self.cached_file_path(checksum)):
+                sidecar.remove()
+                continue
+            try:
+                for project, version in sidecar.load_versions():
+                    self.versions[(project, version)] = checksum
+            except sqlite3.DatabaseError as e:
+                logging.warning(f"Skipping unreadable sidecar {sidecar.path}: {e}")
+        if self.versions:
+            logging.info(f"Restored {len(self.versions)} cached versions from sidecars")
+
+    def total_cost(self):
+        return sum(entry.cost for entry in self.entries.values())
+
+    def stats(self):
+        with self.lock:
+            return {"models": len(self.entries), "costBytes": self.total_cost()}
+
+    def get(self, project, version):
+        """
+        Returns the CachedModel for a project version, or None on a miss.
+        """
+        with self.lock:
+            checksum = self.versions.get((project, version))
+            if checksum is None:
+                return None
+            entry = self.entries.get(checksum)
+            if entry is not None:
+                self.entries.move_to_end(checksum)
+                logging.info(f"Model cache hit for version {version} ({checksum[:12]})")
+                return entry
+
+        # Cached by an earlier process: reopen the file instead of downloading it again
+        return self.reopen(checksum)
+
+    def reopen(self, checksum):
+        """
+        Parses a cached file left by an earlier process, after checking it still has its checksum.
+        Returns the CachedModel, or None if the file is gone or changed.
+        """
+        start_time = time.perf_counter()
+        file_path = self.cached_file_path(checksum)
+        if not os.path.exists(file_path) or file_checksum(file_path) != checksum:
+            logging.warning(f"Cached file of model {checksum[:12]} is missing or changed, dropping it")
+            with self.lock:
+                self.forget(checksum)
+            return None
+
+        if os.path.getsize(file_path) * PARSED_MODEL_SIZE_FACTOR > self.memory_budget:
+            # Cached under a larger budget: drop it like put() would have, the version is downloaded again
+            logging.info(f"Cached model {checksum[:12]} exceeds the cache budget, dropping it")
+            with self.lock:
+                self.forget(checksum)
+                self.remove_file(file_path)
+            return None
+
+        sidecar = ModelSidecar.open(self.sidecar_path(checksum), checksum, os.path.getsize(file_path))
+        entry = self.open_entry(checksum, file_path, sidecar)
+
+        with self.lock:
+            existing = self.entries.get(checksum)
+            if existing is not None:
+                # Reopened by a concurrent request
+                self.entries.move_to_end(checksum)
+                return existing
+            self.entries[checksum] = entry
+            self.evict(keep=checksum)
+
+        logging.info(f"Reopened model {checksum[:12]} from the cache directory in {time.perf_counter() - start_time:.3f}s")
+        return entry
+
+    def forget(self, checksum):
+        """
+        Drops the version mapping and the sidecar of a model. Must be called with self.lock held.
+        """
+        self.versions = {key: value for key, value in self.versions.items() if value != checksum}
+        ModelSidecar(self.sidecar_path(checksum), checksum).remove()
+
+    def put(self, project, version, downloaded_file_path):
+        """
+        Adds a freshly downloaded file to the cache and parses it.
+        The file is moved into the cache directory under its checksum.
+        Returns the CachedModel, which is usable even if it is too large to be retained.
+        """
+        checksum = file_checksum(downloaded_file_path)
+
+        with self.lock:
+            entry = self.entries.get(checksum)
+            if entry is not None:
+                # Same content under another version: reuse the parsed model
+                os.remove(downloaded_file_path)
+                self.versions[(project, version)] = checksum
+                self.entries.move_to_end(checksum)
+                if entry.sidecar:
+                    entry.sidecar.add_version(project, version)
+                return entry
+
+        if os.path.getsize(downloaded_file_path) * PARSED_MODEL_SIZE_FACTOR > self.memory_budget:
+            # Too large to retain: the file stays in the caller's workspace for this request only
+            logging.info(f"Model {checksum[:12]} exceeds the cache budget and is not retained")
+            return self.open_entry(checksum, downloaded_file_path)
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+        cached_file_path = self.cached_file_path(checksum)
+        os.replace(downloaded_file_path, cached_file_path)
+        sidecar = None
+        if self.sidecars:
+            # Keeps the indexes of an earlier process if it cached the same content
+            sidecar = ModelSidecar.open(self.sidecar_path(checksum), checksum, os.path.getsize(cached_file_path))
+            sidecar.add_version(project, version)
+        entry = self.open_entry(checksum, cached_file_path, sidecar)
+
+        with self.lock:
+            self.entries[checksum] = entry
+            self.versions[(project, version)] = checksum
+            self.evict(keep=checksum)
+
+        return entry
+
+    def evict(self, keep=None):
+        """
+        Drops least recently used models until the cache fits its memory budget.
+        Models checked out by a request and the model keep (the one just added) are skipped,
+        so the cache may stay over budget until a later eviction.
+        Must be called with self.lock held.
+        """
+        for checksum, entry in list(self.entries.items()):
+            if self.total_cost() <= self.memory_budget:
+                break
+            if checksum == keep or entry.lock.locked():
+                continue
+            del self.entries[checksum]
+            entry.sidecar = None
+            self.forget(checksum)
+            self.remove_file(entry.file_path)
+            logging.info(f"Evicted model {checksum[:12]} from the model cache")
+
+    @staticmethod
+    def remove_file(file_path):
+        try:
+            os.remove(file_path)
+        except OSError:
+            # Still open by a request that is writing from it
+            logging.warning(f"Could not remove cached file {file_path}")
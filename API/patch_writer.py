@@ -0,0 +1,186 @@
+import bisect
+import logging
+import mmap
+import re
+import time
+from array import array
+
+# One STEP statement up to its terminating ";": leading whitespace and comments, then the statement itself,
+# where string literals and comments may contain ";" and "'" ("''" escapes are two adjacent literals)
+STATEMENT = re.compile(
+    rb"(?:\s++|/\*.*?\*/)*+((?:[^';/]++|'[^']*+'|/\*.*?\*/|/(?!\*))*+;)",
+    re.S,
+)
+# Entity instances are statements starting with "#<id>=" in the DATA section
+ENTITY_START = re.compile(rb"#(\d+)\s*=")
+SECTION_KEYWORD = re.compile(rb"(DATA|ENDSEC)\s*;")
+
+# Largest slice of the original file handed to the output in one write
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class StepIndexError(ValueError):
+    """Raised for a STEP file whose instances can't be located unambiguously; write it fully instead."""
+
+
+class StepIndex:
+    """
+    Byte offsets of every entity instance in the DATA section of a STEP file.
+    An instance spans from its own start to the start of the next instance, so it includes
+    any continuation lines and its trailing newline. The file is read statement by statement, so
+    "DATA;", "ENDSEC;" or "#n=" inside string literals and comments are never taken for record starts.
+    """
+
+    def __init__(self, ids, starts, data_start, data_end):
+        self.ids = ids
+        self.starts = starts
+        self.data_start = data_start
+        self.data_end = data_end
+        self.ids_sorted = all(ids[i] < ids[i + 1] for i in range(len(ids) - 1))
+        self.positions = None  # id -> position, only built when ids are not in file order
+
+    @classmethod
+    def build(cls, file_path):
+        """
+        Indexes a STEP file with a single DATA section.
+        Raises StepIndexError if statements don't parse or the DATA section is missing, repeated or unterminated.
+        """
+        start_time = time.perf_counter()
+        ids = array("q")
+        starts = array("q")
+        data_start = data_end = None
+        with open(file_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            cursor = 0
+            while data_end is None:
+                match = STATEMENT.match(data, cursor)
+                if match is None:
+                    if data_start is None:
+                        raise StepIndexError(f"No DATA section in {file_path}")
+                    raise StepIndexError(f"Unterminated statement at byte {cursor} of {file_path}")
+                statement_start, cursor = match.start(1), match.end()
+                keyword = SECTION_KEYWORD.match(data, statement_start)
+                if data_start is None:
+                    if keyword and keyword.group(1) == b"DATA":
+                        data_start = cursor
+                elif keyword:
+                    if keyword.group(1) != b"ENDSEC":
+                        raise StepIndexError(f"Nested DATA section in {file_path}")
+                    data_end = statement_start
+                else:
+                    entity = ENTITY_START.match(data, statement_start)
+                    if entity is None:
+                        raise StepIndexError(f"Unexpected statement at byte {statement_start} of {file_path}")
+                    ids.append(int(entity.group(1)))
+                    starts.append(statement_start)
+
+            # Only one DATA section is supported
+            while True:
+                match = STATEMENT.match(data, cursor)
+                if match is None:
+                    break
+                keyword = SECTION_KEYWORD.match(data, match.start(1))
+                if keyword and keyword.group(1) == b"DATA":
+                    raise StepIndexError(f"More than one DATA section in {file_path}")
+                cursor = match.end()
+
+        if len(set(ids)) != len(ids):
+            raise StepIndexError(f"Duplicate instance ids in {file_path}")
+        logging.info(f"Indexed {len(ids)} STEP instances in {time.perf_counter() - start_time:.3f}s")
+        return cls(ids, starts, data_start, data_end)
+
+    def position(self, entity_id):
+        """Returns the position of an instance in file order, or None if the file doesn't contain it."""
+        if self.ids_sorted:
+            position = bisect.bisect_left(self.ids, entity_id)
+            return position if position < len(self.ids) and self.ids[position] == entity_id else None
+        if self.positions is None:
+            self.positions = {entity_id: position for position, entity_id in enumerate(self.ids)}
+        return self.positions.get(entity_id)
+
+    def span(self, position):
+        end = self.starts[position + 1] if position + 1 < len(self.starts) else self.data_end
+        return self.starts[position], end
+
+
+def collect_transaction_changes(ifc_file):
+    """
+    Reads the net effect of the open ifcopenshell transaction as (created, modified, removed) entity ids.
+    Entities whose references were rewritten by a removal count as modified.
+    """
+    created, modified, removed = set(), set(), set()
+    for operation in ifc_file.transaction.operations:
+        action = operation["action"]
+        if action == "create":
+            created.add(operation["value"]["id"])
+        elif action == "edit":
+            modified.add(operation["id"])
+        elif action == "delete":
+            removed.add(operation["value"]["id"])
+            modified.update(operation["inverses"].keys())
+        elif action == "batch_delete":
+            modified.update(operation["inverses"].keys())
+
+    return created - removed, modified - removed - created, removed - created
+
+
+def serialize_entity(entity):
+    return entity.to_string().encode("utf-8") + b";\n"
+
+
+def copy_range(output, view, start, end, chunk_size=COPY_CHUNK_SIZE):
+    for offset in range(start, end, chunk_size):
+        output.write(view[offset:min(offset + chunk_size, end)])
+
+
+def write_patched(ifc_file, step_index, original_file_path, output_file_path):
+    """
+    Writes the model by splicing the changes of the current transaction into the original file.
+    Returns the number of serialized instances.
+    """
+    with open(output_file_path, "wb") as output:
+        return stream_patched(ifc_file, step_index, original_file_path, output)
+
+
+def stream_patched(ifc_file, step_index, original_file_path, output):
+    """
+    Streams the model into a binary writable, splicing the changes of the current transaction into the original file.
+    Untouched instances, the header and the trailer are copied byte for byte from a memory map in slices of
+    at most COPY_CHUNK_SIZE, so a streaming output never has to take more than that at once;
+    only modified and created instances are serialized. Returns the number of serialized instances.
+    Raises StepIndexError before writing anything if a changed instance isn't in the index.
+    """
+    start_time = time.perf_counter()
+    created, modified, removed = collect_transaction_changes(ifc_file)
+
+    replaced = []
+    for entity_id in modified | removed:
+        position = step_index.position(entity_id)
+        if position is None:
+            raise StepIndexError(f"Changed instance #{entity_id} is not in the STEP index of {original_file_path}")
+        replaced.append((position, entity_id))
+    replaced.sort()
+
+    with open(original_file_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        view = memoryview(data)
+        try:
+            cursor = 0
+            for position, entity_id in replaced:
+                start, end = step_index.span(position)
+                copy_range(output, view, cursor, start)
+                if entity_id in modified:
+                    output.write(serialize_entity(ifc_file.by_id(entity_id)))
+                cursor = end
+
+            copy_range(output, view, cursor, step_index.data_end)
+            for entity_id in sorted(created):
+                output.write(serialize_entity(ifc_file.by_id(entity_id)))
+            copy_range(output, view, step_index.data_end, len(view))
+        finally:
+            view.release()
+
+    serialized_count = len(modified) + len(created)
+    logging.info(
+        f"Patched {serialized_count} instances and dropped {len(removed)} into {getattr(output, 'name', 'a stream')} "
+        f"in {time.perf_counter() - start_time:.3f}s"
+    )
+    return serialized_count
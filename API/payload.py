@@ -0,0 +1,139 @@
+"""
+Decoding of update request bodies.
+
+Besides the JSON shape {"elements": [{"ifcGUIDs": [...], "color": "#RRGGBB"}, ...]}, updates can be sent packed:
+
+    {"format": "packed", "palette": ["#FF0000", ...], "guids": "<22-char GUIDs concatenated>",
+     "colors": "<base64 of little-endian uint16 palette indices, one per GUID>"}
+
+An element listed more than once takes its last valid color, like a GUID repeated in later JSON groups.
+Rows keep their order: consecutive rows of one color form one color group, so mapped items shared by
+groups of different colors resolve ("last group wins") as in the JSON groups the rows were packed from.
+Either shape may be compressed with Content-Encoding: gzip or deflate.
+"""
+import base64
+import binascii
+import json
+import sys
+import zlib
+from array import array
+
+IFC_GUID_LENGTH = 22
+
+
+class PayloadError(ValueError):
+    """Raised for a request body that can't be decoded."""
+
+
+def decompress_body(body, content_encoding, max_bytes):
+    """
+    Inflates a gzip or deflate request body, refusing to produce more than max_bytes.
+    Uncompressed bodies are held to the same limit.
+    """
+    content_encoding = (content_encoding or "identity").strip().lower()
+    if content_encoding == "identity":
+        if len(body) > max_bytes:
+            raise PayloadError(f"Body exceeds {max_bytes} bytes")
+        return body
+    if content_encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif content_encoding == "deflate":
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+    else:
+        raise PayloadError(f"Unsupported Content-Encoding {content_encoding!r}")
+
+    try:
+        inflated = decompressor.decompress(body, max_bytes)
+    except zlib.error as e:
+        raise PayloadError(f"Body is not valid {content_encoding}: {e}")
+    if decompressor.unconsumed_tail:
+        raise PayloadError(f"Decompressed body exceeds {max_bytes} bytes")
+    return inflated
+
+
+def read_update_payload(flask_request, max_bytes):
+    """
+    Returns the JSON body of a request, inflating it first if it was sent compressed.
+    """
+    body = decompress_body(flask_request.get_data(), flask_request.headers.get("Content-Encoding"), max_bytes)
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        raise PayloadError(f"Body is not valid JSON: {e}")
+    if not isinstance(data, dict):
+        raise PayloadError("Body must be a JSON object")
+    return data
+
+
+def decode_packed_elements(palette, guids, colors, is_valid_color):
+    """
+    Decodes the packed arrays into color groups in the JSON shape, one group per run of rows with the same color.
+    Entries whose palette color fails is_valid_color are dropped, as invalid JSON groups are skipped.
+    The palette indices are read into one array, so no per-row Python objects are built besides the GUIDs.
+    """
+    if not isinstance(palette, list) or not isinstance(guids, str) or not isinstance(colors, str):
+        raise PayloadError("Packed payloads need a palette list and guids and colors strings")
+    if len(guids) % IFC_GUID_LENGTH:
+        raise PayloadError(f"guids length must be a multiple of {IFC_GUID_LENGTH}")
+    if not guids.isascii():
+        raise PayloadError("Invalid packed arrays: guids must be ASCII")
+
+    color_array = array("H")
+    try:
+        color_array.frombytes(base64.b64decode(colors, validate=True))
+    except (binascii.Error, ValueError) as e:
+        raise PayloadError(f"Invalid packed arrays: {e}")
+    if sys.byteorder == "big":
+        color_array.byteswap()
+    row_count = len(guids) // IFC_GUID_LENGTH
+    if row_count != len(color_array):
+        raise PayloadError(f"{row_count} GUIDs but {len(color_array)} color indices")
+    if len(color_array) and max(color_array) >= len(palette):
+        raise PayloadError(f"Color index {max(color_array)} is outside the palette")
+
+    valid_palette = [bool(is_valid_color(color)) for color in palette]
+
+    # Keep the last occurrence of every GUID, walking the rows backwards
+    seen = set()
+    rows = []
+    for position in range(row_count - 1, -1, -1):
+        color_index = color_array[position]
+        if not valid_palette[color_index]:
+            continue
+        guid = guids[position * IFC_GUID_LENGTH:(position + 1) * IFC_GUID_LENGTH]
+        if guid in seen:
+            continue
+        seen.add(guid)
+        rows.append((guid, color_index))
+    rows.reverse()
+
+    # Group consecutive rows of one color, keeping the payload order
+    elements = []
+    previous_index = None
+    for guid, color_index in rows:
+        if color_index != previous_index:
+            elements.append({"ifcGUIDs": [], "color": palette[color_index]})
+            previous_index = color_index
+        elements[-1]["ifcGUIDs"].append(guid)
+    return elements
+
+
+def normalize_update_payload(data, is_valid_color):
+    """
+    Brings a packed update request into the JSON shape in place and returns it.
+    JSON-shaped requests are returned unchanged.
+    """
+    payload_format = data.get("format", "json")
+    if payload_format == "json":
+        return data
+    if payload_format != "packed":
+        raise PayloadError(f"Unknown payload format {payload_format!r}")
+
+    if not isinstance(data.get("elements", []), list):
+        raise PayloadError("elements must be a list")
+    elements = decode_packed_elements(
+        data.pop("palette", None), data.pop("guids", None), data.pop("colors", None), is_valid_color
+    )
+    data["elements"] = data.get("elements", []) + elements
+    data["format"] = "json"
+    return data
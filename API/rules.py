@@ -0,0 +1,238 @@
+import logging
+import re
+import time
+
+from styles import isValidHex
+
+# The property the web client groups elements by
+CATEGORY_PROPERTY = ("SG_Eigenschaften_Allgemein", "BIM-Elementkategorie")
+
+# Rule keys that select elements; every given key must match
+SELECTOR_KEYS = ("ifcType", "material", "category", "properties")
+
+
+class RuleError(ValueError):
+    """Raised for a color rule that can't be compiled."""
+
+
+def get_product_materials(material):
+    """
+    Flattens the material assigned through an IfcRelAssociatesMaterial into a list of IfcMaterials.
+    """
+    materials = []
+    if material.is_a('IfcMaterial'):
+        materials.append(material)
+    elif material.is_a('IfcMaterialList'):
+        materials.extend(material.Materials)
+    elif material.is_a('IfcMaterialLayerSetUsage'):
+        for layer in material.ForLayerSet.MaterialLayers:
+            materials.append(layer.Material)
+    return materials
+
+
+def normalize_value(value):
+    return str(value).strip().lower()
+
+
+def typed_objects(related_object):
+    """
+    Returns the ids an association applies to: the object itself, or the occurrences of a type object.
+    """
+    if not related_object.is_a("IfcTypeObject"):
+        return [related_object.id()]
+    # IFC2X3 names the inverse ObjectTypeOf, IFC4 names it Types
+    type_relations = getattr(related_object, "Types", None) or getattr(related_object, "ObjectTypeOf", None) or ()
+    return [related.id() for relation in type_relations for related in relation.RelatedObjects]
+
+
+class SelectorIndex:
+    """
+    Element ids of one model indexed by material name and by property value, built in one pass
+    over the material and property relationships. Keys and values are lower-cased.
+    Holds ids rather than entity instances so it stays valid across request transactions.
+    """
+
+    def __init__(self, materials, properties):
+        self.materials = materials  # material name -> set of element ids
+        self.properties = properties  # (property set name, property name) -> {value: set of element ids}
+        self.types = {}  # IFC type name -> frozenset of element ids, filled on use
+
+    @classmethod
+    def build(cls, ifc_file):
+        start_time = time.perf_counter()
+
+        materials = {}
+        for association in ifc_file.by_type("IfcRelAssociatesMaterial"):
+            element_ids = [element_id for related in association.RelatedObjects for element_id in typed_objects(related)]
+            for material in get_product_materials(association.RelatingMaterial):
+                if material is not None and material.Name:
+                    materials.setdefault(normalize_value(material.Name), set()).update(element_ids)
+
+        properties = {}
+        for definition in ifc_file.by_type("IfcRelDefinesByProperties"):
+            property_set = definition.RelatingPropertyDefinition
+            if not property_set.is_a("IfcPropertySet"):
+                continue
+            element_ids = [element_id for related in definition.RelatedObjects for element_id in typed_objects(related)]
+            for ifc_property in property_set.HasProperties:
+                if not ifc_property.is_a("IfcPropertySingleValue") or ifc_property.NominalValue is None:
+                    continue
+                key = (normalize_value(property_set.Name), normalize_value(ifc_property.Name))
+                value = normalize_value(ifc_property.NominalValue.wrappedValue)
+                properties.setdefault(key, {}).setdefault(value, set()).update(element_ids)
+
+        logging.info(
+            f"Indexed {len(materials)} materials and {len(properties)} properties for rules "
+            f"in {time.perf_counter() - start_time:.3f}s"
+        )
+        return cls(materials, properties)
+
+    def type_ids(self, ifc_file, type_name):
+        element_ids = self.types.get(type_name)
+        if element_ids is None:
+            try:
+                element_ids = frozenset(element.id() for element in ifc_file.by_type(type_name))
+            except RuntimeError:
+                raise RuleError(f"Unknown IFC type {type_name!r} for schema {ifc_file.schema}")
+            self.types[type_name] = element_ids
+        return element_ids
+
+
+class ValuePattern:
+    """
+    A case-insensitive value to match; "*" and "?" act as wildcards unless exact is set.
+    Plain values are looked up directly, wildcards are matched against the distinct indexed values.
+    """
+
+    def __init__(self, value, exact=False):
+        if value is None or isinstance(value, (dict, list)):
+            raise RuleError(f"Invalid rule value {value!r}")
+        self.value = normalize_value(value)
+        self.regex = None
+        if not exact and ("*" in self.value or "?" in self.value):
+            self.regex = re.compile(re.escape(self.value).replace(r"\*", ".*").replace(r"\?", ".") + r"\Z")
+
+    def select(self, values):
+        """Returns the union of the id sets of every matching key in {value: ids}."""
+        if self.regex is None:
+            return values.get(self.value, set())
+        selected = set()
+        for value, element_ids in values.items():
+            if self.regex.match(value):
+                selected |= element_ids
+        return selected
+
+
+def as_patterns(value, exact=False):
+    values = value if isinstance(value, list) else [value]
+    if not values:
+        raise RuleError("Rule values must not be empty")
+    return [ValuePattern(value, exact) for value in values]
+
+
+class CompiledRule:
+    """
+    One color rule turned into selectors over a SelectorIndex.
+    Every criterion must match; a list of values inside a criterion matches any of them.
+    With "exact": true the material and property values are matched literally, without wildcards.
+    """
+
+    def __init__(self, color, type_names, material_patterns, property_patterns):
+        self.color = color
+        self.type_names = type_names
+        self.material_patterns = material_patterns
+        self.property_patterns = property_patterns  # ((property set name or None, property name), patterns)
+
+    @classmethod
+    def compile(cls, rule):
+        if not isinstance(rule, dict):
+            raise RuleError(f"Rule must be an object, got {rule!r}")
+        if not any(key in rule for key in SELECTOR_KEYS):
+            raise RuleError(f"Rule needs at least one of {', '.join(SELECTOR_KEYS)}")
+
+        exact = rule.get("exact", False)
+        if not isinstance(exact, bool):
+            raise RuleError(f"Invalid exact {exact!r}")
+
+        type_names = rule.get("ifcType")
+        if type_names is not None:
+            type_names = type_names if isinstance(type_names, list) else [type_names]
+            if not type_names or not all(isinstance(type_name, str) for type_name in type_names):
+                raise RuleError(f"Invalid ifcType {rule['ifcType']!r}")
+
+        material_patterns = as_patterns(rule["material"], exact) if "material" in rule else None
+
+        property_patterns = []
+        if "category" in rule:
+            property_patterns.append((CATEGORY_PROPERTY, as_patterns(rule["category"], exact)))
+        properties = rule.get("properties") or {}
+        if not isinstance(properties, dict):
+            raise RuleError(f"Invalid properties {properties!r}")
+        for name, value in properties.items():
+            if not isinstance(name, str):
+                raise RuleError(f"Invalid property name {name!r}")
+            # "Pset.Property" or just "Property" to match it in any property set
+            property_set_name, _, property_name = name.partition(".") if "." in name else ("", "", name)
+            if not property_name.strip():
+                raise RuleError(f"Invalid property name {name!r}")
+            property_patterns.append(((property_set_name or None, property_name), as_patterns(value, exact)))
+
+        if type_names is None and material_patterns is None and not property_patterns:
+            raise RuleError("Rule has no selector values")
+
+        color = rule.get("color")
+        if not isValidHex(color):
+            raise RuleError(f"Invalid color {color!r}, expected \"#RRGGBB\" or \"#RGB\"")
+
+        return cls(color, type_names, material_patterns, property_patterns)
+
+    def property_ids(self, index, key, patterns):
+        property_set_name, property_name = (normalize_value(part) if part else None for part in key)
+        selected = set()
+        for (indexed_set_name, indexed_property_name), values in index.properties.items():
+            if indexed_property_name != property_name:
+                continue
+            if property_set_name is not None and indexed_set_name != property_set_name:
+                continue
+            for pattern in patterns:
+                selected |= pattern.select(values)
+        return selected
+
+    def evaluate(self, index, ifc_file):
+        """Returns the ids of the elements this rule selects, sorted."""
+        candidate_sets = []
+        if self.type_names is not None:
+            candidate_sets.append(set().union(*(index.type_ids(ifc_file, type_name) for type_name in self.type_names)))
+        if self.material_patterns is not None:
+            candidate_sets.append(set().union(*(pattern.select(index.materials) for pattern in self.material_patterns)))
+        for key, patterns in self.property_patterns:
+            candidate_sets.append(self.property_ids(index, key, patterns))
+
+        # Intersect starting from the most selective criterion
+        candidate_sets.sort(key=len)
+        selected = set(candidate_sets[0])
+        for candidates in candidate_sets[1:]:
+            selected &= candidates
+        return sorted(selected)
+
+
+def compile_rules(rules):
+    """
+    Compiles the color rules of a request. Raises RuleError naming the first invalid rule.
+    """
+    if not isinstance(rules, list):
+        raise RuleError("rules must be a list")
+    compiled_rules = []
+    for position, rule in enumerate(rules):
+        try:
+            compiled_rules.append(CompiledRule.compile(rule))
+        except RuleError as e:
+            raise RuleError(f"Rule {position}: {e}")
+    return compiled_rules
+
+
+def evaluate_rules(compiled_rules, index, ifc_file):
+    """
+    Returns the element ids selected by each rule, in rule order.
+    """
+    return [compiled_rule.evaluate(index, ifc_file) for compiled_rule in compiled_rules]
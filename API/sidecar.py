@@ -0,0 +1,191 @@
+import logging
+import os
+import sqlite3
+import time
+import urllib.parse
+from array import array
+from contextlib import closing, contextmanager
+
+# Bump when the tables or what they index change; sidecars of another schema version are rebuilt
+SIDECAR_SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS versions (project TEXT NOT NULL, version TEXT NOT NULL, PRIMARY KEY (project, version));
+CREATE TABLE IF NOT EXISTS guids (guid TEXT PRIMARY KEY, step_id INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS adjacency (element_id INTEGER PRIMARY KEY, mapped_item_ids BLOB NOT NULL, next_ids BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS material_colors (material TEXT, color TEXT, count INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS step_index (ids BLOB NOT NULL, starts BLOB NOT NULL, data_start INTEGER NOT NULL, data_end INTEGER NOT NULL);
+"""
+
+
+def pack_ids(ids):
+    return array("q", ids).tobytes()
+
+
+def unpack_ids(blob):
+    ids = array("q")
+    ids.frombytes(blob)
+    return ids
+
+
+class ModelSidecar:
+    """
+    SQLite file kept next to a cached IFC file with the indexes derived from it: the GlobalId map,
+    the traversal adjacency of the recolor walk, the material inventory, the STEP byte offsets and the
+    (project, version) pairs that point at the file. Lets a restarted process reuse the work of earlier ones.
+    The sidecar records the checksum and size of its IFC file and is rebuilt if they don't match.
+    Every index is optional: a missing one is built by the caller and stored afterwards.
+    """
+
+    def __init__(self, path, checksum):
+        self.path = path
+        self.checksum = checksum
+
+    @classmethod
+    def open(cls, path, checksum, file_size):
+        """
+        Opens the sidecar of a file, starting a fresh one if there is none or it belongs to other content.
+        """
+        sidecar = cls(path, checksum)
+        expected = {"schema": str(SIDECAR_SCHEMA_VERSION), "checksum": checksum, "fileSize": str(file_size)}
+        try:
+            meta = sidecar.read_meta()
+            if all(meta.get(key) == value for key, value in expected.items()):
+                return sidecar
+        except sqlite3.DatabaseError as e:
+            logging.warning(f"Unreadable sidecar {path}, rebuilding it: {e}")
+
+        sidecar.remove()
+        with sidecar.connect(create=True) as connection:
+            connection.executescript(SCHEMA)
+            connection.executemany("INSERT INTO meta VALUES (?, ?)", expected.items())
+        return sidecar
+
+    @contextmanager
+    def connect(self, create=False):
+        """
+        Opens a connection for one unit of work, committed on success.
+        Only open() creates the file, so a sidecar removed in the meantime raises instead of reappearing empty.
+        """
+        uri = f"file:{urllib.parse.quote(self.path)}?mode={'rwc' if create else 'rw'}"
+        with closing(sqlite3.connect(uri, uri=True, timeout=30)) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                yield connection
+
+    def read_meta(self):
+        if not os.path.exists(self.path):
+            return {}
+        with self.connect() as connection:
+            if not connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'meta'").fetchone():
+                return {}
+            return dict(connection.execute("SELECT key, value FROM meta"))
+
+    def remove(self):
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.path + suffix)
+            except FileNotFoundError:
+                pass
+
+    # Versions
+
+    def add_version(self, project, version):
+        with self.connect() as connection:
+            connection.execute("INSERT OR IGNORE INTO versions VALUES (?, ?)", (project, version))
+
+    def load_versions(self):
+        with self.connect() as connection:
+            return connection.execute("SELECT project, version FROM versions").fetchall()
+
+    # GlobalId map
+
+    def load_guids(self):
+        """Returns the GlobalId -> STEP id map, or None if it wasn't stored yet."""
+        with self.connect() as connection:
+            if not self.has_index(connection, "guids"):
+                return None
+            return dict(connection.execute("SELECT guid, step_id FROM guids"))
+
+    def store_guids(self, ids_by_guid):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM guids")
+            connection.executemany("INSERT OR REPLACE INTO guids VALUES (?, ?)", ids_by_guid.items())
+            self.mark_index(connection, "guids")
+
+    # Traversal adjacency
+
+    def load_adjacency(self):
+        """Returns the stored adjacency of the recolor walk, element id -> (mapped item ids, next element ids)."""
+        with self.connect() as connection:
+            return {
+                element_id: (tuple(unpack_ids(mapped_item_ids)), tuple(unpack_ids(next_ids)))
+                for element_id, mapped_item_ids, next_ids in connection.execute("SELECT * FROM adjacency")
+            }
+
+    def store_adjacency(self, adjacency):
+        """Adds adjacency entries; the walk only ever discovers new elements, so existing rows stay valid."""
+        if not adjacency:
+            return
+        with self.connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO adjacency VALUES (?, ?, ?)",
+                (
+                    (element_id, pack_ids(mapped_item_ids), pack_ids(next_ids))
+                    for element_id, (mapped_item_ids, next_ids) in adjacency.items()
+                ),
+            )
+
+    # Material inventory
+
+    def load_material_inventory(self):
+        """Returns the stored {material_name: {color: count}} inventory, or None if it wasn't stored yet."""
+        with self.connect() as connection:
+            if not self.has_index(connection, "materialColors"):
+                return None
+            inventory = {}
+            for material, color, count in connection.execute("SELECT material, color, count FROM material_colors ORDER BY rowid"):
+                inventory.setdefault(material, {})[color] = count
+            return inventory
+
+    def store_material_inventory(self, inventory):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM material_colors")
+            connection.executemany(
+                "INSERT INTO material_colors VALUES (?, ?, ?)",
+                (
+                    (material, color, count)
+                    for material, colors in inventory.items()
+                    for color, count in colors.items()
+                ),
+            )
+            self.mark_index(connection, "materialColors")
+
+    # STEP byte offsets
+
+    def load_step_offsets(self):
+        """Returns (ids, starts, data_start, data_end) of the STEP index, or None if it wasn't stored yet."""
+        with self.connect() as connection:
+            row = connection.execute("SELECT ids, starts, data_start, data_end FROM step_index").fetchone()
+        if row is None:
+            return None
+        return unpack_ids(row[0]), unpack_ids(row[1]), row[2], row[3]
+
+    def store_step_offsets(self, ids, starts, data_start, data_end):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM step_index")
+            connection.execute(
+                "INSERT INTO step_index VALUES (?, ?, ?, ?)",
+                (pack_ids(ids), pack_ids(starts), data_start, data_end),
+            )
+
+    # Indexes that may legitimately be empty are marked complete in meta
+
+    @staticmethod
+    def has_index(connection, name):
+        return connection.execute("SELECT 1 FROM meta WHERE key = ?", (f"index:{name}",)).fetchone() is not None
+
+    @staticmethod
+    def mark_index(connection, name):
+        connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (f"index:{name}", str(time.time())))
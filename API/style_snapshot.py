@@ -0,0 +1,46 @@
+class StyleSnapshot:
+    """
+    The styling a save left applied on a cached model: the styling strategy, the color of every requested
+    element, the color every target of the strategy (e.g. IfcMappedItem) resolved to, and the styled item
+    index and style cache of that state, so the next save can edit the styling in place.
+    Colors are normalized RGB triples; ids are STEP ids.
+    """
+
+    def __init__(self, strategy, styled_item_index, style_cache):
+        self.strategy = strategy
+        self.styled_item_index = styled_item_index
+        self.style_cache = style_cache
+        self.element_colors = {}  # element id -> rgb
+        self.item_colors = {}  # target id -> rgb
+
+
+def assign_element_colors(styled_groups):
+    """
+    Returns the element id -> rgb assignment of the color groups, the last group of an element winning.
+    """
+    element_colors = {}
+    for rgb, element_ids in styled_groups:
+        for element_id in element_ids:
+            element_colors[element_id] = rgb
+    return element_colors
+
+
+def count_changed_elements(previous, current):
+    """
+    Returns the number of elements that were added, removed or recolored between two element assignments.
+    """
+    changed = sum(1 for element_id, rgb in current.items() if previous.get(element_id) != rgb)
+    return changed + sum(1 for element_id in previous if element_id not in current)
+
+
+def diff_item_colors(previous, current):
+    """
+    Compares two target id -> rgb assignments.
+    Returns the items to restyle grouped by their new color ({rgb: [ids]}) and the ids that lose their color.
+    """
+    restyle = {}
+    for mapped_item_id, rgb in current.items():
+        if previous.get(mapped_item_id) != rgb:
+            restyle.setdefault(rgb, []).append(mapped_item_id)
+    unstyle = [mapped_item_id for mapped_item_id in previous if mapped_item_id not in current]
+    return restyle, unstyle
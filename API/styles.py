@@ -0,0 +1,262 @@
+"""
+Shared surface style chains and styled items of the recolor pipeline.
+"""
+import logging
+import time
+
+def get_ifc_schema_version(ifc_model):
+    """
+    Determines the IFC schema version.
+    """
+    schema_version = ifc_model.schema
+    return schema_version
+
+
+def build_styled_item_index(ifc_file):
+    """
+    Builds a lookup from representation item id to its IfcStyledItem.
+    Built once per request so styling doesn't rescan every IfcStyledItem per item.
+    """
+    styled_item_index = {}
+    for styled_item in ifc_file.by_type("IfcStyledItem"):
+        if styled_item.Item is not None:
+            styled_item_index[styled_item.Item.id()] = styled_item
+    return styled_item_index
+
+
+def get_or_create_styled_item(ifc_file, item, styled_item_index):
+    """Return the IfcStyledItem of a representation item, creating and indexing it if missing."""
+    styled_item = styled_item_index.get(item.id())
+
+    if not styled_item:
+        # Create a new IfcStyledItem if none exists
+        styled_item = ifc_file.create_entity("IfcStyledItem", Item=item, Styles=())
+        styled_item_index[item.id()] = styled_item
+
+    return styled_item
+
+
+def normalize_rgb(rgb):
+    """Round a normalized (0-1) RGB triple so equal colors share one cache key."""
+    return tuple(round(float(channel), 4) for channel in rgb)
+
+
+def supports_presentation_style_assignment(ifc_file):
+    """IfcPresentationStyleAssignment only exists up to IFC4 (removed in IFC4X3)."""
+    return get_ifc_schema_version(ifc_file) in ("IFC2X3", "IFC4")
+
+
+def build_style_cache(ifc_file):
+    """
+    Builds a cache of reusable surface styles keyed by (schema, normalized RGB).
+    Existing single-color, two-sided, opaque styles in the model are picked up so they are reused.
+    """
+    schema_version = get_ifc_schema_version(ifc_file)
+    style_cache = {}
+
+    for surface_style in ifc_file.by_type("IfcSurfaceStyle"):
+        if surface_style.Side != "BOTH" or len(surface_style.Styles) != 1:
+            continue
+        rendering = surface_style.Styles[0]
+        if not rendering.is_a("IfcSurfaceStyleRendering") or not rendering.SurfaceColour:
+            continue
+        if rendering.Transparency:
+            continue
+        colour = rendering.SurfaceColour
+        key = (schema_version, normalize_rgb((colour.Red, colour.Green, colour.Blue)))
+        style_cache.setdefault(key, {"surface_style": surface_style, "presentation_style": None})
+
+    if supports_presentation_style_assignment(ifc_file):
+        surface_style_keys = {entry["surface_style"].id(): key for key, entry in style_cache.items()}
+        for presentation_style in ifc_file.by_type("IfcPresentationStyleAssignment"):
+            if len(presentation_style.Styles) != 1:
+                continue
+            key = surface_style_keys.get(presentation_style.Styles[0].id())
+            if key and style_cache[key]["presentation_style"] is None:
+                style_cache[key]["presentation_style"] = presentation_style
+
+    return style_cache
+
+
+def get_or_create_surface_style(ifc_file, rgb, style_cache):
+    """Return the shared IfcSurfaceStyle for a color, creating the style chain once per color."""
+    rgb = normalize_rgb(rgb)
+    key = (get_ifc_schema_version(ifc_file), rgb)
+    entry = style_cache.get(key)
+
+    if entry is None:
+        surface_style = ifc_file.create_entity(
+            "IfcSurfaceStyle",
+            Name="ElementColor",
+            Side="BOTH",
+            Styles=[
+                ifc_file.create_entity(
+                    "IfcSurfaceStyleRendering",
+                    SurfaceColour=ifc_file.create_entity(
+                        "IfcColourRgb", Name=None, Red=rgb[0], Green=rgb[1], Blue=rgb[2]
+                    ),
+                    Transparency=0.0,
+                    ReflectanceMethod="MATT",
+                )
+            ],
+        )
+        entry = style_cache[key] = {"surface_style": surface_style, "presentation_style": None}
+
+    return entry["surface_style"]
+
+
+def get_or_create_presentation_style(ifc_file, rgb, style_cache):
+    """
+    Return the shared style to put on an IfcStyledItem for a color.
+    This is an IfcPresentationStyleAssignment where the schema has it, otherwise the IfcSurfaceStyle itself.
+    """
+    surface_style = get_or_create_surface_style(ifc_file, rgb, style_cache)
+    if not supports_presentation_style_assignment(ifc_file):
+        return surface_style
+
+    entry = style_cache[(get_ifc_schema_version(ifc_file), normalize_rgb(rgb))]
+    if entry["presentation_style"] is None:
+        entry["presentation_style"] = ifc_file.create_entity(
+            "IfcPresentationStyleAssignment", Styles=[surface_style]
+        )
+
+    return entry["presentation_style"]
+
+
+def remove_unused_style(ifc_file, rgb, style_cache):
+    """
+    Removes the style chain of a color from the model and the style cache once nothing references it.
+    Returns the number of removed entities.
+    """
+    key = (get_ifc_schema_version(ifc_file), normalize_rgb(rgb))
+    entry = style_cache.get(key)
+    if entry is None:
+        return 0
+
+    styles = [style for style in (entry["presentation_style"], entry["surface_style"]) if style is not None]
+    style_ids = [style.id() for style in styles]
+    removed_ids = set()
+    candidates = list(styles)
+    while candidates:
+        entity = candidates.pop(0)
+        if entity.id() in removed_ids or ifc_file.get_inverse(entity):
+            continue
+        children = [child for child in ifc_file.traverse(entity, max_levels=1)[1:] if child.id()]
+        removed_ids.add(entity.id())
+        ifc_file.remove(entity)
+        candidates.extend(children)
+
+    if style_ids[-1] in removed_ids:
+        del style_cache[key]
+    elif len(style_ids) > 1 and style_ids[0] in removed_ids:
+        entry["presentation_style"] = None
+    return len(removed_ids)
+
+
+def assign_color_to_material(ifc_file, material, rgb, style_cache=None, styled_representations=None):
+    """
+    Colors a material through its IfcMaterialDefinitionRepresentation, replacing its styled representations
+    with one IfcStyledRepresentation that holds the shared style chain of the color.
+    Pass the same styled_representations dict ({normalized rgb: IfcStyledRepresentation}) for several
+    materials so materials of one color share one representation. Returns that representation.
+    """
+    if style_cache is None:
+        style_cache = build_style_cache(ifc_file)
+    if styled_representations is None:
+        styled_representations = {}
+
+    # Step 1: One styled representation per color, holding the shared style
+    rgb = normalize_rgb(rgb)
+    styled_representation = styled_representations.get(rgb)
+    if styled_representation is None:
+        styled_item = ifc_file.create_entity(
+            "IfcStyledItem", Item=None, Styles=[get_or_create_presentation_style(ifc_file, rgb, style_cache)]
+        )
+        styled_representation = styled_representations[rgb] = ifc_file.create_entity(
+            "IfcStyledRepresentation",
+            ContextOfItems=get_representation_context(ifc_file),
+            RepresentationIdentifier="Style",
+            RepresentationType="Material",
+            Items=[styled_item],
+        )
+
+    # Step 2: Link it to the material in place of its previous styling
+    if material.HasRepresentation:
+        material_def_rep = material.HasRepresentation[0]
+        material_def_rep.Representations = tuple(
+            representation for representation in material_def_rep.Representations
+            if not representation.is_a("IfcStyledRepresentation")
+        ) + (styled_representation,)
+    else:
+        ifc_file.create_entity(
+            "IfcMaterialDefinitionRepresentation",
+            Representations=[styled_representation],
+            RepresentedMaterial=material,
+        )
+    return styled_representation
+
+
+def get_representation_context(ifc_file):
+    """Retrieve or create the representation context for styled representations."""
+    # Placeholder: This should retrieve or create a suitable representation context
+    # In real cases, it depends on the IFC file setup
+    return ifc_file.by_type("IfcGeometricRepresentationContext")[0]  # Replace with actual logic
+
+
+# Utility function to validate if the color is a valid hex color code
+def isValidHex(hex):
+    if isinstance(hex, str) and len(hex) in [4, 7] and hex[0] == "#":
+        try:
+            int(hex[1:], 16)  # Try to parse the string to an integer
+            return True
+        except ValueError:
+            return False
+    return False
+
+
+def hex_to_rgb(hex_color):
+    """
+    Converts a "#RRGGBB" or "#RGB" color to an RGB triple normalized to 0-1 for IFC.
+    """
+    digits = hex_color.lstrip("#")
+    if len(digits) == 3:
+        digits = "".join(digit * 2 for digit in digits)
+    return tuple(int(digits[i:i+2], 16) / 255 for i in (0, 2, 4))
+
+
+def purge_styles(ifc_file):
+    """
+    Removes every IfcStyledItem and IfcPresentationStyleAssignment, plus the surface styles,
+    renderings and colours that only they referenced, in one batched pass.
+    Returns the number of removed entities and the elapsed time in seconds.
+    """
+    start_time = time.perf_counter()
+
+    # Styled items and style assignments are always removed
+    to_remove = []
+    for entity_type in ("IfcStyledItem", "IfcPresentationStyleAssignment"):
+        to_remove.extend(ifc_file.by_type(entity_type))
+    removed_ids = {entity.id() for entity in to_remove}
+
+    # Walk down from the surface styles level by level and keep only what is orphaned
+    candidates = ifc_file.by_type("IfcSurfaceStyle")
+    while candidates:
+        next_candidates = []
+        for entity in candidates:
+            if entity.id() in removed_ids:
+                continue
+            if all(inverse.id() in removed_ids for inverse in ifc_file.get_inverse(entity)):
+                to_remove.append(entity)
+                removed_ids.add(entity.id())
+                next_candidates.extend(child for child in ifc_file.traverse(entity, max_levels=1)[1:] if child.id())
+        candidates = next_candidates
+
+    # Delete in batch so referencing aggregates are rewritten once, not once per removal
+    ifc_file.batch()
+    for entity in to_remove:
+        ifc_file.remove(entity)
+    ifc_file.unbatch()
+
+    elapsed = time.perf_counter() - start_time
+    logging.info(f"Purged {len(to_remove)} style entities in {elapsed:.3f}s")
+    return len(to_remove), elapsed
@@ -0,0 +1,243 @@
+from rules import get_product_materials
+from style_snapshot import diff_item_colors
+from styles import (
+    assign_color_to_material,
+    build_style_cache,
+    build_styled_item_index,
+    get_ifc_schema_version,
+    get_or_create_presentation_style,
+    get_or_create_styled_item,
+    normalize_rgb,
+    remove_unused_style,
+    supports_presentation_style_assignment,
+)
+from traversal import TraversalCache
+
+
+class MappedItemStrategy:
+    """
+    Styles the IfcMappedItems in the representations of the reached elements.
+    Each placement of a shared representation map gets its own IfcStyledItem, so instances keep separate colors.
+    """
+
+    name = "mapped"
+    supports_diff = True
+
+    def targets(self, engine, root_ids):
+        return engine.traversal_cache.mapped_items_for_roots(engine.ifc_file, root_ids)
+
+    def apply(self, engine, target_ids, rgb):
+        presentation_style = get_or_create_presentation_style(engine.ifc_file, rgb, engine.style_cache)
+        for target_id in target_ids:
+            styled_item = get_or_create_styled_item(
+                engine.ifc_file, engine.ifc_file.by_id(target_id), engine.styled_item_index
+            )
+            styled_item.Styles = (presentation_style,)
+
+    def remove(self, engine, target_ids):
+        for target_id in target_ids:
+            styled_item = engine.styled_item_index.pop(target_id, None)
+            if styled_item is not None:
+                engine.ifc_file.remove(styled_item)
+                engine.removed_styled_item_count += 1
+
+    def planned_entities(self, engine, target_colors):
+        """Returns the entities (created, edited) that styling the targets takes, besides the color chains."""
+        existing = sum(1 for target_id in target_colors if target_id in engine.styled_item_index)
+        return len(target_colors) - existing, existing
+
+
+class DeepItemStrategy(MappedItemStrategy):
+    """
+    Styles the geometric items themselves: the items of the reached elements' representations, with
+    IfcMappedItems expanded into the items of their mapped representation. Geometry shared through a
+    representation map takes the color of the last group that reaches it, for every placement of the map.
+    """
+
+    name = "deep"
+
+    def targets(self, engine, root_ids):
+        item_ids = set()
+        for element_id in engine.traversal_cache.reachable_elements(engine.ifc_file, root_ids):
+            item_ids.update(self.element_items(engine, element_id))
+        return frozenset(item_ids)
+
+    def element_items(self, engine, element_id):
+        items = engine.item_memo.get(element_id)
+        if items is not None:
+            return items
+
+        element = engine.ifc_file.by_id(element_id)
+        item_ids = set()
+        if hasattr(element, "Representation") and element.Representation:
+            stack = [item for representation in element.Representation.Representations for item in representation.Items]
+            visited = set()
+            while stack:
+                item = stack.pop()
+                if item.id() in visited:
+                    continue
+                visited.add(item.id())
+                if item.is_a("IfcMappedItem"):
+                    stack.extend(item.MappingSource.MappedRepresentation.Items)
+                else:
+                    item_ids.add(item.id())
+
+        items = engine.item_memo[element_id] = tuple(item_ids)
+        return items
+
+
+class MaterialStrategy:
+    """
+    Colors the materials associated with the reached elements, through assign_color_to_material.
+    Everything using a material takes its color, also elements outside the group.
+    Saves with this strategy always restyle fully, so it has no remove step.
+    """
+
+    name = "material"
+    supports_diff = False
+
+    def targets(self, engine, root_ids):
+        material_ids = set()
+        for element_id in engine.traversal_cache.reachable_elements(engine.ifc_file, root_ids):
+            element = engine.ifc_file.by_id(element_id)
+            for association in getattr(element, "HasAssociations", None) or ():
+                if association.is_a("IfcRelAssociatesMaterial"):
+                    material_ids.update(material.id() for material in get_product_materials(association.RelatingMaterial))
+        return frozenset(material_ids)
+
+    def apply(self, engine, target_ids, rgb):
+        for target_id in target_ids:
+            assign_color_to_material(
+                engine.ifc_file, engine.ifc_file.by_id(target_id), rgb, engine.style_cache, engine.styled_representations
+            )
+
+    def planned_entities(self, engine, target_colors):
+        # One IfcStyledItem and one IfcStyledRepresentation per color, plus a definition for unrepresented materials
+        represented = sum(1 for target_id in target_colors if engine.ifc_file.by_id(target_id).HasRepresentation)
+        colors = len(set(target_colors.values()) - set(engine.styled_representations))
+        return 2 * colors + len(target_colors) - represented, represented
+
+
+STRATEGIES = {strategy.name: strategy for strategy in (MappedItemStrategy(), DeepItemStrategy(), MaterialStrategy())}
+DEFAULT_STRATEGY = MappedItemStrategy.name
+
+
+class StylingEngine:
+    """
+    Styles color groups of elements with one of the STRATEGIES.
+    A strategy turns the roots of a group into targets (mapped items, geometric items or materials), reached by
+    the iterative walk of the traversal cache, and styles them with one shared style chain per color.
+    The styled item index, style cache and traversal cache can be shared with other engines on the same model.
+    Colors are RGB triples normalized to 0-1.
+    """
+
+    def __init__(self, ifc_file, strategy=DEFAULT_STRATEGY, traversal_cache=None, styled_item_index=None, style_cache=None):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown styling strategy {strategy!r}, expected one of {', '.join(STRATEGIES)}")
+        self.ifc_file = ifc_file
+        self.strategy = STRATEGIES[strategy]
+        self.traversal_cache = traversal_cache if traversal_cache is not None else TraversalCache()
+        self.styled_item_index = styled_item_index if styled_item_index is not None else build_styled_item_index(ifc_file)
+        self.style_cache = style_cache if style_cache is not None else build_style_cache(ifc_file)
+        self.styled_representations = {}  # rgb -> IfcStyledRepresentation of the material strategy
+        self.item_memo = {}  # element id -> geometric item ids of the deep strategy
+        self.removed_styled_item_count = 0  # IfcStyledItems removed by apply_changes()
+
+    def collect_targets(self, groups, on_group=None):
+        """
+        Returns the target ids of every group of root ids, in order.
+        on_group(root_ids) is called once each group is collected, e.g. to report progress.
+        """
+        closures = []
+        for root_ids in groups:
+            closures.append(self.strategy.targets(self, root_ids))
+            if on_group is not None:
+                on_group(root_ids)
+        return closures
+
+    def plan(self, color_groups, closures=None):
+        """
+        Plans the styling of [(rgb, root ids), ...]. A target reached by several groups is a conflict; the last group wins.
+        closures may carry the already collected targets of every group.
+        Returns the target id -> rgb assignment and the number of conflicting targets.
+        """
+        if closures is None:
+            closures = self.collect_targets([root_ids for _, root_ids in color_groups])
+
+        target_colors = {}
+        reached_count = 0
+        for (rgb, _), closure in zip(color_groups, closures):
+            rgb = normalize_rgb(rgb)
+            reached_count += len(closure)
+            for target_id in closure:
+                target_colors[target_id] = rgb
+        return target_colors, reached_count - len(target_colors)
+
+    def apply_changes(self, previous, current):
+        """
+        Moves the styling from the target colors `previous` to `current`, touching only targets whose color
+        changed. Style chains of colors that fell out of use are removed. Strategies without supports_diff
+        only style from scratch (previous empty).
+        Returns the number of restyled and unstyled targets.
+        """
+        if previous and not self.strategy.supports_diff:
+            raise ValueError(f"The {self.strategy.name} strategy can't apply changes, restyle fully instead")
+        restyle, unstyle = diff_item_colors(previous, current)
+        for rgb, target_ids in restyle.items():
+            self.strategy.apply(self, target_ids, rgb)
+        if unstyle:
+            self.strategy.remove(self, unstyle)
+        for rgb in set(previous.values()) - set(current.values()):
+            remove_unused_style(self.ifc_file, rgb, self.style_cache)
+        return sum(len(target_ids) for target_ids in restyle.values()), len(unstyle)
+
+    def apply_targets(self, target_ids, rgb):
+        self.strategy.apply(self, target_ids, normalize_rgb(rgb))
+
+    def style_group(self, root_ids, rgb):
+        """Styles one group of roots right away. Returns the number of styled targets."""
+        target_ids = self.strategy.targets(self, root_ids)
+        self.apply_targets(target_ids, rgb)
+        return len(target_ids)
+
+    def dry_run(self, color_groups, closures=None):
+        """
+        Plans the styling of the color groups without changing the model and returns the planned counts:
+        targets, conflicts, colors, and the entities the styling would create and edit.
+        """
+        target_colors, conflict_count = self.plan(color_groups, closures)
+        colors = set(target_colors.values())
+        schema_version = get_ifc_schema_version(self.ifc_file)
+        chain_size = 4 if supports_presentation_style_assignment(self.ifc_file) else 3
+        new_color_count = sum(1 for rgb in colors if (schema_version, rgb) not in self.style_cache)
+        created_count, edited_count = self.strategy.planned_entities(self, target_colors)
+        return {
+            "strategy": self.strategy.name,
+            "targets": len(target_colors),
+            "conflicts": conflict_count,
+            "colors": len(colors),
+            "entitiesCreated": created_count + new_color_count * chain_size,
+            "entitiesEdited": edited_count,
+        }
+
+
+def update_element_and_children_colors(ifc_file, root_element, rgb, styled_item_index, style_cache,
+                                       strategy=DEFAULT_STRATEGY, traversal_cache=None):
+    """
+    Colors an element and everything the recolor walk reaches from it (decomposition children and objects
+    sharing its type) with a StylingEngine strategy, by default on their IfcMappedItems.
+    The styled item index and style cache are built once per model by the caller (build_styled_item_index,
+    build_style_cache); pass the same traversal_cache for several roots of one model to share their walks.
+    Returns the number of styled targets.
+    """
+    engine = StylingEngine(ifc_file, strategy, traversal_cache, styled_item_index, style_cache)
+    return engine.style_group([root_element.id()], rgb)
+
+
+def apply_color_to_mapped_items(ifc_file, mapped_item_ids, rgb, styled_item_index, style_cache):
+    """
+    Styling pass for a precomputed set of IfcMappedItems, as collected by TraversalCache.
+    Same result as calling update_element_and_children_colors for each root of the set.
+    """
+    engine = StylingEngine(ifc_file, "mapped", styled_item_index=styled_item_index, style_cache=style_cache)
+    engine.apply_targets(mapped_item_ids, rgb)
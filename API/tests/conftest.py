@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+API_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_MODEL = os.path.normpath(os.path.join(API_DIRECTORY, "..", "Temp", "temp2.ifc"))
+
+# The API modules are flat scripts, imported by name like app.py does
+sys.path.insert(0, API_DIRECTORY)
+
+from mock_aps import MockApsServer  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def sample_model():
+    """Path of the bundled IFC2X3 sample model."""
+    return SAMPLE_MODEL
+
+
+@pytest.fixture(scope="session")
+def sample_guids(sample_model):
+    import ifcopenshell
+
+    return [product.GlobalId for product in ifcopenshell.open(sample_model).by_type("IfcProduct")]
+
+
+@pytest.fixture
+def aps_server(monkeypatch):
+    """Mock APS server that the API modules send their Autodesk calls to."""
+    import aps_client
+    import uploader
+
+    server = MockApsServer().start()
+    for module in (aps_client, uploader):
+        monkeypatch.setattr(module, "APS_BASE_URL", server.base_url)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch, aps_server, sample_model):
+    """
+    The Flask app against the mock APS server, which serves the sample model as version "v1" of project "p1".
+    The model cache (without sidecars), workspaces and local exports live under tmp_path.
+    """
+    import app
+    from aps_client import ApsClient
+    from model_cache import ModelCache
+
+    aps_server.add_version("v1", sample_model)
+    monkeypatch.setattr(app, "APS_BASE_URL", aps_server.base_url)
+    monkeypatch.setattr(app, "aps_client", ApsClient())
+    monkeypatch.setattr(app, "model_cache", ModelCache(str(tmp_path / "cache"), 1024 * 1024 * 1024, sidecars=False))
+    monkeypatch.setattr(app, "workspace_root", str(tmp_path / "jobs"))
+    monkeypatch.setattr(app, "export_mode", "local")
+    monkeypatch.setattr(app, "export_gzip", False)
+    monkeypatch.setattr(app, "export_directory", str(tmp_path / "exports"))
+    return app
@@ -0,0 +1,110 @@
+import ifcopenshell
+import pytest
+
+from model_cache import ModelCache
+
+BUDGET = 1024 * 1024 * 1024
+REQUEST = {"versionID": "v1", "projectID": "p1", "accessToken": "token"}
+
+
+def post(app_module, route, **payload):
+    return app_module.app.test_client().post(route, json={**REQUEST, **payload})
+
+
+def s3_downloads(aps_server):
+    return [path for method, path in aps_server.requests if method == "GET" and path.startswith("/s3/")]
+
+
+@pytest.mark.parametrize("route", ["/api/update_ifc", "/api/materials"])
+def test_unknown_token_is_rejected_on_a_cache_miss(app_module, aps_server, route):
+    aps_server.tokens = {"token"}
+
+    response = post(app_module, route, accessToken="unknown")
+
+    assert response.status_code == 403
+    assert not s3_downloads(aps_server)
+
+
+@pytest.mark.parametrize("route", ["/api/update_ifc", "/api/materials"])
+def test_unknown_token_is_rejected_on_a_cache_hit(app_module, aps_server, route):
+    aps_server.tokens = {"token", "other"}
+    assert post(app_module, "/api/update_ifc").status_code == 200
+
+    aps_server.tokens = {"token"}
+    assert post(app_module, route, accessToken="unknown").status_code == 403
+    assert post(app_module, route, accessToken="other").status_code == 403
+    assert post(app_module, route).status_code == 200
+    assert len(s3_downloads(aps_server)) == 1
+
+
+def test_unknown_token_is_rejected_for_versions_restored_from_sidecars(app_module, aps_server, monkeypatch, tmp_path):
+    aps_server.tokens = {"token"}
+    cache_directory = str(tmp_path / "sidecar-cache")
+    monkeypatch.setattr(app_module, "model_cache", ModelCache(cache_directory, BUDGET, sidecars=True))
+    assert post(app_module, "/api/update_ifc").status_code == 200
+
+    # A restarted process knows the version from its sidecar
+    monkeypatch.setattr(app_module, "model_cache", ModelCache(cache_directory, BUDGET, sidecars=True))
+    assert ("p1", "v1") in app_module.model_cache.versions
+
+    assert post(app_module, "/api/update_ifc", accessToken="unknown").status_code == 403
+    response = post(app_module, "/api/update_ifc")
+    assert response.status_code == 200
+    assert response.get_json()["metrics"]["counters"]["modelCacheHits"] == 1
+    assert len(s3_downloads(aps_server)) == 1
+
+
+def test_upload_export_creates_a_version(app_module, aps_server, monkeypatch):
+    monkeypatch.setattr(app_module, "export_mode", "upload")
+
+    response = post(app_module, "/api/update_ifc")
+
+    assert response.status_code == 200
+    export = response.get_json()["export"]
+    assert export["fileName"] == "temp2.ifc"
+    assert export["versionId"]
+    assert aps_server.uploaded_bytes == export["bytes"] > 0
+
+
+def test_file_export_uploads_the_written_file(app_module, aps_server, monkeypatch):
+    monkeypatch.setattr(app_module, "export_mode", "file")
+
+    response = post(app_module, "/api/update_ifc")
+
+    assert response.status_code == 200
+    export = response.get_json()["export"]
+    assert export["fileName"] == "temp2.ifc"
+    assert export["versionId"]
+    uploaded = [content for key, content in aps_server.objects.items() if key.endswith("-temp2.ifc")]
+    assert [len(content) for content in uploaded] == [export["bytes"]]
+
+
+@pytest.mark.parametrize("body", [
+    {"projectID": "p1", "accessToken": "token"},
+    {"versionID": "v1", "accessToken": "token"},
+    {"versionID": "v1", "projectID": "p1", "accessToken": ""},
+    {"versionID": ["v1"], "projectID": "p1", "accessToken": "token"},
+    ["v1", "p1", "token"],
+])
+def test_invalid_materials_request_is_a_bad_request(app_module, aps_server, body):
+    response = app_module.app.test_client().post("/api/materials", json=body)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+    assert not aps_server.requests
+
+
+def test_materials_keep_the_styling_kept_for_diff_saves(app_module, sample_model, sample_guids):
+    inventory = app_module.build_material_inventory(ifcopenshell.open(sample_model))
+    assert any(color != "Unknown Color" for colors in inventory.values() for color in colors)
+    elements = [{"ifcGUIDs": sample_guids, "color": "#FF0000"}]
+    assert post(app_module, "/api/update_ifc", elements=elements).status_code == 200
+
+    # The inventory was taken when the model was loaded, before the save purged the material styles
+    response = post(app_module, "/api/materials")
+    assert response.status_code == 200
+    assert response.get_json() == inventory
+    assert app_module.model_cache.get("p1", "v1").style_snapshot is not None
+
+    response = post(app_module, "/api/update_ifc", elements=elements)
+    assert response.get_json()["metrics"]["counters"]["diffSaves"] == 1
@@ -0,0 +1,113 @@
+import pytest
+
+import aps_client
+from aps_client import ApsClient, LookupCache
+
+VERSION_PATH = "/data/v1/projects/p1/versions/v1"
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the backoff delays instead of sleeping."""
+    delays = []
+    monkeypatch.setattr(aps_client.time, "sleep", delays.append)
+    return delays
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(aps_client.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def version(aps_server, sample_model):
+    aps_server.add_version("v1", sample_model)
+    return f"{aps_server.base_url}{VERSION_PATH}"
+
+
+def requests_to(aps_server, method, path):
+    return [request for request in aps_server.requests if request == (method, path)]
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_get_is_retried_with_backoff(aps_server, version, sleeps, status):
+    aps_server.fail("GET", VERSION_PATH, status, status)
+
+    response = ApsClient(backoff_seconds=0.5).get(version)
+
+    assert response.status_code == 200
+    assert len(requests_to(aps_server, "GET", VERSION_PATH)) == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_retries_stop_after_max_retries(aps_server, version, sleeps):
+    aps_server.fail("GET", VERSION_PATH, *[503] * 5)
+
+    response = ApsClient(max_retries=2, backoff_seconds=0.5).get(version)
+
+    assert response.status_code == 503
+    assert len(requests_to(aps_server, "GET", VERSION_PATH)) == 3
+
+
+def test_retry_after_is_honored_and_capped(aps_server, version, sleeps):
+    aps_server.retry_after = "7"
+    aps_server.fail("GET", VERSION_PATH, 429, 429)
+
+    response = ApsClient(backoff_seconds=0.5, max_backoff_seconds=5).get(version)
+
+    assert response.status_code == 200
+    assert sleeps == [5, 5]
+
+
+def test_post_is_only_retried_when_throttled(aps_server, sleeps):
+    # POSTs create storage, items and versions, so a server error may have been processed already
+    client = ApsClient(backoff_seconds=0)
+    path = "/data/v1/projects/p1/unmocked"
+    aps_server.fail("POST", path, 500)
+    assert client.post(f"{aps_server.base_url}{path}").status_code == 500
+    assert len(requests_to(aps_server, "POST", path)) == 1
+
+    aps_server.fail("POST", path, 429)
+    assert client.post(f"{aps_server.base_url}{path}").status_code == 404
+    assert len(requests_to(aps_server, "POST", path)) == 3
+
+
+def test_request_without_retry_returns_the_first_response(aps_server, version, sleeps):
+    aps_server.fail("GET", VERSION_PATH, 503)
+
+    response = ApsClient(backoff_seconds=0).request("GET", version, retry=False)
+
+    assert response.status_code == 503
+    assert not sleeps
+
+
+def test_version_details_are_cached_per_token_until_the_ttl(aps_server, version, clock):
+    client = ApsClient()
+
+    client.get_version_details("p1", "v1", "token")
+    client.get_version_details("p1", "v1", "token")
+    assert len(requests_to(aps_server, "GET", VERSION_PATH)) == 1
+
+    client.get_version_details("p1", "v1", "other")
+    assert len(requests_to(aps_server, "GET", VERSION_PATH)) == 2
+
+    clock[0] += client.version_details_cache.ttl_seconds + 1
+    client.get_version_details("p1", "v1", "token")
+    assert len(requests_to(aps_server, "GET", VERSION_PATH)) == 3
+
+
+def test_lookup_cache_expires_and_evicts_the_least_recently_used(clock):
+    cache = LookupCache(max_entries=2, ttl_seconds=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    clock[0] += 10.5
+    assert cache.get("a") is None
+    assert cache.get("c") is None
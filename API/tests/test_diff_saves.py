@@ -0,0 +1,92 @@
+import ifcopenshell
+import pytest
+
+from model_cache import ModelCache
+
+BUDGET = 1024 * 1024 * 1024
+REQUEST = {"versionID": "v1", "projectID": "p1", "accessToken": "token"}
+
+
+def styling(path):
+    """Color of every styled item in a written model, and the number of surface styles and colors."""
+    ifc_file = ifcopenshell.open(path)
+    colors = {}
+    for styled_item in ifc_file.by_type("IfcStyledItem"):
+        style = styled_item.Styles[0]
+        if style.is_a("IfcPresentationStyleAssignment"):
+            style = style.Styles[0]
+        colour = style.Styles[0].SurfaceColour
+        item_id = styled_item.Item.id() if styled_item.Item else None
+        colors[item_id] = (round(colour.Red, 3), round(colour.Green, 3), round(colour.Blue, 3))
+    return colors, len(ifc_file.by_type("IfcSurfaceStyle")), len(ifc_file.by_type("IfcColourRgb"))
+
+
+def save(app_module, **payload):
+    response = app_module.app.test_client().post("/api/update_ifc", json={**REQUEST, **payload})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def save_sequence(app_module, monkeypatch, diff_saves, saves, **cache_options):
+    monkeypatch.setattr(app_module, "diff_saves", diff_saves)
+    monkeypatch.setattr(
+        app_module, "model_cache",
+        ModelCache(app_module.model_cache.cache_directory, BUDGET, sidecars=False, **cache_options),
+    )
+    results = []
+    for payload in saves:
+        result = save(app_module, **payload)
+        results.append((result["restyle"]["mode"], styling(result["export"]["path"])))
+    return results
+
+
+def recolor_sequence(guids, strategy):
+    return [
+        {"strategy": strategy, "elements": elements}
+        for elements in (
+            [{"ifcGUIDs": guids[:40], "color": "#FF0000"}, {"ifcGUIDs": guids[40:], "color": "#00FF88"}],
+            [{"ifcGUIDs": guids[:40], "color": "#FF0000"}, {"ifcGUIDs": guids[40:], "color": "#00FF88"}],
+            [{"ifcGUIDs": guids[:39], "color": "#FF0000"}, {"ifcGUIDs": guids[39:40], "color": "#0000FF"},
+             {"ifcGUIDs": guids[40:], "color": "#00FF88"}],
+            [{"ifcGUIDs": guids[:30], "color": "#FF0000"}, {"ifcGUIDs": guids[40:], "color": "#123456"}],
+            [{"ifcGUIDs": guids[:5], "color": "#ABCDEF"}],
+            [],
+            [{"ifcGUIDs": guids[40:], "color": "#00FF88"}, {"ifcGUIDs": guids[:40], "color": "invalid"}],
+        )
+    ]
+
+
+@pytest.mark.parametrize("strategy", ["mapped", "deep"])
+def test_diff_saves_equal_full_saves(app_module, monkeypatch, sample_guids, strategy):
+    saves = recolor_sequence(sample_guids, strategy)
+
+    diffed = save_sequence(app_module, monkeypatch, True, saves)
+    full = save_sequence(app_module, monkeypatch, False, saves)
+
+    assert [mode for mode, _ in diffed] == ["full"] + ["diff"] * (len(saves) - 1)
+    assert [result for _, result in diffed] == [result for _, result in full]
+
+
+def test_strategy_change_restyles_fully(app_module, monkeypatch, sample_guids):
+    elements = [{"ifcGUIDs": sample_guids[:40], "color": "#FF0000"}]
+
+    switched = save_sequence(app_module, monkeypatch, True, [
+        {"strategy": "mapped", "elements": elements},
+        {"strategy": "deep", "elements": elements},
+        {"strategy": "material", "elements": elements},
+        {"strategy": "material", "elements": elements},
+    ])
+    deep_only = save_sequence(app_module, monkeypatch, False, [{"strategy": "deep", "elements": elements}])
+
+    assert [mode for mode, _ in switched] == ["full", "full", "full", "full"]
+    assert switched[1][1] == deep_only[0][1]
+
+
+def test_kept_styling_is_restyled_fully_after_max_kept_saves(app_module, monkeypatch, sample_guids):
+    saves = recolor_sequence(sample_guids, "mapped")[:5]
+
+    capped = save_sequence(app_module, monkeypatch, True, saves, max_kept_saves=2)
+    full = save_sequence(app_module, monkeypatch, False, saves)
+
+    assert [mode for mode, _ in capped] == ["full", "diff", "full", "diff", "full"]
+    assert [result for _, result in capped] == [result for _, result in full]
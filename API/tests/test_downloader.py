@@ -0,0 +1,104 @@
+import os
+
+import pytest
+import requests
+
+import downloader
+from downloader import ChecksumMismatch, download_file_ranged
+from mock_aps import BUCKET_KEY, MockApsServer
+from workspace import WorkspaceQuotaExceeded
+
+CHUNK_SIZE = 256 * 1024
+
+
+@pytest.fixture
+def server():
+    server = MockApsServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def signed_download(server, sample_model):
+    """Signed URL and SHA-1 of the sample model, served by the mock server."""
+    server.add_version("v1", sample_model)
+    object_key = os.path.basename(sample_model)
+    response = requests.get(f"{server.base_url}/oss/v2/buckets/{BUCKET_KEY}/objects/{object_key}/signeds3download")
+    return response.json()
+
+
+def read(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def test_ranged_download_matches_file(tmp_path, sample_model, signed_download):
+    target = tmp_path / "download.ifc"
+
+    size = download_file_ranged(signed_download["url"], str(target), chunk_size=CHUNK_SIZE, parallelism=4,
+                                expected_sha1=signed_download["sha1"])
+
+    assert size == os.path.getsize(sample_model)
+    assert read(target) == read(sample_model)
+
+
+@pytest.mark.parametrize("short_start", [0, CHUNK_SIZE], ids=["first chunk", "later chunk"])
+def test_short_chunk_is_retried(tmp_path, sample_model, server, signed_download, short_start):
+    server.short_reads[short_start] = 1
+    target = tmp_path / "download.ifc"
+
+    download_file_ranged(signed_download["url"], str(target), chunk_size=CHUNK_SIZE, parallelism=2)
+
+    assert server.short_reads[short_start] == 0
+    assert read(target) == read(sample_model)
+
+
+def test_persistent_short_read_fails(tmp_path, server, signed_download):
+    server.short_reads[CHUNK_SIZE] = 10
+
+    with pytest.raises(IOError, match="Short read"):
+        download_file_ranged(signed_download["url"], str(tmp_path / "download.ifc"), chunk_size=CHUNK_SIZE,
+                             parallelism=2, max_retries=1)
+
+
+def test_checksum_mismatch_is_raised(tmp_path, signed_download):
+    with pytest.raises(ChecksumMismatch):
+        download_file_ranged(signed_download["url"], str(tmp_path / "download.ifc"), chunk_size=CHUNK_SIZE,
+                             expected_sha1="0" * 40)
+
+
+def test_quota_is_checked_before_downloading(tmp_path, signed_download):
+    with pytest.raises(WorkspaceQuotaExceeded):
+        download_file_ranged(signed_download["url"], str(tmp_path / "download.ifc"), chunk_size=CHUNK_SIZE,
+                             max_bytes=CHUNK_SIZE)
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(downloader.time, "sleep", lambda seconds: None)
+
+
+def s3_gets(server):
+    return [path for method, path in server.requests if method == "GET" and path.startswith("/s3/")]
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_throttling_and_server_errors_are_retried(tmp_path, sample_model, server, signed_download, no_backoff, status):
+    server.fail("GET", r"/s3/.*", status, status)
+    target = tmp_path / "download.ifc"
+
+    download_file_ranged(signed_download["url"], str(target), chunk_size=CHUNK_SIZE, parallelism=1)
+
+    assert read(target) == read(sample_model)
+
+
+@pytest.mark.parametrize("status", [403, 404])
+def test_client_errors_fail_without_retries(tmp_path, server, signed_download, no_backoff, status):
+    server.fail("GET", r"/s3/.*", status)
+    server.requests.clear()
+
+    with pytest.raises(requests.HTTPError) as error:
+        download_file_ranged(signed_download["url"], str(tmp_path / "download.ifc"), chunk_size=CHUNK_SIZE)
+
+    assert error.value.response.status_code == status
+    assert len(s3_gets(server)) == 1
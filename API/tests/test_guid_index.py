@@ -0,0 +1,58 @@
+import ifcopenshell
+import pytest
+
+from guid_index import GuidIndex
+
+REQUEST = {"versionID": "v1", "projectID": "p1", "accessToken": "token"}
+
+
+@pytest.fixture(scope="module")
+def ifc_file(sample_model):
+    return ifcopenshell.open(sample_model)
+
+
+def test_groups_resolve_guids_and_step_ids_in_order(ifc_file):
+    product, other_product = ifc_file.by_type("IfcProduct")[:2]
+    element_type = ifc_file.by_type("IfcTypeObject")[0]
+
+    groups, missing = GuidIndex.build(ifc_file).resolve_groups(
+        [[product.GlobalId, element_type.id()], [f"#{other_product.id()}", str(element_type.id())]], ifc_file
+    )
+
+    assert groups == [[product.id(), element_type.id()], [other_product.id(), element_type.id()]]
+    assert missing == []
+
+
+def test_only_products_and_type_objects_resolve(ifc_file):
+    property_set = ifc_file.by_type("IfcPropertySet")[0]
+    colour = ifc_file.by_type("IfcColourRgb")[0]
+    product = ifc_file.by_type("IfcProduct")[0]
+    identifiers = [
+        property_set.GlobalId,  # a GlobalId, but not of a colorable entity
+        property_set.id(),
+        f"#{colour.id()}",
+        "0000000000000000000000",  # unknown GlobalId
+        10 ** 9,  # unknown STEP id
+        product.GlobalId,
+    ]
+
+    groups, missing = GuidIndex.build(ifc_file).resolve_groups([identifiers], ifc_file)
+
+    assert groups == [[product.id()]]
+    assert missing == identifiers[:-1]
+
+
+def test_update_reports_the_missing_guids(app_module, sample_guids, ifc_file):
+    property_set = ifc_file.by_type("IfcPropertySet")[0]
+    elements = [
+        {"ifcGUIDs": sample_guids[:5] + ["0000000000000000000000"], "color": "#FF0000"},
+        {"ifcGUIDs": [property_set.GlobalId, property_set.id()], "color": "#00FF00"},
+    ]
+
+    response = app_module.app.test_client().post("/api/update_ifc", json={**REQUEST, "elements": elements})
+
+    assert response.status_code == 200, response.get_json()
+    result = response.get_json()
+    assert result["missingGUIDs"] == ["0000000000000000000000", property_set.GlobalId, property_set.id()]
+    assert result["metrics"]["counters"]["guidsMissing"] == 3
+    assert result["metrics"]["counters"]["guidsRequested"] == 8
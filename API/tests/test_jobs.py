@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import JobManager, JobProgress
+
+REQUEST = {"versionID": "v1", "projectID": "p1", "accessToken": "token"}
+
+
+class RecordingProgress(JobProgress):
+    """JobProgress that also records every advance as (stage, amount)."""
+
+    def __init__(self):
+        super().__init__()
+        self.advances = []
+
+    def advance(self, stage, amount=1):
+        self.advances.append((stage, amount))
+        super().advance(stage, amount)
+
+
+def wait_for(job, timeout=60):
+    deadline = time.monotonic() + timeout
+    while job.finished_at is None:
+        assert time.monotonic() < deadline, f"job {job.id} did not finish"
+        time.sleep(0.01)
+    return job
+
+
+@pytest.fixture
+def manager():
+    return JobManager(max_workers=1, retention_seconds=60)
+
+
+def test_progress_reports_stages():
+    progress = JobProgress()
+
+    progress.start("write", 100)
+    progress.advance("write", 30)
+    progress.advance("write", 40)
+    assert progress.snapshot()["stages"]["write"] == {"done": 70, "total": 100}
+    assert progress.snapshot()["currentStage"] == "write"
+
+    progress.finish("write")
+    assert progress.snapshot()["stages"]["write"] == {"done": 70, "total": 70}
+
+
+def test_job_runs_through_its_lifecycle(manager):
+    started, release = threading.Event(), threading.Event()
+
+    def work(value, progress):
+        started.set()
+        release.wait(10)
+        progress.start("style", 2)
+        progress.advance("style", 2)
+        return {"value": value}
+
+    job = manager.submit(work, 42)
+    assert started.wait(10)
+    assert manager.get(job.id).to_dict()["status"] == "running"
+
+    release.set()
+    wait_for(job)
+    status = job.to_dict()
+    assert status["status"] == "succeeded"
+    assert status["result"] == {"value": 42}
+    assert status["error"] is None
+    assert status["progress"]["stages"]["style"] == {"done": 2, "total": 2}
+
+
+def test_failed_job_reports_its_error(manager):
+    def work(progress):
+        raise ValueError("model is broken")
+
+    job = wait_for(manager.submit(work))
+
+    assert job.to_dict()["status"] == "failed"
+    assert job.to_dict()["error"] == "model is broken"
+
+
+def test_finished_jobs_expire_after_the_retention(manager, monkeypatch):
+    job = wait_for(manager.submit(lambda progress: None))
+    assert manager.get(job.id) is job
+
+    finished_at = job.finished_at
+    monkeypatch.setattr(jobs.time, "time", lambda: finished_at + 30)
+    wait_for(manager.submit(lambda progress: None))
+    assert manager.get(job.id) is job
+
+    monkeypatch.setattr(jobs.time, "time", lambda: finished_at + 61)
+    wait_for(manager.submit(lambda progress: None))
+    assert manager.get(job.id) is None
+
+
+def test_save_job_is_polled_until_it_succeeds(app_module):
+    client = app_module.app.test_client()
+
+    rules = [{"category": "Trenner", "color": "#FF0000"}]
+    response = client.post("/api/update_ifc/jobs", json={**REQUEST, "rules": rules})
+    assert response.status_code == 202
+    job_id = response.get_json()["jobId"]
+
+    deadline = time.monotonic() + 60
+    while True:
+        status = client.get(f"/api/jobs/{job_id}").get_json()
+        if status["status"] in ("succeeded", "failed"):
+            break
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+    assert status["status"] == "succeeded", status["error"]
+    assert status["result"]["status"] == "success"
+    stages = status["progress"]["stages"]
+    assert stages["download"]["done"] == stages["download"]["total"] > 0
+    assert stages["style"] == {"done": 30, "total": 30}
+    assert stages["write"]["done"] == stages["write"]["total"] == status["result"]["export"]["bytes"]
+
+
+def test_unknown_job_is_not_found(app_module):
+    assert app_module.app.test_client().get("/api/jobs/unknown").status_code == 404
+
+
+def test_progress_advances_per_group_and_per_written_chunk(app_module, sample_guids):
+    progress = RecordingProgress()
+    groups = [sample_guids[:10], sample_guids[10:25], sample_guids[25:]]
+    data = {**REQUEST, "elements": [{"ifcGUIDs": guids, "color": "#00FF00"} for guids in groups]}
+
+    result = app_module.process_update_request(data, progress=progress)
+
+    assert [amount for stage, amount in progress.advances if stage == "style"] == [len(guids) for guids in groups]
+    write_advances = [amount for stage, amount in progress.advances if stage == "write"]
+    assert len(write_advances) > 1
+    assert sum(write_advances) == result["export"]["bytes"]
+    assert progress.snapshot()["stages"]["write"]["total"] == result["export"]["bytes"]
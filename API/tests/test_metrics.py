@@ -0,0 +1,116 @@
+import time
+
+import ifcopenshell
+
+from metrics import STAGE_BUCKETS, MetricsRegistry, RequestMetrics, profiled
+
+REQUEST = {"versionID": "v1", "projectID": "p1", "accessToken": "token"}
+
+
+def request_metrics(stages, counters=None, gauges=None):
+    metrics = RequestMetrics()
+    metrics.stages.update(stages)
+    for name, amount in (counters or {}).items():
+        metrics.count(name, amount)
+    for name, value in (gauges or {}).items():
+        metrics.set_gauge(name, value)
+    return metrics
+
+
+def test_repeated_stages_and_counters_accumulate():
+    metrics = RequestMetrics()
+
+    for _ in range(2):
+        with metrics.stage("style"):
+            time.sleep(0.01)
+        metrics.count("styledItemsCreated", 3)
+    metrics.set_gauge("modelEntities", 10)
+    metrics.set_gauge("modelEntities", 12)
+
+    result = metrics.to_dict()
+    assert result["stages"]["style"] >= 0.02
+    assert result["counters"] == {"styledItemsCreated": 6}
+    assert result["gauges"] == {"modelEntities": 12}
+
+
+def test_registry_renders_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    registry.add_gauge("ifc_model_cache_entries", "Models in the cache.", lambda: 2)
+    registry.observe_request(
+        request_metrics({"style": 0.02}, {"styledItemsRemoved": 5}, {"modelEntities": 100}), "success"
+    )
+    registry.observe_request(
+        request_metrics({"style": 0.3}, {"styledItemsRemoved": 7}, {"modelEntities": 120}), "success"
+    )
+    registry.observe_request(request_metrics({"download": 200.0}), "error")
+
+    lines = registry.render().splitlines()
+
+    assert 'ifc_update_requests_total{status="success"} 2' in lines
+    assert 'ifc_update_requests_total{status="error"} 1' in lines
+    assert "# TYPE ifc_update_styled_items_removed_total counter" in lines
+    assert "ifc_update_styled_items_removed_total 12" in lines
+    # Request gauges keep the latest value
+    assert "ifc_update_model_entities 120" in lines
+    assert 'ifc_update_stage_seconds_bucket{stage="style",le="0.01"} 0' in lines
+    assert 'ifc_update_stage_seconds_bucket{stage="style",le="0.025"} 1' in lines
+    assert 'ifc_update_stage_seconds_bucket{stage="style",le="0.5"} 2' in lines
+    assert 'ifc_update_stage_seconds_bucket{stage="style",le="+Inf"} 2' in lines
+    assert 'ifc_update_stage_seconds_sum{stage="style"} 0.320000' in lines
+    assert 'ifc_update_stage_seconds_count{stage="style"} 2' in lines
+    # Durations above the largest bucket only count towards +Inf
+    assert f'ifc_update_stage_seconds_bucket{{stage="download",le="{STAGE_BUCKETS[-1]}"}} 0' in lines
+    assert 'ifc_update_stage_seconds_bucket{stage="download",le="+Inf"} 1' in lines
+    assert lines[-3:] == [
+        "# HELP ifc_model_cache_entries Models in the cache.",
+        "# TYPE ifc_model_cache_entries gauge",
+        "ifc_model_cache_entries 2",
+    ]
+
+
+def busy_function():
+    return sum(range(1000))
+
+
+def test_profiled_reports_the_profiled_functions():
+    result = {}
+
+    with profiled(True, result):
+        busy_function()
+
+    assert "busy_function" in result["profile"]
+
+
+def test_profiling_is_off_unless_enabled():
+    result = {}
+
+    with profiled(False, result):
+        busy_function()
+
+    assert result == {}
+
+
+def save(app_module, elements):
+    response = app_module.app.test_client().post("/api/update_ifc", json={**REQUEST, "elements": elements})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["metrics"]["counters"]
+
+
+def test_styled_items_removed_counts_only_styled_items(app_module, sample_model, sample_guids):
+    styled_item_count = len(ifcopenshell.open(sample_model).by_type("IfcStyledItem"))
+    elements = [
+        {"ifcGUIDs": sample_guids[:30], "color": "#FF0000"},
+        {"ifcGUIDs": sample_guids[30:], "color": "#0000FF"},
+    ]
+
+    # A full save purges every styled item, among other style entities
+    counters = save(app_module, elements)
+    assert counters["styledItemsRemoved"] == styled_item_count
+    assert counters["entitiesRemoved"] > styled_item_count
+    created = counters["styledItemsCreated"]
+
+    # A diff save removes the styled items of the targets that lost their color
+    counters = save(app_module, elements[:1])
+    assert counters["diffSaves"] == 1
+    assert 0 < counters["styledItemsRemoved"] == counters["targetsUnstyled"] < created
+    assert counters["styledItemsCreated"] == 0
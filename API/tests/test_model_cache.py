@@ -0,0 +1,150 @@
+import os
+import shutil
+
+import pytest
+
+from model_cache import KEPT_OPERATION_COST, PARSED_MODEL_SIZE_FACTOR, ModelCache
+
+BUDGET = 1024 * 1024 * 1024
+
+
+@pytest.fixture
+def download(tmp_path, sample_model):
+    """Copies the sample model into a workspace, like a finished download, and returns its path."""
+    def copy(name="download.ifc", variant=0):
+        path = tmp_path / "workspace" / name
+        path.parent.mkdir(exist_ok=True)
+        shutil.copy(sample_model, path)
+        # Trailing blank lines give a variant its own checksum without changing the model
+        with open(path, "a") as file:
+            file.write("\n" * variant)
+        return str(path)
+    return copy
+
+
+def cache(tmp_path, **kwargs):
+    return ModelCache(str(tmp_path / "cache"), kwargs.pop("memory_budget", BUDGET), sidecars=False, **kwargs)
+
+
+def save(cached_model, color_count=1):
+    """A diff save that adds color_count colors and keeps them. Returns whether it started from kept styling."""
+    with cached_model.checkout_restyle() as ifc_file:
+        reused = cached_model.style_snapshot is not None
+        for _ in range(color_count):
+            ifc_file.create_entity("IfcColourRgb", None, 1.0, 0.0, 0.0)
+        cached_model.style_snapshot = object()
+    return reused
+
+
+def test_kept_styling_is_reused_until_max_kept_saves(tmp_path, download):
+    cached_model = cache(tmp_path, max_kept_saves=3).put("p1", "v1", download())
+    colour_count = len(cached_model.ifc_file.by_type("IfcColourRgb"))
+
+    assert [save(cached_model) for _ in range(5)] == [False, True, True, False, True]
+    # The rolled back saves left nothing behind: only the two saves since the full restyle are kept
+    assert cached_model.kept_saves == 2
+    assert len(cached_model.ifc_file.by_type("IfcColourRgb")) == colour_count + 2
+    with cached_model.checkout() as ifc_file:
+        assert len(ifc_file.by_type("IfcColourRgb")) == colour_count
+
+
+def test_kept_styling_is_restyled_fully_after_max_kept_operations(tmp_path, download):
+    cached_model = cache(tmp_path, max_kept_operations=10).put("p1", "v1", download())
+
+    assert save(cached_model, 6) is False
+    assert save(cached_model, 6) is True
+    assert save(cached_model, 6) is False
+    assert cached_model.kept_operations == 6
+
+
+def test_kept_operations_count_towards_the_cache_cost(tmp_path, download):
+    model_cache = cache(tmp_path)
+    cached_model = model_cache.put("p1", "v1", download())
+    base_cost = cached_model.file_size * PARSED_MODEL_SIZE_FACTOR
+    assert model_cache.stats()["costBytes"] == base_cost
+
+    save(cached_model, 5)
+    save(cached_model, 5)
+
+    assert model_cache.stats()["costBytes"] == base_cost + 10 * KEPT_OPERATION_COST
+    with cached_model.checkout():
+        pass
+    assert model_cache.stats()["costBytes"] == base_cost
+
+
+def test_failed_save_drops_the_kept_styling(tmp_path, download):
+    cached_model = cache(tmp_path).put("p1", "v1", download())
+    save(cached_model, 3)
+
+    with pytest.raises(RuntimeError):
+        with cached_model.checkout_restyle() as ifc_file:
+            ifc_file.create_entity("IfcColourRgb", None, 1.0, 0.0, 0.0)
+            raise RuntimeError("export failed")
+
+    assert cached_model.style_snapshot is None
+    assert (cached_model.kept_saves, cached_model.kept_operations) == (0, 0)
+    assert save(cached_model) is False
+
+
+def count_colours(ifc_file):
+    return {"colours": len(ifc_file.by_type("IfcColourRgb"))}
+
+
+def test_material_inventory_is_taken_from_the_downloaded_file(tmp_path, download):
+    cached_model = cache(tmp_path).put("p1", "v1", download())
+    colour_count = len(cached_model.ifc_file.by_type("IfcColourRgb"))
+    save(cached_model, 3)
+
+    # Built after a save, the inventory comes from a fresh parse and the kept styling stays applied
+    assert cached_model.ensure_material_inventory(count_colours) == {"colours": colour_count}
+    assert cached_model.kept_saves == 1
+    assert save(cached_model) is True
+    assert cached_model.ensure_material_inventory(lambda ifc_file: None) == {"colours": colour_count}
+
+
+def model_cost(download):
+    return os.path.getsize(download()) * PARSED_MODEL_SIZE_FACTOR
+
+
+def test_least_recently_used_models_are_evicted(tmp_path, download):
+    model_cache = cache(tmp_path, memory_budget=2 * model_cost(download) + 1024)
+    first = model_cache.put("p1", "v1", download(variant=1))
+    second = model_cache.put("p1", "v2", download(variant=2))
+    assert model_cache.get("p1", "v1") is first
+
+    model_cache.put("p1", "v3", download(variant=3))
+
+    assert model_cache.get("p1", "v2") is None
+    assert not os.path.exists(second.file_path)
+    assert model_cache.get("p1", "v1") is first
+    assert model_cache.stats()["models"] == 2
+
+
+def test_checked_out_models_are_not_evicted(tmp_path, download):
+    model_cache = cache(tmp_path, memory_budget=model_cost(download) + 1024)
+    first = model_cache.put("p1", "v1", download(variant=1))
+
+    with first.checkout():
+        second = model_cache.put("p1", "v2", download(variant=2))
+        # Over budget until the next eviction, which finds the first model returned
+        assert model_cache.get("p1", "v1") is first
+        assert os.path.exists(first.file_path)
+
+    model_cache.put("p1", "v3", download(variant=3))
+    assert model_cache.get("p1", "v1") is None
+    assert model_cache.get("p1", "v2") is None
+    assert not os.path.exists(second.file_path)
+    assert model_cache.stats()["models"] == 1
+
+
+def test_models_over_the_budget_are_not_reopened(tmp_path, download):
+    cache_directory = str(tmp_path / "cache")
+    cached_file_path = ModelCache(cache_directory, BUDGET).put("p1", "v1", download()).file_path
+
+    # A restart with a smaller budget drops the cached file instead of parsing it
+    model_cache = ModelCache(cache_directory, model_cost(download) - 1)
+    assert ("p1", "v1") in model_cache.versions
+    assert model_cache.get("p1", "v1") is None
+    assert ("p1", "v1") not in model_cache.versions
+    assert not os.path.exists(cached_file_path)
+    assert ModelCache(cache_directory, BUDGET).get("p1", "v1") is None
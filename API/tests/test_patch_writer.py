@@ -0,0 +1,97 @@
+import io
+
+import ifcopenshell
+import pytest
+
+from patch_writer import StepIndex, StepIndexError, stream_patched, write_patched
+from styles import purge_styles
+from styling_engine import StylingEngine
+
+
+def write_tricky_copy(sample_model, path):
+    """Copies the sample with section keywords, instance starts and ";" inside strings and comments."""
+    with open(sample_model, "r", encoding="utf-8") as file:
+        content = file.read()
+    content = content.replace("FILE_DESCRIPTION(('", "FILE_DESCRIPTION(('DATA; ENDSEC; ", 1)
+    content = content.replace(
+        "#1=IFCORGANIZATION($,'",
+        "/* comment; #7=X; */\n#1=IFCORGANIZATION($,'It''s;\n#99999=IFCWALL();\nENDSEC;\n ",
+        1,
+    )
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(content)
+    return str(path)
+
+
+def restyle(ifc_file):
+    """Purges, edits and creates entities inside a recorded transaction, like a save does."""
+    ifc_file.set_history_size(1)
+    ifc_file.begin_transaction()
+    purge_styles(ifc_file)
+    ifc_file.by_id(1).Name = "Renamed; with 'quotes' and DATA;"
+    product_ids = [product.id() for product in ifc_file.by_type("IfcProduct")]
+    StylingEngine(ifc_file).style_group(product_ids[:30], (1.0, 0.0, 0.0))
+
+
+def instances(path):
+    return {entity.id(): entity.to_string() for entity in ifcopenshell.open(path)}
+
+
+@pytest.fixture(params=["sample", "tricky"])
+def model_path(request, tmp_path, sample_model):
+    if request.param == "sample":
+        return sample_model
+    return write_tricky_copy(sample_model, tmp_path / "tricky.ifc")
+
+
+def test_patched_output_equals_full_write(tmp_path, model_path):
+    ifc_file = ifcopenshell.open(model_path)
+    restyle(ifc_file)
+
+    write_patched(ifc_file, StepIndex.build(model_path), model_path, str(tmp_path / "patched.ifc"))
+    ifc_file.write(str(tmp_path / "full.ifc"))
+
+    assert instances(str(tmp_path / "patched.ifc")) == instances(str(tmp_path / "full.ifc"))
+
+
+def test_index_ignores_strings_and_comments(tmp_path, sample_model):
+    plain = StepIndex.build(sample_model)
+    tricky = StepIndex.build(write_tricky_copy(sample_model, tmp_path / "tricky.ifc"))
+
+    assert list(tricky.ids) == list(plain.ids)
+    assert 99999 not in tricky.ids
+
+
+@pytest.mark.parametrize("replace, replacement", [
+    ("DATA;\n", "DATA;\n#1=IFCX('unterminated);\nDATA;\n"),
+    ("DATA;\n", "DATA;\nDATA;\n"),
+    ("END-ISO-10303-21;", "DATA;\n#1=IFCX();\nENDSEC;\nEND-ISO-10303-21;"),
+    ("DATA;\n", "DATA;\n#5=IFCX();\n"),
+    ("DATA;", "NODATA;"),
+], ids=["unterminated string", "nested data", "second data", "duplicate id", "no data"])
+def test_ambiguous_files_are_rejected(tmp_path, sample_model, replace, replacement):
+    with open(sample_model, "r", encoding="utf-8") as file:
+        content = file.read().replace(replace, replacement, 1)
+    path = tmp_path / "ambiguous.ifc"
+    path.write_text(content, encoding="utf-8")
+
+    with pytest.raises(StepIndexError):
+        StepIndex.build(str(path))
+
+
+def test_changed_instance_missing_from_index_writes_nothing(sample_model):
+    ifc_file = ifcopenshell.open(sample_model)
+    restyle(ifc_file)
+    step_index = StepIndex.build(sample_model)
+    position = step_index.position(1)
+    incomplete = StepIndex(
+        step_index.ids[:position] + step_index.ids[position + 1:],
+        step_index.starts[:position] + step_index.starts[position + 1:],
+        step_index.data_start,
+        step_index.data_end,
+    )
+    output = io.BytesIO()
+
+    with pytest.raises(StepIndexError):
+        stream_patched(ifc_file, incomplete, sample_model, output)
+    assert output.getvalue() == b""
@@ -0,0 +1,130 @@
+import base64
+import gzip
+from array import array
+
+import ifcopenshell
+import pytest
+
+from guid_index import GuidIndex
+from payload import PayloadError, decode_packed_elements, decompress_body, normalize_update_payload
+from style_snapshot import assign_element_colors
+from styles import hex_to_rgb, isValidHex
+from styling_engine import StylingEngine
+
+
+def pack(elements):
+    """Packs JSON color groups like packElements in the web client."""
+    palette, guids, color_indices = [], [], array("H")
+    for element in elements:
+        if element["color"] not in palette:
+            palette.append(element["color"])
+        for guid in element["ifcGUIDs"]:
+            guids.append(guid)
+            color_indices.append(palette.index(element["color"]))
+    return {
+        "format": "packed",
+        "palette": palette,
+        "guids": "".join(guids),
+        "colors": base64.b64encode(color_indices.tobytes()).decode("ascii"),
+    }
+
+
+@pytest.fixture(scope="module")
+def ifc_file(sample_model):
+    return ifcopenshell.open(sample_model)
+
+
+def plan(ifc_file, elements):
+    """
+    Element and target colors of JSON color groups, as /api/update_ifc plans them.
+    Conflict counts are left out: packing drops repeated GUIDs, which only changes how many conflicts are reported.
+    """
+    element_groups, missing = GuidIndex.build(ifc_file).resolve_groups([data["ifcGUIDs"] for data in elements], ifc_file)
+    styled_groups = [
+        (hex_to_rgb(data["color"]), element_ids)
+        for data, element_ids in zip(elements, element_groups)
+        if isValidHex(data["color"])
+    ]
+    target_colors, _ = StylingEngine(ifc_file).plan(styled_groups)
+    return assign_element_colors(styled_groups), target_colors, missing
+
+
+def test_packed_payload_plans_like_json(ifc_file, sample_guids):
+    # Overlapping groups, a color used twice, an invalid color and a GUID repeated across groups
+    elements = [
+        {"ifcGUIDs": sample_guids[:40], "color": "#FF0000"},
+        {"ifcGUIDs": sample_guids[30:60], "color": "#00FF88"},
+        {"ifcGUIDs": sample_guids[55:], "color": "#FF0000"},
+        {"ifcGUIDs": sample_guids[:5], "color": "invalid"},
+        {"ifcGUIDs": sample_guids[10:12], "color": "#0000FF"},
+    ]
+
+    decoded = normalize_update_payload(pack(elements), isValidHex)["elements"]
+
+    assert plan(ifc_file, decoded) == plan(ifc_file, elements)
+
+
+def test_rows_keep_their_order():
+    guids = ["A" * 22, "B" * 22, "C" * 22]
+    elements = [
+        {"ifcGUIDs": [guids[0]], "color": "#FF0000"},
+        {"ifcGUIDs": [guids[1]], "color": "#0000FF"},
+        {"ifcGUIDs": [guids[2]], "color": "#FF0000"},
+    ]
+    packed = pack(elements)
+
+    decoded = decode_packed_elements(packed["palette"], packed["guids"], packed["colors"], isValidHex)
+
+    assert decoded == elements
+
+
+def test_last_occurrence_of_a_guid_wins():
+    guid = "A" * 22
+    packed = pack([{"ifcGUIDs": [guid], "color": "#FF0000"}, {"ifcGUIDs": [guid], "color": "#0000FF"}])
+
+    decoded = decode_packed_elements(packed["palette"], packed["guids"], packed["colors"], isValidHex)
+
+    assert decoded == [{"ifcGUIDs": [guid], "color": "#0000FF"}]
+
+
+@pytest.mark.parametrize("palette, guids, colors", [
+    (["#FF0000"], "A" * 21, base64.b64encode(bytes(2)).decode()),
+    (["#FF0000"], "A" * 22, "@@"),
+    (["#FF0000"], "A" * 44, base64.b64encode(bytes(2)).decode()),
+    (["#FF0000"], "A" * 22, base64.b64encode(array("H", [1]).tobytes()).decode()),
+    ("#FF0000", "A" * 22, base64.b64encode(bytes(2)).decode()),
+], ids=["guid length", "base64", "count", "palette index", "palette type"])
+def test_malformed_packed_arrays_are_rejected(palette, guids, colors):
+    with pytest.raises(PayloadError):
+        decode_packed_elements(palette, guids, colors, isValidHex)
+
+
+def test_compressed_body_is_inflated_within_the_limit():
+    body = b'{"elements": []}' * 100
+
+    assert decompress_body(gzip.compress(body), "gzip", len(body)) == body
+    with pytest.raises(PayloadError):
+        decompress_body(gzip.compress(body), "gzip", len(body) - 1)
+    with pytest.raises(PayloadError):
+        decompress_body(body, "br", len(body))
+
+
+def test_uncompressed_body_is_held_to_the_limit():
+    body = b'{"elements": []}' * 100
+
+    assert decompress_body(body, None, len(body)) == body
+    assert decompress_body(body, "identity", len(body)) == body
+    with pytest.raises(PayloadError, match="exceeds"):
+        decompress_body(body, "identity", len(body) - 1)
+
+
+def test_oversized_request_is_refused_before_it_is_read(app_module, aps_server, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, "MAX_CONTENT_LENGTH", 1024)
+    request = {"versionID": "v1", "projectID": "p1", "accessToken": "token"}
+
+    response = app_module.app.test_client().post(
+        "/api/update_ifc", json={**request, "elements": [{"ifcGUIDs": ["x" * 22] * 100, "color": "#FF0000"}]}
+    )
+
+    assert response.status_code == 413
+    assert not aps_server.requests
@@ -0,0 +1,119 @@
+import ifcopenshell
+import pytest
+
+from rules import CompiledRule, RuleError, SelectorIndex, compile_rules
+from styles import hex_to_rgb
+
+REQUEST = {"versionID": "v1", "projectID": "p1", "accessToken": "token"}
+
+
+@pytest.fixture(scope="module")
+def model(sample_model):
+    ifc_file = ifcopenshell.open(sample_model)
+    return ifc_file, SelectorIndex.build(ifc_file)
+
+
+def select(model, **rule):
+    ifc_file, index = model
+    return set(CompiledRule.compile({"color": "#FF0000", **rule}).evaluate(index, ifc_file))
+
+
+def ids_of_type(model, *type_names):
+    ifc_file, _ = model
+    return {element.id() for type_name in type_names for element in ifc_file.by_type(type_name)}
+
+
+def test_ifc_type_selects_every_listed_type(model):
+    selected = select(model, ifcType=["IfcFlowController", "IfcFlowTerminal"])
+
+    assert selected == ids_of_type(model, "IfcFlowController", "IfcFlowTerminal")
+    assert select(model, ifcType="IfcFlowTerminal") == ids_of_type(model, "IfcFlowTerminal")
+
+
+def test_material_wildcards_match_case_insensitively(model):
+    _, index = model
+    primary = index.materials["gru_primar"]
+    steel = index.materials["_gru_str_met_steel.s235"]
+
+    assert select(model, material="GRU_*") == primary
+    assert select(model, material="*gru*") == primary | steel
+    assert select(model, material="gru_prima?") == primary
+
+
+def test_exact_matches_wildcards_literally(model):
+    assert select(model, material="GRU_*", exact=True) == set()
+    assert select(model, material="Gru_Primar", exact=True) == select(model, material="gru_primar")
+
+
+def test_category_and_properties_select_by_value(model):
+    _, index = model
+    categories = index.properties[("sg_eigenschaften_allgemein", "bim-elementkategorie")]
+    l1 = index.properties[("sg_aks_sap", "sg_aks_07")]["l1"]
+    l2 = index.properties[("sg_aks_sap", "sg_aks_07")]["l2"]
+
+    assert select(model, category="Trenner") == categories["trenner"]
+    assert select(model, properties={"SG_AKS_SAP.SG_AKS_07": "L1"}) == l1
+    # Without a property set the property matches in any of them
+    assert select(model, properties={"SG_AKS_07": ["L1", "l2"]}) == l1 | l2
+    assert select(model, properties={"Other.SG_AKS_07": "L1"}) == set()
+
+
+def test_every_criterion_must_match(model):
+    selected = select(model, category="Trenner", properties={"SG_AKS_07": "L1"}, ifcType="IfcFlowController")
+
+    assert selected
+    assert selected == (
+        select(model, category="Trenner") & select(model, properties={"SG_AKS_07": "L1"})
+        & ids_of_type(model, "IfcFlowController")
+    )
+
+
+@pytest.mark.parametrize("rule, message", [
+    ({"ifcType": "IfcWall"}, "color"),
+    ({"ifcType": "IfcWall", "color": "red"}, "color"),
+    ({"ifcType": "IfcWall", "color": 255}, "color"),
+    ({"properties": {1: "x"}, "color": "#FF0000"}, "property name"),
+    ({"properties": {"Pset.": "x"}, "color": "#FF0000"}, "property name"),
+    ({"properties": ["x"], "color": "#FF0000"}, "properties"),
+    ({"material": [], "color": "#FF0000"}, "empty"),
+    ({"color": "#FF0000"}, "at least one"),
+])
+def test_invalid_rules_are_rejected(rule, message):
+    with pytest.raises(RuleError, match=message) as error:
+        compile_rules([{"ifcType": "IfcWall", "color": "#00FF00"}, rule])
+    assert str(error.value).startswith("Rule 1:")
+
+
+def test_invalid_rule_is_a_bad_request(app_module, aps_server):
+    response = app_module.app.test_client().post(
+        "/api/update_ifc", json={**REQUEST, "rules": [{"category": "Trenner", "color": "#12345G"}]}
+    )
+
+    assert response.status_code == 400
+    assert "color" in response.get_json()["error"]
+    assert not aps_server.requests
+
+
+def test_rules_apply_after_guid_groups_and_the_last_rule_wins(app_module, model):
+    ifc_file, index = model
+    trenner = index.properties[("sg_eigenschaften_allgemein", "bim-elementkategorie")]["trenner"]
+    l1 = index.properties[("sg_aks_sap", "sg_aks_07")]["l1"]
+    unmatched = {product.id() for product in ifc_file.by_type("IfcProduct")} - trenner - l1
+    # Elements of both rules, of one rule only, and of none
+    guid_ids = sorted(trenner & l1)[:3] + sorted(trenner - l1)[:3] + sorted(l1 - trenner)[:3] + sorted(unmatched)[:3]
+    guids = [ifc_file.by_id(element_id).GlobalId for element_id in guid_ids]
+    payload = {
+        "elements": [{"ifcGUIDs": guids, "color": "#FF0000"}],
+        "rules": [{"category": "Trenner", "color": "#00FF00"}, {"properties": {"SG_AKS_07": "L1"}, "color": "#0000FF"}],
+    }
+
+    response = app_module.app.test_client().post("/api/update_ifc", json={**REQUEST, **payload})
+
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()["ruleMatches"] == [len(trenner), len(l1)]
+    element_colors = app_module.model_cache.get("p1", "v1").style_snapshot.element_colors
+    expected = {element_id: hex_to_rgb("#FF0000") for element_id in guid_ids}
+    expected.update({element_id: hex_to_rgb("#00FF00") for element_id in trenner})
+    expected.update({element_id: hex_to_rgb("#0000FF") for element_id in l1})
+    assert element_colors == expected
+    assert len(set(expected.values())) == 3
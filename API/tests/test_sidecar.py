@@ -0,0 +1,93 @@
+import os
+import shutil
+
+import pytest
+
+from model_cache import ModelCache
+from sidecar import ModelSidecar
+
+CHECKSUM = "0" * 64
+BUDGET = 1024 * 1024 * 1024
+
+
+def test_indexes_survive_reopen(tmp_path):
+    path = str(tmp_path / "model.sqlite")
+    sidecar = ModelSidecar.open(path, CHECKSUM, 1234)
+    sidecar.add_version("p1", "v1")
+    sidecar.store_guids({"A" * 22: 1, "B" * 22: 2})
+    sidecar.store_adjacency({1: ((10, 11), (2,)), 2: ((), ())})
+    sidecar.store_material_inventory({"Beton": {"#FF0000": 3}, "Holz": {"#00FF00": 1}})
+    sidecar.store_step_offsets([1, 2], [100, 150], 90, 200)
+
+    reopened = ModelSidecar.open(path, CHECKSUM, 1234)
+
+    assert reopened.load_versions() == [("p1", "v1")]
+    assert reopened.load_guids() == {"A" * 22: 1, "B" * 22: 2}
+    assert reopened.load_adjacency() == {1: ((10, 11), (2,)), 2: ((), ())}
+    assert reopened.load_material_inventory() == {"Beton": {"#FF0000": 3}, "Holz": {"#00FF00": 1}}
+    ids, starts, data_start, data_end = reopened.load_step_offsets()
+    assert (list(ids), list(starts), data_start, data_end) == ([1, 2], [100, 150], 90, 200)
+
+
+def test_missing_indexes_are_reported_as_missing(tmp_path):
+    sidecar = ModelSidecar.open(str(tmp_path / "model.sqlite"), CHECKSUM, 1234)
+
+    assert sidecar.load_guids() is None
+    assert sidecar.load_material_inventory() is None
+    assert sidecar.load_step_offsets() is None
+    assert sidecar.load_adjacency() == {}
+
+
+@pytest.mark.parametrize("checksum, file_size", [("1" * 64, 1234), (CHECKSUM, 4321)], ids=["checksum", "size"])
+def test_sidecar_of_other_content_is_rebuilt(tmp_path, checksum, file_size):
+    path = str(tmp_path / "model.sqlite")
+    ModelSidecar.open(path, CHECKSUM, 1234).store_guids({"A" * 22: 1})
+
+    reopened = ModelSidecar.open(path, checksum, file_size)
+
+    assert reopened.load_guids() is None
+
+
+def test_unreadable_sidecar_is_rebuilt(tmp_path):
+    path = tmp_path / "model.sqlite"
+    path.write_bytes(b"not a database")
+
+    sidecar = ModelSidecar.open(str(path), CHECKSUM, 1234)
+
+    assert sidecar.load_guids() is None
+
+
+def download(sample_model, tmp_path):
+    path = str(tmp_path / "download.ifc")
+    shutil.copy(sample_model, path)
+    return path
+
+
+def test_restarted_cache_reopens_versions_with_their_indexes(tmp_path, sample_model):
+    cache_directory = str(tmp_path / "cache")
+    cached_model = ModelCache(cache_directory, BUDGET).put("p1", "v1", download(sample_model, tmp_path))
+    with cached_model.checkout():
+        ids_by_guid = cached_model.get_guid_index().ids_by_guid
+        step_ids = list(cached_model.get_step_index().ids)
+
+    restarted = ModelCache(cache_directory, BUDGET)
+    reopened = restarted.get("p1", "v1")
+
+    assert reopened is not None and reopened.checksum == cached_model.checksum
+    assert reopened.with_sidecar(ModelSidecar.load_guids) == ids_by_guid
+    with reopened.checkout():
+        assert reopened.get_guid_index().ids_by_guid == ids_by_guid
+        assert list(reopened.get_step_index().ids) == step_ids
+
+
+def test_changed_cached_file_is_dropped(tmp_path, sample_model):
+    cache_directory = str(tmp_path / "cache")
+    cached_model = ModelCache(cache_directory, BUDGET).put("p1", "v1", download(sample_model, tmp_path))
+    with open(cached_model.file_path, "ab") as file:
+        file.write(b"/* changed */\n")
+
+    restarted = ModelCache(cache_directory, BUDGET)
+
+    assert restarted.get("p1", "v1") is None
+    assert ("p1", "v1") not in restarted.versions
+    assert not os.path.exists(restarted.sidecar_path(cached_model.checksum))
@@ -0,0 +1,210 @@
+import ifcopenshell
+import pytest
+
+from styles import build_style_cache, build_styled_item_index, purge_styles
+from styling_engine import StylingEngine
+from traversal import TraversalCache
+
+REQUEST = {"versionID": "v1", "projectID": "p1", "accessToken": "token"}
+
+
+def save(app_module, **payload):
+    response = app_module.app.test_client().post("/api/update_ifc", json={**REQUEST, **payload})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+@pytest.mark.parametrize("strategy", ["mapped", "deep", "material"])
+def test_dry_run_predicts_the_save(app_module, monkeypatch, sample_guids, strategy):
+    monkeypatch.setattr(app_module, "diff_saves", False)
+    payload = {
+        "elements": [{"ifcGUIDs": sample_guids[:40], "color": "#FF0000"}, {"ifcGUIDs": sample_guids[30:], "color": "#00FF88"}],
+        "rules": [{"category": "Trenner", "color": "#0000FF"}],
+    }
+
+    dry_run = save(app_module, dryRun=True, **payload)
+    result = save(app_module, strategy=strategy, **payload)
+
+    assert dry_run["status"] == "dryRun"
+    assert dry_run["plans"][strategy]["entitiesCreated"] == result["metrics"]["counters"]["entitiesCreated"]
+    assert dry_run["plans"][strategy]["targets"] == result["restyle"]["targetsRestyled"]
+
+
+def test_unknown_strategy_is_rejected(app_module):
+    response = app_module.app.test_client().post("/api/update_ifc", json={**REQUEST, "strategy": "unknown"})
+
+    assert response.status_code == 400
+
+
+
+def test_material_styling_cannot_apply_changes(sample_model):
+    ifc_file = ifcopenshell.open(sample_model)
+    material_id = ifc_file.by_type("IfcMaterial")[0].id()
+    engine = StylingEngine(ifc_file, "material")
+    engine.apply_changes({}, {material_id: (1.0, 0.0, 0.0)})
+
+    with pytest.raises(ValueError, match="restyle fully"):
+        engine.apply_changes({material_id: (1.0, 0.0, 0.0)}, {})
+
+
+# Copies of the styling helpers app.py had before the styling engine, as the reference for the strategies
+
+
+def legacy_assign_style(ifc_file, item, style):
+    styled_item = None
+    for candidate in ifc_file.by_type("IfcStyledItem"):
+        if candidate.Item == item:
+            styled_item = candidate
+            break
+    if not styled_item:
+        styled_item = ifc_file.create_entity("IfcStyledItem", Item=item, Styles=())
+    styled_item.Styles = (style,)
+
+
+def legacy_surface_style(ifc_file, rgb, name):
+    return ifc_file.create_entity(
+        "IfcSurfaceStyle", Name="ElementColor", Side="BOTH",
+        Styles=[ifc_file.create_entity(
+            "IfcSurfaceStyleRendering",
+            SurfaceColour=ifc_file.create_entity("IfcColourRgb", Name=name, Red=rgb[0], Green=rgb[1], Blue=rgb[2]),
+            Transparency=0.0, ReflectanceMethod="MATT",
+        )],
+    )
+
+
+def legacy_update_element_and_children_colors(ifc_file, root_element, rgb):
+    presentation_style = ifc_file.create_entity(
+        "IfcPresentationStyleAssignment", Styles=[legacy_surface_style(ifc_file, rgb, None)]
+    )
+    visited = set()
+    stack = [root_element]
+    while stack:
+        element = stack.pop()
+        if element.id() in visited:
+            continue
+        visited.add(element.id())
+        if hasattr(element, "Representation") and element.Representation:
+            for shape_representation in element.Representation.Representations:
+                for item in shape_representation.Items:
+                    if item.is_a("IfcMappedItem"):
+                        legacy_assign_style(ifc_file, item, presentation_style)
+        if hasattr(element, "IsDecomposedBy"):
+            for decomposition in element.IsDecomposedBy:
+                stack.extend(decomposition.RelatedObjects)
+        if hasattr(element, "IsDefinedBy"):
+            for definition in element.IsDefinedBy:
+                if definition.is_a("IfcRelDefinesByType"):
+                    stack.extend(definition.RelatedObjects)
+
+
+def legacy_apply_style_to_shape_representation(ifc_file, element, rgb):
+    """The element step of update_element_and_children_colors2."""
+    surface_style = legacy_surface_style(ifc_file, rgb, "Test")
+    if not hasattr(element, "Representation") or not element.Representation:
+        return
+    for shape_representation in element.Representation.Representations:
+        for item in shape_representation.Items:
+            if item.is_a("IfcMappedItem"):
+                for mapped_item in item.MappingSource.MappedRepresentation.Items:
+                    legacy_assign_style(ifc_file, mapped_item, surface_style)
+            else:
+                legacy_assign_style(ifc_file, item, surface_style)
+
+
+def legacy_assign_color_to_material(ifc_file, material, rgb):
+    color_rgb = ifc_file.create_entity("IfcColourRgb", Name="CustomColor", Red=rgb[0], Green=rgb[1], Blue=rgb[2])
+    surface_style_shading = ifc_file.create_entity("IfcSurfaceStyleShading", SurfaceColour=color_rgb)
+    surface_style = ifc_file.create_entity("IfcSurfaceStyle", Side="BOTH", Styles=[surface_style_shading])
+    styled_item = ifc_file.create_entity("IfcStyledItem", Item=None, Styles=[surface_style])
+    ifc_file.create_entity("IfcMaterialDefinitionRepresentation", RepresentedMaterial=material, Representations=[styled_item])
+
+
+def style_color(styles):
+    style = styles[0]
+    if style.is_a("IfcPresentationStyleAssignment"):
+        return style_color(style.Styles)
+    colour = style.Styles[0].SurfaceColour
+    return round(colour.Red, 6), round(colour.Green, 6), round(colour.Blue, 6)
+
+
+def item_colors(ifc_file):
+    return {
+        styled_item.Item.id(): style_color(styled_item.Styles)
+        for styled_item in ifc_file.by_type("IfcStyledItem") if styled_item.Item is not None
+    }
+
+
+def material_colors(ifc_file):
+    colors = {}
+    for material_def_rep in ifc_file.by_type("IfcMaterialDefinitionRepresentation"):
+        for representation in material_def_rep.Representations:
+            styled_items = representation.Items if representation.is_a("IfcStyledRepresentation") else [representation]
+            for styled_item in styled_items:
+                colors[material_def_rep.RepresentedMaterial.id()] = style_color(styled_item.Styles)
+    return colors
+
+
+@pytest.fixture
+def equivalence(sample_model):
+    """Opens unstyled copies of the sample and styles two overlapping color groups with a strategy."""
+    def open_unstyled():
+        ifc_file = ifcopenshell.open(sample_model)
+        purge_styles(ifc_file)
+        return ifc_file
+
+    ifc_file = open_unstyled()
+    product_ids = [product.id() for product in ifc_file.by_type("IfcProduct") if product.Representation]
+    groups = [((1.0, 0.0, 0.0), product_ids[:20:5]), ((0.0, 0.5, 1.0), product_ids[10:70:12])]
+
+    def style(strategy):
+        styled = open_unstyled()
+        engine = StylingEngine(
+            styled, strategy, TraversalCache(), build_styled_item_index(styled), build_style_cache(styled)
+        )
+        for rgb, root_ids in groups:
+            engine.style_group(root_ids, rgb)
+        return styled, engine
+
+    return open_unstyled, groups, style
+
+
+def test_mapped_strategy_matches_the_legacy_helper(equivalence):
+    open_unstyled, groups, style = equivalence
+    legacy = open_unstyled()
+    for rgb, root_ids in groups:
+        for root_id in root_ids:
+            legacy_update_element_and_children_colors(legacy, legacy.by_id(root_id), rgb)
+
+    styled, _ = style("mapped")
+
+    assert item_colors(legacy)
+    assert item_colors(styled) == item_colors(legacy)
+
+
+def test_deep_strategy_matches_the_legacy_helper(equivalence):
+    # update_element_and_children_colors2 recursed through type relations without a visited set, which never
+    # ends for typed elements, so its element step is driven over the elements the recolor walk reaches
+    open_unstyled, groups, style = equivalence
+    legacy = open_unstyled()
+    traversal_cache = TraversalCache()
+    for rgb, root_ids in groups:
+        for element_id in traversal_cache.reachable_elements(legacy, root_ids):
+            legacy_apply_style_to_shape_representation(legacy, legacy.by_id(element_id), rgb)
+
+    styled, _ = style("deep")
+
+    assert item_colors(legacy)
+    assert item_colors(styled) == item_colors(legacy)
+
+
+def test_material_strategy_matches_the_legacy_helper(equivalence):
+    open_unstyled, groups, style = equivalence
+    styled, engine = style("material")
+
+    legacy = open_unstyled()
+    for rgb, root_ids in groups:
+        for material_id in engine.strategy.targets(engine, root_ids):
+            legacy_assign_color_to_material(legacy, legacy.by_id(material_id), rgb)
+
+    assert material_colors(legacy)
+    assert material_colors(styled) == material_colors(legacy)
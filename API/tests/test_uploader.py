@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+import uploader
+from aps_client import ApsClient
+from jobs import JobProgress
+from mock_aps import BUCKET_KEY
+from uploader import MIN_PART_SIZE, MultipartUploadError, MultipartUploadStream, upload_file_multipart
+
+OBJECT_KEY = "upload.ifc"
+STORAGE_ID = f"urn:adsk.objects:os.object:{BUCKET_KEY}/{OBJECT_KEY}"
+PART_PATH = r"/s3-upload/[^/]+/{}"
+
+
+@pytest.fixture
+def aps(monkeypatch):
+    """APS client without backoff delays."""
+    monkeypatch.setattr(uploader.time, "sleep", lambda seconds: None)
+    return ApsClient(backoff_seconds=0)
+
+
+@pytest.fixture
+def upload_file(tmp_path):
+    """A file of two full parts and a short third one."""
+    path = tmp_path / "output.ifc"
+    path.write_bytes(os.urandom(2 * MIN_PART_SIZE + 1234))
+    return str(path)
+
+
+def read(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def part_puts(aps_server, part):
+    return [path for method, path in aps_server.requests if method == "PUT" and path.endswith(f"/{part}")]
+
+
+def test_upload_completes_with_every_part(aps_server, aps, upload_file):
+    progress = JobProgress()
+
+    result = upload_file_multipart(aps, "token", STORAGE_ID, upload_file, part_size=MIN_PART_SIZE, progress=progress)
+
+    assert result["size"] == os.path.getsize(upload_file)
+    assert aps_server.objects[OBJECT_KEY] == read(upload_file)
+    assert progress.snapshot()["stages"]["upload"] == {"done": result["size"], "total": result["size"]}
+
+
+def test_failed_part_is_retried(aps_server, aps, upload_file):
+    aps_server.fail("PUT", PART_PATH.format(2), 500)
+
+    upload_file_multipart(aps, "token", STORAGE_ID, upload_file, part_size=MIN_PART_SIZE)
+
+    assert len(part_puts(aps_server, 2)) == 2
+    assert len(part_puts(aps_server, 1)) == 1
+    assert aps_server.objects[OBJECT_KEY] == read(upload_file)
+
+
+def test_resumed_upload_only_sends_the_missing_parts(aps_server, aps, upload_file):
+    aps_server.fail("PUT", PART_PATH.format(3), *[500] * 100)
+    with pytest.raises(MultipartUploadError) as error:
+        upload_file_multipart(aps, "token", STORAGE_ID, upload_file, part_size=MIN_PART_SIZE)
+    state = error.value.state
+    assert state.missing_parts() == [3]
+    # Retried by put_part alone, not again by the client
+    assert len(part_puts(aps_server, 3)) == uploader.DEFAULT_MAX_RETRIES + 1
+    assert OBJECT_KEY not in aps_server.objects
+
+    aps_server.failures.clear()
+    aps_server.requests.clear()
+    upload_file_multipart(aps, "token", STORAGE_ID, upload_file, part_size=MIN_PART_SIZE, state=state)
+
+    assert [path for method, path in aps_server.requests if method == "PUT"] == [f"/s3-upload/{state.upload_key}/3"]
+    assert aps_server.objects[OBJECT_KEY] == read(upload_file)
+
+
+def test_incomplete_upload_is_not_completed(aps_server, aps, upload_file):
+    aps_server.fail("POST", r"/oss/v2/buckets/.*/signeds3upload", 400)
+
+    with pytest.raises(MultipartUploadError, match="complete"):
+        upload_file_multipart(aps, "token", STORAGE_ID, upload_file, part_size=MIN_PART_SIZE)
+    assert OBJECT_KEY not in aps_server.objects
+
+
+def test_streamed_upload_completes(aps_server, aps, upload_file):
+    content = read(upload_file)
+    stream = MultipartUploadStream(aps, "token", STORAGE_ID, part_size=MIN_PART_SIZE)
+
+    for position in range(0, len(content), 1024 * 1024):
+        stream.write(content[position:position + 1024 * 1024])
+    result = stream.finish()
+
+    assert result["size"] == len(content)
+    assert stream.state.part_count == 3
+    assert aps_server.objects[OBJECT_KEY] == content
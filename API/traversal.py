@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+
+
+class TraversalCache:
+    """
+    Memoized form of the recolor walk of the styling engine, kept per model.
+    For every visited element it stores the IfcMappedItems of its representation and the elements
+    the walk continues to (decomposition children and objects sharing its type), as STEP ids.
+    Mapped-item sets for whole color groups are memoized too, since saves tend to resend the same rows.
+    """
+
+    def __init__(self, max_group_entries=256, adjacency=None):
+        self.adjacency = adjacency if adjacency is not None else {}  # element id -> (mapped item ids, next element ids)
+        self.new_adjacency = {}  # entries added since the last take_new_adjacency()
+        self.group_closures = OrderedDict()  # frozenset of root ids -> frozenset of mapped item ids
+        self.max_group_entries = max_group_entries
+        self.lock = threading.Lock()
+
+    def neighbors(self, element):
+        entry = self.adjacency.get(element.id())
+        if entry is not None:
+            return entry
+
+        mapped_item_ids = []
+        if hasattr(element, "Representation") and element.Representation:
+            for shape_representation in element.Representation.Representations:
+                for item in shape_representation.Items:
+                    if item.is_a("IfcMappedItem"):
+                        mapped_item_ids.append(item.id())
+
+        next_ids = []
+        # Add children via decomposition
+        if hasattr(element, "IsDecomposedBy"):
+            for decomposition in element.IsDecomposedBy:
+                next_ids.extend(related.id() for related in decomposition.RelatedObjects)
+        # Add related objects defined by type
+        if hasattr(element, "IsDefinedBy"):
+            for definition in element.IsDefinedBy:
+                if definition.is_a("IfcRelDefinesByType"):
+                    next_ids.extend(related.id() for related in definition.RelatedObjects)
+
+        entry = (tuple(mapped_item_ids), tuple(next_ids))
+        self.adjacency[element.id()] = entry
+        self.new_adjacency[element.id()] = entry
+        return entry
+
+    def take_new_adjacency(self):
+        """Returns and forgets the adjacency entries added since the last call, e.g. to persist them."""
+        with self.lock:
+            new_adjacency, self.new_adjacency = self.new_adjacency, {}
+            return new_adjacency
+
+    def store_closure(self, key, closure):
+        self.group_closures[key] = closure
+        self.group_closures.move_to_end(key)
+        while len(self.group_closures) > self.max_group_entries:
+            self.group_closures.popitem(last=False)
+
+    def mapped_items_for_roots(self, ifc_file, root_ids):
+        """
+        Returns the ids of all IfcMappedItems reachable from any of the roots.
+        One walk with a shared visited set covers the whole group, so siblings sharing a type
+        or a parent are expanded only once.
+        """
+        key = frozenset(root_ids)
+        with self.lock:
+            closure = self.group_closures.get(key)
+            if closure is not None:
+                self.group_closures.move_to_end(key)
+                return closure
+
+            mapped_item_ids = set()
+            for element_id in self.walk(ifc_file, key):
+                mapped_item_ids.update(self.adjacency[element_id][0])
+
+            closure = frozenset(mapped_item_ids)
+            self.store_closure(key, closure)
+            return closure
+
+    def reachable_elements(self, ifc_file, root_ids):
+        """
+        Returns the ids of all elements the walk reaches from the roots, the roots included.
+        """
+        with self.lock:
+            return frozenset(self.walk(ifc_file, root_ids))
+
+    def walk(self, ifc_file, root_ids):
+        """
+        Iterative walk over decomposition children and objects sharing a type. Must be called with self.lock held.
+        """
+        visited = set()
+        stack = list(root_ids)
+        while stack:
+            element_id = stack.pop()
+            if element_id in visited:
+                continue
+            visited.add(element_id)
+
+            _, next_ids = self.neighbors(ifc_file.by_id(element_id))
+            stack.extend(next_id for next_id in next_ids if next_id not in visited)
+        return visited
@@ -0,0 +1,281 @@
+import logging
+import math
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from aps_client import APS_BASE_URL
+
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+MAX_URLS_PER_REQUEST = 25  # OSS limit for signeds3upload
+DEFAULT_PARALLELISM = 4
+DEFAULT_MAX_RETRIES = 3
+
+
+class MultipartUploadState:
+    """
+    Upload key and completed parts of one OSS multipart upload.
+    Passing it back into upload_file_multipart resumes the upload and only sends the missing parts.
+    """
+
+    def __init__(self, bucket_key, object_key, part_size, part_count):
+        self.bucket_key = bucket_key
+        self.object_key = object_key
+        self.part_size = part_size
+        self.part_count = part_count
+        self.upload_key = None
+        self.etags = {}  # part number -> ETag
+        self.lock = threading.Lock()
+
+    def missing_parts(self):
+        return [part for part in range(1, self.part_count + 1) if part not in self.etags]
+
+
+class MultipartUploadError(Exception):
+    def __init__(self, message, state):
+        super().__init__(message)
+        self.state = state
+
+
+def parse_storage_id(storage_id):
+    """
+    Splits an OSS object URN ("urn:adsk.objects:os.object:<bucket>/<object>") into bucket and object key.
+    """
+    bucket_key, object_key = storage_id.split(":")[-1].split("/", 1)
+    return bucket_key, object_key
+
+
+def signeds3upload_url(bucket_key, object_key):
+    return (
+        f"{APS_BASE_URL}/oss/v2/buckets/{urllib.parse.quote(bucket_key, safe='')}"
+        f"/objects/{urllib.parse.quote(object_key, safe='')}/signeds3upload"
+    )
+
+
+def request_part_urls(aps_client, access_token, state, first_part, parts):
+    """
+    Gets signed S3 URLs for parts first_part .. first_part + parts - 1 and records the upload key.
+    Signing holds state.lock, so retries in upload threads and new batches share one upload key.
+    """
+    with state.lock:
+        params = {"firstPart": first_part, "parts": parts, "minutesExpiration": 60}
+        if state.upload_key:
+            params["uploadKey"] = state.upload_key
+        response = aps_client.get(
+            signeds3upload_url(state.bucket_key, state.object_key),
+            headers={"Authorization": f"Bearer {access_token}"},
+            params=params,
+        )
+        if response.status_code != 200:
+            raise Exception(f"Failed to get signed upload URLs: {response.status_code} - {response.text}")
+
+        data = response.json()
+        state.upload_key = data["uploadKey"]
+    return dict(zip(range(first_part, first_part + parts), data["urls"]))
+
+
+def part_length(state, file_size, part):
+    return min(state.part_size, file_size - (part - 1) * state.part_size)
+
+
+def put_part(aps_client, access_token, state, part, data, url, max_retries):
+    """
+    PUTs one part to its signed URL, retrying with a freshly signed URL, and records its ETag.
+    The part is retried here only; the client sends each PUT once.
+    """
+    for attempt in range(max_retries + 1):
+        response = None
+        try:
+            response = aps_client.request(
+                "PUT", url, retry=False, data=data, headers={"Content-Type": "application/octet-stream"}
+            )
+            if response.status_code in (200, 201):
+                with state.lock:
+                    state.etags[part] = response.headers.get("ETag", "").strip('"')
+                return
+            failure = f"{response.status_code} - {response.text}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            failure = str(e)
+        if attempt == max_retries:
+            raise Exception(f"Part {part} failed: {failure}")
+        delay = aps_client.retry_delay(attempt, response)
+        logging.warning(f"Upload of part {part} failed ({failure}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+        # Signed URLs expire, so every retry gets a new one
+        url = request_part_urls(aps_client, access_token, state, part, 1)[part]
+
+
+def complete_upload(aps_client, access_token, state, size):
+    """
+    Completes a multipart upload whose parts are all confirmed. Returns the completion response JSON.
+    """
+    response = aps_client.post(
+        signeds3upload_url(state.bucket_key, state.object_key),
+        headers={"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"},
+        json={
+            "uploadKey": state.upload_key,
+            "size": size,
+            "eTags": [state.etags[part] for part in range(1, state.part_count + 1)],
+        },
+    )
+    if response.status_code != 200:
+        raise MultipartUploadError(
+            f"Failed to complete multipart upload: {response.status_code} - {response.text}", state
+        )
+    return response.json()
+
+
+def upload_file_multipart(aps_client, access_token, storage_id, file_path, part_size=DEFAULT_PART_SIZE,
+                          parallelism=DEFAULT_PARALLELISM, max_retries=DEFAULT_MAX_RETRIES, progress=None, state=None):
+    """
+    Uploads a file to an OSS object with the signed S3 multipart flow.
+    Parts are sent in parallel and retried on their own, with a freshly signed URL for every retry.
+    The upload is only completed once every part is confirmed; otherwise MultipartUploadError carries
+    the state needed to resume. Returns the completion response JSON.
+    """
+    file_size = os.path.getsize(file_path)
+    part_size = max(part_size, MIN_PART_SIZE)
+
+    if state is None:
+        bucket_key, object_key = parse_storage_id(storage_id)
+        state = MultipartUploadState(bucket_key, object_key, part_size, max(1, math.ceil(file_size / part_size)))
+
+    missing_parts = state.missing_parts()
+    if progress:
+        progress.start("upload", file_size)
+        progress.advance("upload", file_size - sum(part_length(state, file_size, part) for part in missing_parts))
+
+    # Sign URLs for the missing parts in batches of up to 25 consecutive parts
+    part_urls = {}
+    batch_start = 0
+    while batch_start < len(missing_parts):
+        first_part = missing_parts[batch_start]
+        parts = 1
+        while (batch_start + parts < len(missing_parts) and parts < MAX_URLS_PER_REQUEST
+               and missing_parts[batch_start + parts] == first_part + parts):
+            parts += 1
+        part_urls.update(request_part_urls(aps_client, access_token, state, first_part, parts))
+        batch_start += parts
+
+    def upload_part(part):
+        length = part_length(state, file_size, part)
+        with open(file_path, "rb") as file:
+            file.seek((part - 1) * state.part_size)
+            data = file.read(length)
+
+        put_part(aps_client, access_token, state, part, data, part_urls[part], max_retries)
+        if progress:
+            progress.advance("upload", length)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="ifc-upload") as executor:
+        futures = {part: executor.submit(upload_part, part) for part in missing_parts}
+    failures = {part: future.exception() for part, future in futures.items() if future.exception()}
+    if failures:
+        raise MultipartUploadError(
+            f"{len(failures)} of {state.part_count} parts failed, first error: {next(iter(failures.values()))}",
+            state,
+        )
+
+    # Every part is confirmed: complete the upload
+    result = complete_upload(aps_client, access_token, state, file_size)
+
+    elapsed = time.perf_counter() - start_time
+    logging.info(f"Uploaded {file_size} bytes in {state.part_count} parts in {elapsed:.2f}s")
+    return result
+
+
+class MultipartUploadStream:
+    """
+    Sink for export_to_sink that uploads what is written to an OSS object with the signed S3 multipart flow,
+    without a local file. Writes are cut into parts of part_size; full parts are uploaded in the background,
+    and write() blocks while `parallelism` parts are in flight, so at most about (parallelism + 1) parts
+    are held in memory. The size isn't known up front, so part URLs are signed in batches as parts fill up.
+    There is no file to resend from: a part that still fails after its retries fails the whole upload.
+    """
+
+    def __init__(self, aps_client, access_token, storage_id, part_size=DEFAULT_PART_SIZE,
+                 parallelism=DEFAULT_PARALLELISM, max_retries=DEFAULT_MAX_RETRIES, progress=None):
+        bucket_key, object_key = parse_storage_id(storage_id)
+        self.aps_client = aps_client
+        self.access_token = access_token
+        self.state = MultipartUploadState(bucket_key, object_key, max(part_size, MIN_PART_SIZE), 0)
+        self.max_retries = max_retries
+        self.progress = progress
+        self.buffer = bytearray()
+        self.size = 0
+        self.part_urls = {}
+        self.slots = threading.BoundedSemaphore(parallelism)
+        self.executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="ifc-upload")
+        self.futures = {}
+        self.start_time = time.perf_counter()
+        if progress:
+            progress.start("upload")
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.state.part_size:
+            part_data = bytes(self.buffer[:self.state.part_size])
+            del self.buffer[:self.state.part_size]
+            self.submit_part(part_data)
+        return len(data)
+
+    def submit_part(self, data):
+        self.raise_failures()
+        self.state.part_count += 1
+        part = self.state.part_count
+        if part not in self.part_urls:
+            self.part_urls.update(
+                request_part_urls(self.aps_client, self.access_token, self.state, part, MAX_URLS_PER_REQUEST)
+            )
+
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self.upload_part, part, data)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures[part] = future
+        self.size += len(data)
+
+    def upload_part(self, part, data):
+        put_part(self.aps_client, self.access_token, self.state, part, data, self.part_urls[part], self.max_retries)
+        if self.progress:
+            self.progress.advance("upload", len(data))
+
+    def raise_failures(self):
+        failures = {part: future.exception() for part, future in self.futures.items() if future.done() and future.exception()}
+        if failures:
+            raise MultipartUploadError(
+                f"{len(failures)} parts failed, first error: {next(iter(failures.values()))}", self.state
+            )
+
+    def finish(self):
+        """
+        Uploads the buffered rest as the last part, waits for every part and completes the upload.
+        Returns the completion response JSON.
+        """
+        if self.buffer or not self.state.part_count:
+            self.submit_part(bytes(self.buffer))
+            self.buffer.clear()
+        self.executor.shutdown(wait=True)
+        self.raise_failures()
+        if self.progress:
+            self.progress.set_total("upload", self.size)
+
+        result = complete_upload(self.aps_client, self.access_token, self.state, self.size)
+        logging.info(
+            f"Streamed {self.size} bytes in {self.state.part_count} parts in {time.perf_counter() - self.start_time:.2f}s"
+        )
+        return result
+
+    def abort(self):
+        """Drops the buffered bytes and the parts not yet sent. OSS discards uncompleted uploads."""
+        self.buffer.clear()
+        self.executor.shutdown(wait=True, cancel_futures=True)
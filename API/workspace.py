@@ -0,0 +1,51 @@
+import logging
+import os
+import shutil
+import uuid
+
+
+class WorkspaceQuotaExceeded(Exception):
+    pass
+
+
+class Workspace:
+    """
+    A private temp directory for one request or job, so concurrent saves never share file paths.
+    Use as a context manager: the directory is created on enter and removed on exit unless keep is set.
+    """
+
+    def __init__(self, root_directory, quota_bytes, keep=False):
+        self.directory = os.path.join(root_directory, uuid.uuid4().hex)
+        self.quota_bytes = quota_bytes
+        self.keep = keep
+
+    def __enter__(self):
+        os.makedirs(self.directory)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.keep:
+            logging.info(f"Keeping workspace {self.directory}")
+        else:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        return False
+
+    def path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def used_bytes(self):
+        total = 0
+        for directory, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                total += os.path.getsize(os.path.join(directory, file_name))
+        return total
+
+    def check_quota(self, extra_bytes=0):
+        """
+        Raises WorkspaceQuotaExceeded if the workspace plus extra_bytes is over its quota.
+        """
+        used = self.used_bytes() + extra_bytes
+        if used > self.quota_bytes:
+            raise WorkspaceQuotaExceeded(
+                f"Workspace quota exceeded: {used} bytes used, {self.quota_bytes} allowed"
+            )
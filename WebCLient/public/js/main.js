@@ -33,6 +33,9 @@ const gridOptions = {
     onSelectionChanged: handleSelectionChanged, // Handle row selection
 };
 const API_URL = 'http://localhost:8001/api';
+// Send categories whose rows share one color as server-side rules instead of GUID lists.
+// Rules also match elements the grid never listed, e.g. ones whose category only exists in the IFC.
+const SAVE_CATEGORIES_AS_RULES = false;
 const login = document.getElementById('autodeskSigninButton');
 let viewer;
 let gridApi;
@@ -152,35 +155,62 @@ async function handleSave(event) {
     const rowData = [];
     gridApi.forEachNode((node) => rowData.push(node.data));
 
-    const elementsToUpdate = rowData.map((row) => {
-        const ifcGUIDs = row.dbIds.map((dbId) => dbIdToIfcGUIDMap[dbId]).filter(Boolean);
-        return {
-            ifcGUIDs, // Send IFC GUIDs instead of dbIds
-            color: row.farbe, // Assuming `farbe` is the updated hex color
-        };
+    // With SAVE_CATEGORIES_AS_RULES, categories whose rows all share one color are sent as a rule
+    // the server matches itself; the category is matched literally, so "*" and "?" in names aren't wildcards
+    const colorsByCategory = new Map();
+    rowData.forEach((row) => {
+        if (!colorsByCategory.has(row.kategorie)) colorsByCategory.set(row.kategorie, new Set());
+        colorsByCategory.get(row.kategorie).add(row.farbe);
     });
 
-    // Send the data to the backend
+    const rules = [];
+    if (SAVE_CATEGORIES_AS_RULES) {
+        colorsByCategory.forEach((colors, category) => {
+            if (colors.size === 1) {
+                rules.push({ category, exact: true, color: [...colors][0] });
+            }
+        });
+    }
+
+    const elementsToUpdate = rowData
+        .filter((row) => !SAVE_CATEGORIES_AS_RULES || colorsByCategory.get(row.kategorie).size > 1)
+        .map((row) => {
+            const ifcGUIDs = row.dbIds.map((dbId) => dbIdToIfcGUIDMap[dbId]).filter(Boolean);
+            return {
+                ifcGUIDs, // Send IFC GUIDs instead of dbIds
+                color: row.farbe, // Assuming `farbe` is the updated hex color
+            };
+        });
+
+    // Send the data to the backend as a background job, packed and compressed
     try {
-        const response = await fetch(`${API_URL}/update_ifc`, {
+        const { body, headers } = await encodeUpdatePayload({
+            versionID,
+            projectID,
+            ...packElements(elementsToUpdate),
+            rules,
+            accessToken,
+        });
+        const response = await fetch(`${API_URL}/update_ifc/jobs`, {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                versionID,
-                projectID,
-                elements: elementsToUpdate,
-                accessToken,
-            }),
+            headers,
+            body,
         });
 
-        if (response.ok) {
-            const result = await response.json();
-            console.log("Save successful:", result);
+        if (!response.ok) {
+            console.error("Save failed:", response.statusText);
+            alert("Failed to save changes.");
+            return;
+        }
+
+        const { jobId } = await response.json();
+        const job = await pollSaveJob(jobId);
+
+        if (job.status === 'succeeded') {
+            console.log("Save successful:", job.result);
             alert("Changes saved successfully.");
         } else {
-            console.error("Save failed:", response.statusText);
+            console.error("Save failed:", job.error);
             alert("Failed to save changes.");
         }
     } catch (err) {
@@ -189,6 +219,71 @@ async function handleSave(event) {
     }
 }
 
+// Pack color groups as a palette plus one concatenated GUID string and one uint16 palette index per GUID
+function packElements(elements) {
+    const palette = [];
+    const paletteIndex = new Map();
+    const guids = [];
+    const colorIndices = [];
+
+    elements.forEach(({ ifcGUIDs, color }) => {
+        if (!paletteIndex.has(color)) {
+            paletteIndex.set(color, palette.length);
+            palette.push(color);
+        }
+        ifcGUIDs.forEach((guid) => {
+            guids.push(guid);
+            colorIndices.push(paletteIndex.get(color));
+        });
+    });
+
+    // Uint16Array uses the platform byte order, which is little-endian in all browsers we support
+    const colorBytes = new Uint8Array(new Uint16Array(colorIndices).buffer);
+    let binary = '';
+    for (let i = 0; i < colorBytes.length; i += 0x8000) {
+        binary += String.fromCharCode(...colorBytes.subarray(i, i + 0x8000));
+    }
+
+    return { format: 'packed', palette, guids: guids.join(''), colors: btoa(binary) };
+}
+
+// Gzip the JSON body where the browser supports CompressionStream
+async function encodeUpdatePayload(payload) {
+    const json = JSON.stringify(payload);
+    if (typeof CompressionStream === 'undefined') {
+        return { body: json, headers: { 'Content-Type': 'application/json' } };
+    }
+
+    const stream = new Blob([json]).stream().pipeThrough(new CompressionStream('gzip'));
+    return {
+        body: await new Response(stream).blob(),
+        headers: { 'Content-Type': 'application/json', 'Content-Encoding': 'gzip' },
+    };
+}
+
+// Poll a save job until it finishes, logging the progress of the current stage
+async function pollSaveJob(jobId, intervalMs = 1000) {
+    while (true) {
+        const response = await fetch(`${API_URL}/jobs/${jobId}`);
+        if (!response.ok) {
+            throw new Error(`Could not get status of job ${jobId}: ${response.statusText}`);
+        }
+
+        const job = await response.json();
+        if (job.status === 'succeeded' || job.status === 'failed') {
+            return job;
+        }
+
+        const { currentStage, stages } = job.progress;
+        if (currentStage) {
+            const { done, total } = stages[currentStage];
+            console.log(`Saving: ${currentStage} ${done}${total ? ` / ${total}` : ''}`);
+        }
+
+        await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+}
+
 
 async function handleFileSelect(event) {
     const fileInput = event.target;